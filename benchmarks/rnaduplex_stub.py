@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-in for RNAduplex, used by the benchmarks.
+
+Reads the same FASTA-like stream the pipeline feeds RNAduplex (a header line followed by
+the mRNA and the miRNA sequence) and prints one duplex per pair in RNAduplex's output
+format. The structure and energy are derived from a CRC32 of the two sequences, so the
+output is identical on every machine and the downstream parsing and feature code sees
+realistic input without ViennaRNA being installed.
+"""
+import sys
+import zlib
+
+
+def fake_duplex(mrna, mirna):
+    h = zlib.crc32(f"{mrna}&{mirna}".encode())
+    length = min(6 + h % 12, len(mrna), len(mirna))
+    mrna_start = 1 + (h >> 8) % (len(mrna) - length + 1)
+    mirna_start = 1 + (h >> 16) % (len(mirna) - length + 1)
+    energy = -(length * 1.1 + ((h >> 24) % 10) / 10)
+    return (f"{'(' * length}&{')' * length}   "
+            f"{mrna_start},{mrna_start + length - 1}  :   "
+            f"{mirna_start},{mirna_start + length - 1}  ({energy:5.2f})")
+
+
+def main():
+    header = None
+    sequences = []
+    out = sys.stdout
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(">"):
+            header, sequences = line, []
+            continue
+        sequences.append(line)
+        if header is not None and len(sequences) == 2:
+            out.write(f"{header}\n{fake_duplex(*sequences)}\n")
+            header = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Stage-level and end-to-end benchmarks of the pipeline on synthetic data.
+
+A toy reference and a synthetic VCF are generated under the work directory and RNAduplex
+is replaced by benchmarks/rnaduplex_stub.py, so the suite runs on any machine. Every stage
+is timed on its own (and, unless --no-memory is given, run a second time under tracemalloc
+for its peak memory), then run_pipeline is timed end to end. --worker-memory also measures
+the memory of process workers with and without the shared reference store.
+
+Usage:
+    python -m benchmarks.run_benchmarks --variants 500 --save benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --variants 500 --compare benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --variants 100 --no-memory --worker-memory -w 4
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+import tracemalloc
+
+from benchmarks.synthetic_data import generate_synthetic_vcf, make_toy_reference
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RNADUPLEX_STUB = os.path.join(BENCHMARK_DIR, "rnaduplex_stub.py")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipeline stages on a synthetic VCF.')
+    parser.add_argument('-n', '--variants', default=200, type=int,
+                        help='Number of variants in the synthetic VCF')
+    parser.add_argument('--indel-fraction', default=0.1, type=float,
+                        help='Share of insertions and deletions among the variants')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed for the toy reference and the synthetic VCF')
+    parser.add_argument('-c', '--chunksize', default=100, type=int,
+                        help='Chunk size of the end-to-end run')
+    parser.add_argument('-w', '--workers', default=os.cpu_count(), type=int,
+                        help='Workers of the end-to-end run')
+    parser.add_argument('--work-dir', default=os.path.join(BENCHMARK_DIR, "work"), type=str,
+                        help='Directory for the toy reference, the VCF and the outputs')
+    parser.add_argument('--real-rnaduplex', action='store_true',
+                        help='Use the real RNAduplex instead of the deterministic stub')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Skip the tracemalloc pass that measures peak memory')
+    parser.add_argument('--worker-memory', action='store_true',
+                        help='Also measure the memory of process workers with and without the shared reference store')
+    parser.add_argument('--bed-intervals', default=1_000_000, type=int,
+                        help='Intervals of the synthetic pre-filter BED of --worker-memory')
+    parser.add_argument('--save', type=str, default=None,
+                        help='Write the measurements to this JSON file')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Compare the measurements with a baseline JSON file')
+    parser.add_argument('--tolerance', default=0.1, type=float,
+                        help='Relative slowdown reported as a regression in --compare')
+
+    return parser.parse_args()
+
+
+def clear_caches():
+    """
+    Empty the memoization caches so every measured stage starts cold.
+    """
+    from scripts.utils import sequence_utils
+    from scripts.pipeline_steps import step3
+
+    for module in (sequence_utils, step3):
+        for obj in vars(module).values():
+            if callable(getattr(obj, "cache_clear", None)):
+                obj.cache_clear()
+
+
+def measure(results, stage, func, rows, track_memory=True):
+    """
+    Run func once for timing and, if requested, once more under tracemalloc for peak memory.
+
+    func must not modify its inputs in place (pass copies), since it may run twice.
+
+    Returns:
+        The return value of the timed run.
+    """
+    clear_caches()
+    start = time.perf_counter()
+    output = func()
+    seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if track_memory:
+        clear_caches()
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb = peak / (1024 ** 2)
+
+    results[stage] = {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else None,
+        "peak_mb": peak_mb,
+    }
+    print(f"{stage:<52} {rows:>9} rows {seconds:>9.3f} s"
+          + (f" {peak_mb:>9.1f} MB" if peak_mb is not None else ""))
+    return output
+
+
+def benchmark_stages(vcf_path, work_dir, track_memory):
+    """
+    Time every stage of steps 1 to 5 in isolation, feeding each the output of the previous one.
+
+    Returns:
+        dict: Stage name mapped to rows, seconds, rows per second and peak memory.
+    """
+    import pandas as pd
+    from scripts.config import PipelineConfig
+    from scripts.globals import MUTSIG_PROBABILITIES_560
+    from scripts.pipeline_orchestration import (compute_chunk_features, fold_in_memory,
+                                                prediction_feature_steps)
+    from scripts.pipeline_steps import step1, step2, step3, step4, step5
+
+    results = {}
+    stage_dir = os.path.join(work_dir, "stages")
+    os.makedirs(stage_dir, exist_ok=True)
+
+    variants = pd.read_csv(vcf_path, sep="\t", header=None, names=["chr", "pos", "id", "ref", "alt"])
+    df = variants.copy()
+    df['id'] = (df['id'].astype(str) + '_' + df['chr'].astype(str) + '_' + df['pos'].astype(str)
+                + '_' + df['ref'] + '_' + df['alt'])
+
+    # step 1
+    report_path = os.path.join(stage_dir, "invalid_rows.csv")
+    df = measure(results, "step1.validate_ref_nucleotides_sharded",
+                 lambda: step1.validate_ref_nucleotides_sharded(df.copy(), report_path),
+                 len(df), track_memory)
+    df = measure(results, "step1.generate_is_mirna_column",
+                 lambda: step1.generate_is_mirna_column(df.copy(), grch=37), len(df), track_memory)
+    df = measure(results, "step1.add_sequence_columns",
+                 lambda: step1.add_sequence_columns(df.copy()), len(df), track_memory)
+
+    # step 2
+    fasta_file = os.path.join(stage_dir, "pairs.fa")
+    rnaduplex_file = os.path.join(stage_dir, "rnad.csv")
+    case_1 = step2.classify_and_get_case_1_mutations(df, "bench", 0, len(df), stage_dir)
+    measure(results, "step2.prepare_job_fastas_sharded",
+            lambda: step2.prepare_job_fastas_sharded(case_1, fasta_file), len(case_1), track_memory)
+    measure(results, "step2.run_rnaduplex_and_awk_sharded",
+            lambda: step2.run_rnaduplex_and_awk_sharded(fasta_file, rnaduplex_file),
+            len(case_1), track_memory)
+
+    # step 3, in the order analysis_pipeline runs the feature functions
+    df = measure(results, "step3.process_rnaduplex_output",
+                 lambda: step3.process_rnaduplex_output(rnaduplex_file), len(case_1), track_memory)
+    for name, func in prediction_feature_steps():
+        df = measure(results, f"step3.{name}", lambda: func(df.copy()), len(df), track_memory)
+
+    # steps 1 to 3 as process_chunk and the API run them, folding through pipes
+    measure(results, "pipeline.compute_chunk_features",
+            lambda: compute_chunk_features(variants.copy(), PipelineConfig(), fold_in_memory),
+            len(variants), track_memory)
+
+    # step 4
+    features, id_array, binary_array = step4.reorder_columns_for_prediction(df.copy())
+    predictions = measure(results, "step4.make_predictions_with_xgb",
+                          lambda: step4.make_predictions_with_xgb(features), len(features), track_memory)
+    pairs = measure(results, "step4.create_results_df",
+                    lambda: step4.create_results_df(id_array, predictions, binary_array, filter_range=0),
+                    len(predictions), track_memory)
+    pairs = pairs.drop(columns=["binary_array"]).reset_index(drop=True)
+
+    # step 5 (the pyensembl annotation is left out, it needs the Ensembl cache)
+    measure(results, "step5.filter_rows_with_same_prediction",
+            lambda: step5.filter_rows_with_same_prediction(pairs.copy()), len(pairs), track_memory)
+    # the remaining functions get every pair so that they have something to chew on
+    pairs = measure(results, "step5.split_id_column",
+                    lambda: step5.split_id_column(pairs.copy()), len(pairs), track_memory)
+    snvs = pairs[(pairs['ref'].str.len() == 1) & (pairs['alt'].str.len() == 1)].reset_index(drop=True)
+    snvs = measure(results, "step5.generate_mutation_context_column",
+                   lambda: step5.generate_mutation_context_column(snvs.copy()), len(snvs), track_memory)
+    measure(results, "step5.add_mutsig_probabilities",
+            lambda: step5.add_mutsig_probabilities(snvs.copy(), MUTSIG_PROBABILITIES_560),
+            len(snvs), track_memory)
+
+    return results
+
+
+def benchmark_end_to_end(vcf_path, work_dir, chunksize, workers, track_memory):
+    """
+    Time run_pipeline on the whole VCF with the thread executor.
+
+    Returns:
+        dict: Rows, seconds, rows per second, peak memory and the run report stage totals.
+    """
+    from scripts.config import PipelineConfig
+    from scripts.main_operations import run_pipeline
+
+    rows = sum(1 for _ in open(vcf_path))
+    config = PipelineConfig(vcf_full_path=vcf_path, chunksize=chunksize, workers=workers,
+                            output_root=os.path.join(work_dir, "end_to_end"))
+
+    def run():
+        shutil.rmtree(config.output_dir, ignore_errors=True)
+        os.makedirs(config.output_dir)
+        return run_pipeline(config)
+
+    results = {}
+    report = measure(results, "end_to_end.run_pipeline", run, rows, track_memory)
+    results["end_to_end.run_pipeline"]["stages"] = report.stage_totals()
+    return results
+
+
+def _worker_memory(bed_path):
+    # runs in a worker process: load what a chunk reads, then report the memory of the process
+    import psutil
+    from scripts.gene_index import load_region_filter
+    from scripts.reference_data import warm_up
+
+    load_region_filter((), bed_path)
+    warm_up()
+    # keep this worker busy so that every worker of the pool gets one task
+    time.sleep(1)
+    memory = psutil.Process().memory_full_info()
+    return os.getpid(), memory.rss / 1024 ** 2, memory.uss / 1024 ** 2, memory.pss / 1024 ** 2
+
+
+def write_synthetic_bed(bed_path, n_intervals, seed=0):
+    """
+    Write a BED file of random intervals on chromosomes 1 to 22, about as many as the exons of
+    the gene index by default.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    contigs = rng.integers(1, 23, n_intervals)
+    starts = rng.integers(0, 200_000_000, n_intervals)
+    ends = starts + rng.integers(50, 5000, n_intervals)
+    with open(bed_path, 'w') as f:
+        f.writelines(f"{contig}\t{start}\t{end}\n" for contig, start, end in zip(contigs, starts, ends))
+
+
+def benchmark_worker_memory(work_dir, workers, n_intervals):
+    """
+    Measure the memory of process workers that loaded the pre-filter intervals, the reference
+    tables and the model, with private copies of the intervals and attached to the shared
+    reference store, for forked and for spawned workers.
+
+    As in run_pipeline, the driver loads the intervals before the workers start. USS is the
+    memory only that worker holds; PSS splits shared pages between the processes mapping them,
+    so its sum over the workers is what the pool costs the machine.
+
+    Returns:
+        dict: '{start method}.{private|shared}' mapped to the store size and per-worker RSS,
+            USS and PSS.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from scripts.config import PipelineConfig
+    from scripts.gene_index import load_region_filter
+    from scripts.main_operations import init_worker
+    from scripts.shared_reference import reference_store
+
+    bed_path = os.path.join(work_dir, f"prefilter_{n_intervals}.bed")
+    if not os.path.exists(bed_path):
+        write_synthetic_bed(bed_path, n_intervals)
+    load_region_filter((), bed_path)
+
+    results = {}
+    print(f"\n{'worker memory':<20} {'workers':>8} {'store MB':>9} {'RSS MB':>9} {'USS MB':>9} "
+          f"{'PSS sum MB':>11}")
+    for start_method in ("fork", "spawn"):
+        for shared in (False, True):
+            config = PipelineConfig(backend="process", workers=workers, prefilter_bed=bed_path,
+                                    shared_reference=shared,
+                                    output_root=os.path.join(work_dir, "worker_memory"))
+            os.makedirs(config.output_dir, exist_ok=True)
+            with reference_store(config) as (store_dir, store_bytes):
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(start_method),
+                                         initializer=init_worker, initargs=(None, store_dir)) as pool:
+                    samples = {pid: memory for pid, *memory in pool.map(_worker_memory, [bed_path] * workers)}
+
+            rss, uss, pss = (sum(values) / len(samples) for values in zip(*samples.values()))
+            mode = f"{start_method}.{'shared' if shared else 'private'}"
+            results[mode] = {"workers": len(samples), "intervals": n_intervals,
+                             "store_mb": store_bytes / 1024 ** 2, "mean_rss_mb": rss,
+                             "mean_uss_mb": uss, "total_pss_mb": pss * len(samples)}
+            print(f"{mode:<20} {len(samples):>8} {store_bytes / 1024 ** 2:>9.1f} {rss:>9.1f} {uss:>9.1f} "
+                  f"{pss * len(samples):>11.1f}")
+
+    return results
+
+
+def compare_with_baseline(current, baseline, tolerance):
+    """
+    Print the throughput and peak memory of every stage relative to a baseline.
+
+    Returns:
+        list: Names of the stages that got slower by more than the tolerance.
+    """
+    regressions = []
+    print(f"\n{'stage':<52} {'speedup':>8} {'memory':>8}")
+    for stage, new in current["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if old is None or not old.get("rows_per_second") or not new.get("rows_per_second"):
+            print(f"{stage:<52} {'new':>8}")
+            continue
+
+        speedup = new["rows_per_second"] / old["rows_per_second"]
+        memory = (f"{new['peak_mb'] / old['peak_mb']:>7.2f}x"
+                  if new.get("peak_mb") and old.get("peak_mb") else f"{'-':>8}")
+        flag = ""
+        if speedup < 1 - tolerance:
+            regressions.append(stage)
+            flag = "  slower"
+        print(f"{stage:<52} {speedup:>7.2f}x {memory}{flag}")
+
+    return regressions
+
+
+def main():
+    args = parse_arguments()
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+
+    reference_dir = os.path.join(work_dir, "toy_reference")
+    sequences = make_toy_reference(reference_dir, seed=args.seed)
+    vcf_path = os.path.join(work_dir, f"bench_{args.variants}.vcf")
+    counts = generate_synthetic_vcf(vcf_path, sequences, args.variants,
+                                    indel_fraction=args.indel_fraction, seed=args.seed)
+
+    # scripts.globals reads these when it is first imported
+    os.environ["MIRSCRIBE_GRCH37_DIR"] = reference_dir
+    if not args.real_rnaduplex:
+        os.environ["MIRSCRIBE_RNADUPLEX"] = RNADUPLEX_STUB
+
+    track_memory = not args.no_memory
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "variants": args.variants,
+            "indel_fraction": args.indel_fraction,
+            "variant_counts": counts,
+            "seed": args.seed,
+            "chunksize": args.chunksize,
+            "workers": args.workers,
+            "rnaduplex": "real" if args.real_rnaduplex else "stub",
+        },
+        "stages": {},
+    }
+    results["stages"].update(benchmark_stages(vcf_path, work_dir, track_memory))
+    results["stages"].update(benchmark_end_to_end(vcf_path, work_dir, args.chunksize, args.workers, track_memory))
+    if args.worker_memory:
+        results["worker_memory"] = benchmark_worker_memory(work_dir, args.workers, args.bed_intervals)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"\nSaved measurements to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) slower than the baseline by more than "
+                  f"{args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
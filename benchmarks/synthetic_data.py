@@ -0,0 +1,98 @@
+import os
+import random
+
+# chromosome lengths of the toy reference, small enough to generate in a second
+TOY_CHROMOSOMES = {"1": 200_000, "2": 150_000, "3": 100_000}
+FASTA_LINE_LENGTH = 60
+
+
+def make_toy_reference(reference_dir, chromosomes=TOY_CHROMOSOMES, seed=0):
+    """
+    Write a random reference genome in the layout sequence_utils expects
+    (one Homo_sapiens.GRCh37.dna.chromosome.{chrom}.fa per chromosome, 60 bases per line).
+
+    Files that already exist are kept, so repeated benchmark runs share the same reference.
+
+    Args:
+        reference_dir (str): Directory to write the FASTA files into.
+        chromosomes (dict, optional): Chromosome name mapped to its length.
+        seed (int, optional): Seed of the random generator. Default is 0.
+
+    Returns:
+        dict: Chromosome name mapped to its sequence.
+    """
+    os.makedirs(reference_dir, exist_ok=True)
+    rng = random.Random(seed)
+    sequences = {}
+
+    for chrom, length in chromosomes.items():
+        sequence = "".join(rng.choices("ACGT", k=length))
+        sequences[chrom] = sequence
+
+        file_path = os.path.join(
+            reference_dir, f"Homo_sapiens.GRCh37.dna.chromosome.{chrom}.fa")
+        if os.path.exists(file_path):
+            continue
+
+        with open(file_path, 'w') as f:
+            f.write(f">{chrom} dna:chromosome chromosome:GRCh37:{chrom}:1:{length}:1\n")
+            for i in range(0, length, FASTA_LINE_LENGTH):
+                f.write(sequence[i:i + FASTA_LINE_LENGTH] + "\n")
+
+    return sequences
+
+
+def generate_synthetic_vcf(vcf_path, sequences, n_variants, indel_fraction=0.1,
+                           invalid_fraction=0.02, sample_name="PD10010a", seed=0):
+    """
+    Write a headerless 5-column VCF (chr, pos, id, ref, alt) against a toy reference.
+
+    Args:
+        vcf_path (str): Path of the VCF file to write.
+        sequences (dict): Chromosome name mapped to its sequence, as returned by make_toy_reference.
+        n_variants (int): Number of variants to write.
+        indel_fraction (float, optional): Share of insertions and deletions. Default is 0.1.
+        invalid_fraction (float, optional): Share of variants whose ref does not match the reference,
+            which the validation step filters out. Default is 0.02.
+        sample_name (str, optional): Value of the id column. Default is a sample of the mutsig tables.
+        seed (int, optional): Seed of the random generator. Default is 0.
+
+    Returns:
+        dict: Number of SNVs, insertions, deletions and invalid rows written.
+    """
+    rng = random.Random(seed)
+    chroms = list(sequences)
+    weights = [len(sequences[c]) for c in chroms]
+    counts = {"snv": 0, "insertion": 0, "deletion": 0, "invalid": 0}
+
+    rows = []
+    for _ in range(n_variants):
+        chrom = rng.choices(chroms, weights=weights)[0]
+        sequence = sequences[chrom]
+        # stay clear of the chromosome ends so the 30 nt flanks always exist
+        pos = rng.randint(100, len(sequence) - 100)
+        ref_base = sequence[pos - 1]
+
+        draw = rng.random()
+        if draw < indel_fraction / 2:
+            ref, alt = ref_base, ref_base + "".join(rng.choices("ACGT", k=rng.randint(1, 3)))
+            counts["insertion"] += 1
+        elif draw < indel_fraction:
+            ref, alt = sequence[pos - 1:pos + rng.randint(1, 3)], ref_base
+            counts["deletion"] += 1
+        else:
+            ref, alt = ref_base, rng.choice([b for b in "ACGT" if b != ref_base])
+            counts["snv"] += 1
+
+        if rng.random() < invalid_fraction:
+            ref = "".join(rng.choice([b for b in "ACGT" if b != base]) for base in ref)
+            counts["invalid"] += 1
+
+        rows.append((chrom, pos, sample_name, ref, alt))
+
+    rows.sort(key=lambda row: (chroms.index(row[0]), row[1]))
+    with open(vcf_path, 'w') as f:
+        for row in rows:
+            f.write("\t".join(map(str, row)) + "\n")
+
+    return counts
@@ -0,0 +1,133 @@
+"""
+In-memory scoring of variant tables (steps 1 to 4) for use as a library.
+
+Unlike synth.py nothing is written to disk: RNAduplex runs through pipes and its output is
+parsed in Python. Reference tables, sequence caches and the XGBoost model stay loaded in the
+process, so only the first call pays for loading them (see reference_data.warm_up).
+
+Example:
+    from scripts.api import score_variants
+    results = score_variants({"chr": [1], "pos": [1141], "ref": ["G"], "alt": ["A"]})
+"""
+from dataclasses import replace
+
+import pandas as pd
+
+from scripts.config import PipelineConfig
+from scripts.pipeline_orchestration import (RESULT_COLUMNS, compute_chunk_features, fold_in_memory,
+                                            predict_chunk)
+from scripts.pipeline_steps.step2 import run_rnaduplex_on_string
+from scripts.utils.instrumentation import chunk_recorder
+from scripts.vcf_reader import normalize_chromosomes, reference_length
+
+VARIANT_COLUMNS = ["chr", "pos", "id", "ref", "alt"]
+
+
+def prepare_variants(variants, vcf_id):
+    """
+    Bring a variant table into the shape of a VCF chunk read by run_pipeline.
+
+    Args:
+        variants (pandas.DataFrame or dict): 'chr', 'pos', 'ref' and 'alt' columns (or arrays),
+            optionally 'id' with the sample name.
+        vcf_id (str): Sample name used where 'id' is missing.
+
+    Returns:
+        pandas.DataFrame: Columns chr, pos, id, ref, alt.
+
+    Raises:
+        ValueError: If columns are missing or a variant cannot be scored (see check_variants).
+    """
+    df = pd.DataFrame(variants).copy()
+    missing = {"chr", "pos", "ref", "alt"} - set(df.columns)
+    if missing:
+        raise ValueError(f"Variants are missing the columns {sorted(missing)}")
+    if "id" not in df.columns:
+        df["id"] = vcf_id
+
+    df["chr"] = normalize_chromosomes(df["chr"])
+    df["pos"] = df["pos"].astype(int)
+    check_variants(df)
+
+    return df[VARIANT_COLUMNS].reset_index(drop=True)
+
+
+def check_variants(df):
+    """
+    Reject variants the pipeline cannot score, before they reach a run or a micro-batch.
+
+    Alleles must be non-empty A/C/G/T strings and every variant must lie on a chromosome with
+    a reference FASTA in GRCH37_DIR, inside its length. A ref allele that merely disagrees
+    with the reference is not an error; validation reports it as an invalid row.
+
+    Args:
+        df (pandas.DataFrame): Variants with normalized 'chr' and integer 'pos' columns.
+
+    Raises:
+        ValueError: Naming the first offending values.
+    """
+    for column in ("ref", "alt"):
+        malformed = ~df[column].astype(str).str.fullmatch("[ACGT]+")
+        if malformed.any():
+            raise ValueError(f"Malformed {column} alleles: {df.loc[malformed, column].head().tolist()}")
+
+    for chrom, positions in df.groupby("chr")["pos"]:
+        length = reference_length(chrom)
+        if length is None:
+            raise ValueError(f"No reference FASTA for chromosome {chrom}")
+        outside = positions[(positions < 1) | (positions > length)]
+        if not outside.empty:
+            raise ValueError(f"Positions outside chromosome {chrom} (length {length}): "
+                             f"{outside.head().tolist()}")
+
+
+def score_variants(variants, config: PipelineConfig = None, vcf_id: str = None,
+                   model_path: str = None, rnaduplex=run_rnaduplex_on_string,
+                   return_details: bool = False):
+    """
+    Run steps 1 to 4 of the pipeline on a variant table held in memory.
+
+    The steps are those of process_chunk (see compute_chunk_features); only the folding runs
+    through pipes instead of files, and the invalid and case 2 ids are returned instead of
+    written.
+
+    Args:
+        variants (pandas.DataFrame or dict): Variants with 'chr', 'pos', 'ref', 'alt' and optionally 'id'.
+        config (PipelineConfig, optional): Settings of the run; 'filter_threshold',
+            'model_path', the pre-filter, the miRNA panel and the pair pruning are used.
+            Default is PipelineConfig().
+        vcf_id (str, optional): Sample name for variants without 'id'. Default is "api".
+        model_path (str, optional): XGBoost model to predict with. Default is config.model_path.
+        rnaduplex (callable, optional): Function mapping RNAduplex input to its raw output.
+            Default runs RNAduplex through pipes.
+        return_details (bool, optional): Also return the invalid and case 2 ids and the stage
+            timings. Default is False.
+
+    Returns:
+        pandas.DataFrame: The rows synth.py would write to the result files, or a
+            (results, details) tuple if return_details is True.
+    """
+    config = config or PipelineConfig()
+    if model_path is not None:
+        config = replace(config, model_path=model_path)
+    df = prepare_variants(variants, vcf_id or "api")
+    results = pd.DataFrame(columns=RESULT_COLUMNS)
+
+    with chunk_recorder("api") as recorder:
+        details = recorder.stats
+        details["rows"] = len(df)
+
+        frames = compute_chunk_features(
+            df, config, lambda case_1: fold_in_memory(case_1, config.mirna_panel, rnaduplex),
+            chunk_stats=details)
+        details["invalid_ids"] = frames.invalid_rows["id"].tolist()
+        details["case_2_ids"] = frames.case_2["id"].tolist()
+
+        if frames.features is not None:
+            # Step 4: Prediction
+            results = predict_chunk(frames.features, frames.id_array, frames.binary_array,
+                                    config).reset_index(drop=True)
+
+    if return_details:
+        return results, recorder.to_dict()
+    return results
@@ -0,0 +1,115 @@
+import logging
+
+# pandas makes intermediate copies (merges, groupby-apply, pivots) on top of the
+# largest frame we measure, so the per-row footprint is scaled by this factor
+MEMORY_OVERHEAD_FACTOR = 3.0
+
+
+class AdaptiveChunkSizer:
+    """
+    Size VCF chunks from the measured cost of chunks that already finished.
+
+    Every finished chunk reports how many input rows it had, how long it took, how many
+    rows went through RNAduplex and how large its biggest frame was. From an exponentially
+    weighted average of seconds and bytes per input row the sizer picks the largest chunk
+    that still fits both the target wall time and the per-worker memory budget.
+
+    Args:
+        initial_size (int): Chunk size used until the first measurement arrives.
+        target_seconds (float): Wall time a single chunk should take.
+        memory_budget_mb (float): Memory a single chunk may use in one worker.
+        min_size (int, optional): Lower bound for the chunk size. Default is 10.
+        max_size (int, optional): Upper bound for the chunk size. Default is 5000.
+        smoothing (float, optional): Weight of the newest measurement in the averages. Default is 0.3.
+    """
+
+    def __init__(self, initial_size, target_seconds, memory_budget_mb,
+                 min_size=10, max_size=5000, smoothing=0.3):
+        self.target_seconds = target_seconds
+        self.memory_budget_bytes = memory_budget_mb * 1024 ** 2
+        self.min_size = min_size
+        self.max_size = max_size
+        self.smoothing = smoothing
+
+        self.size = self._clamp(initial_size)
+        self.seconds_per_row = None
+        self.bytes_per_row = None
+        self.chunks_seen = 0
+        self.rows_seen = 0
+        self.rows_folded = 0
+        self.seconds_spent = 0.0
+
+    def _clamp(self, size):
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    def _smooth(self, average, value):
+        if average is None:
+            return value
+        return (1 - self.smoothing) * average + self.smoothing * value
+
+    def record(self, chunk_stats):
+        """
+        Update the cost model with the statistics of a finished chunk.
+
+        Args:
+            chunk_stats (dict): Dictionary with 'rows', 'seconds', 'folded_rows' and 'frame_bytes'.
+        """
+        rows = chunk_stats.get("rows", 0)
+        if rows == 0:
+            return
+
+        self.chunks_seen += 1
+        self.rows_seen += rows
+        self.rows_folded += chunk_stats.get("folded_rows", 0)
+        self.seconds_spent += chunk_stats.get("seconds", 0.0)
+
+        self.seconds_per_row = self._smooth(
+            self.seconds_per_row, chunk_stats.get("seconds", 0.0) / rows)
+        self.bytes_per_row = self._smooth(
+            self.bytes_per_row, chunk_stats.get("frame_bytes", 0) * MEMORY_OVERHEAD_FACTOR / rows)
+
+    def next_size(self):
+        """
+        Return the size of the next chunk to read.
+
+        The new size is at most double and at least half of the previous one, so one
+        unusually cheap or expensive chunk cannot swing the schedule too far.
+
+        Returns:
+            int: Number of VCF lines to put in the next chunk.
+        """
+        if self.seconds_per_row is None:
+            return self.size
+
+        candidates = [self.max_size]
+        if self.seconds_per_row > 0:
+            candidates.append(self.target_seconds / self.seconds_per_row)
+        if self.bytes_per_row:
+            candidates.append(self.memory_budget_bytes / self.bytes_per_row)
+
+        proposed = min(candidates)
+        proposed = min(max(proposed, self.size / 2), self.size * 2)
+        self.size = self._clamp(proposed)
+
+        logging.debug(f"Next chunk size: {self.size} "
+                      f"({self.seconds_per_row:.4f} s/row, {self.bytes_per_row or 0:.0f} B/row)")
+        return self.size
+
+    def summary(self):
+        """
+        Summarize the observed throughput.
+
+        Returns:
+            dict: Chunks and rows seen, rows folded per worker-second and the current chunk size.
+        """
+        folded_per_second = (self.rows_folded / self.seconds_spent
+                             if self.seconds_spent > 0 else None)
+        return {
+            "chunks": self.chunks_seen,
+            "rows": self.rows_seen,
+            "rows_folded": self.rows_folded,
+            "rows_folded_per_worker_second": folded_per_second,
+            "seconds_per_row": self.seconds_per_row,
+            "bytes_per_row": self.bytes_per_row,
+            "chunk_size": self.size,
+        }
@@ -1,8 +1,90 @@
 import argparse
 import os
+from dataclasses import dataclass
+from typing import NamedTuple
 
+from scripts.globals import XGB_MODEL
 
-def parse_arguments():
+
+class MirnaPanel(NamedTuple):
+    """
+    miRNAs the variants are folded against: those listed in `file` and/or matching the
+    pandas query `query` over the miRNA table (e.g. "conservation >= 2").
+    """
+    file: str = None
+    query: str = None
+
+
+@dataclass
+class PipelineConfig:
+    """
+    Settings of one pipeline run.
+
+    Built from the command line with parse_arguments(), or directly when the pipeline is used
+    as a library. The object is passed to run_pipeline and on to every chunk, so it has to stay
+    picklable for the process, filequeue and dask backends.
+    """
+    vcf_full_path: str = "data/sample_vcfs/sample.vcf"
+    chunksize: int = 200
+    output_root: str = "./results"
+    verbose: bool = False
+    workers: int = os.cpu_count()
+    skip_rnaduplex: bool = False
+    filter_threshold: float = 0.2
+    profile: bool = False
+    backend: str = "thread"
+    queue_dir: str = None
+    scheduler_address: str = None
+    join_queue: bool = False
+    adaptive_chunks: bool = False
+    target_chunk_seconds: float = 120
+    worker_memory_mb: float = 2048
+    min_chunksize: int = 10
+    max_chunksize: int = 5000
+    cache_mb: float = None
+    region_mode: str = None
+    region_size: int = 1_000_000
+    prefilter: tuple = ()
+    prefilter_bed: str = None
+    mirna_panel_file: str = None
+    mirna_panel_query: str = None
+    prune_pairs: bool = False
+    prune_energy: float = None
+    fold_workers: int = 1
+    cache_features: bool = False
+    feature_cache_dir: str = None
+    rescore: bool = False
+    model_path: str = XGB_MODEL
+    shared_reference: bool = True
+
+    @property
+    def vcf_id(self):
+        return os.path.basename(self.vcf_full_path).split(".")[0]
+
+    @property
+    def output_dir(self):
+        return os.path.join(self.output_root, f"{self.vcf_id}_{self.chunksize}")
+
+    @property
+    def mirna_panel(self):
+        if self.mirna_panel_file is None and self.mirna_panel_query is None:
+            return None
+        return MirnaPanel(self.mirna_panel_file, self.mirna_panel_query)
+
+    @property
+    def feature_cache_path(self):
+        return self.feature_cache_dir or os.path.join(self.output_dir, "features")
+
+    @property
+    def reference_store_path(self):
+        return os.path.join(self.output_dir, ".reference")
+
+    @property
+    def queue_path(self):
+        return self.queue_dir or os.path.join(self.output_dir, ".queue")
+
+
+def build_parser():
     parser = argparse.ArgumentParser(
         description='Process a VCF file in chunks using concurrent futures.')
     parser.add_argument('file_path', default="data/sample_vcfs/sample.vcf",
@@ -21,20 +103,107 @@ def parse_arguments():
                         help='Threshold for filtering out pairs that have less prediction difference than the threshold')
     parser.add_argument('--profile', action='store_true',
                         help='Enable memory profiling')
+    parser.add_argument('-b', '--backend', default='thread',
+                        choices=['thread', 'process', 'filequeue', 'dask'],
+                        help='Execution backend that chunks are submitted through')
+    parser.add_argument('--queue-dir', type=str, default=None,
+                        help='Shared directory for the filequeue backend (default: <output_dir>/.queue)')
+    parser.add_argument('--scheduler-address', type=str, default=None,
+                        help='Address of a running dask scheduler for the dask backend')
+    parser.add_argument('--join', action='store_true',
+                        help='Join a running filequeue run as an extra worker instead of driving it')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Size chunks from the measured cost of earlier chunks, starting at --chunksize')
+    parser.add_argument('--target-chunk-seconds', default=120, type=float,
+                        help='Target wall time per chunk for --adaptive')
+    parser.add_argument('--worker-memory-mb', default=2048, type=float,
+                        help='Memory budget per worker for --adaptive')
+    parser.add_argument('--min-chunksize', default=10, type=int,
+                        help='Smallest chunk size --adaptive may choose')
+    parser.add_argument('--max-chunksize', default=5000, type=int,
+                        help='Largest chunk size --adaptive may choose')
+    parser.add_argument('--cache-mb', default=None, type=float,
+                        help='Combined memory budget of the sequence and feature caches per worker process')
+    parser.add_argument('--regions', default=None, choices=['chromosome', 'window'],
+                        help='Let every worker read its own region of a bgzipped, tabix-indexed VCF '
+                             '(chromosome: one region per chromosome, longer ones split into parts of at most 50 Mb)')
+    parser.add_argument('--region-size', default=1_000_000, type=int,
+                        help='Region size in bases for --regions window')
+    parser.add_argument('--prefilter', nargs='+', default=(), choices=['utr3', 'exon', 'gene'],
+                        help='Only fold case 1 variants inside these Ensembl 75 features')
+    parser.add_argument('--prefilter-bed', type=str, default=None,
+                        help='Only fold case 1 variants inside the intervals of this BED file '
+                             '(combined with --prefilter)')
+    parser.add_argument('--mirna-panel', type=str, default=None,
+                        help='File listing the miRNAs (accessions or names, one per line) to fold against')
+    parser.add_argument('--mirna-query', type=str, default=None,
+                        help='Pandas query selecting miRNAs from the miRNA table, e.g. "conservation >= 2"')
+    parser.add_argument('--prune', action='store_true',
+                        help='Drop wt/mut duplex pairs that do not cover the mutation before step 3 (lossless)')
+    parser.add_argument('--prune-energy', type=float, default=None,
+                        help='Also drop pairs whose wt and mut energies are both above this cutoff in kcal/mol')
+    parser.add_argument('--fold-workers', default=1, type=int,
+                        help='RNAduplex processes per chunk; 0 spreads --workers over the chunks '
+                             'when there are fewer chunks than workers')
+    parser.add_argument('--cache-features', action='store_true',
+                        help='Store the step 3 features of every chunk and reuse them when the chunk is unchanged')
+    parser.add_argument('--feature-cache-dir', type=str, default=None,
+                        help='Directory of the stored features (default: <output_dir>/features)')
+    parser.add_argument('--rescore', action='store_true',
+                        help='Only run the prediction (step 4) over the stored features, e.g. with a new --model')
+    parser.add_argument('--model', type=str, default=XGB_MODEL,
+                        help='XGBoost model to predict with')
+    parser.add_argument('--no-shared-reference', action='store_true',
+                        help='Let every process or filequeue worker load its own copy of the pre-filter '
+                             'intervals instead of memory mapping a shared one (only spawned and joining '
+                             'workers save memory with the shared copy; forked workers share the driver\'s)')
 
-    return parser.parse_args()
+    return parser
 
 
-args = parse_arguments()
+def parse_arguments(argv=None):
+    """
+    Parse command line arguments into a PipelineConfig.
 
-VCF_FULL_PATH = args.file_path
-CHUNKSIZE = args.chunksize
-VERBOSE = args.verbose
-WORKERS = args.workers
-SKIP_RNADUPLEX = args.skip_rnaduplex
-FILTER_THRESHOLD = args.threshold
-PROFILER = args.profile
+    Args:
+        argv (list, optional): Arguments to parse. Default is sys.argv[1:].
 
+    Returns:
+        PipelineConfig: The settings of the run.
+    """
+    args = build_parser().parse_args(argv)
 
-VCF_ID = os.path.basename(VCF_FULL_PATH).split(".")[0]
-OUTPUT_DIR = os.path.join(args.output_dir, f"{VCF_ID}_{CHUNKSIZE}")
+    return PipelineConfig(
+        vcf_full_path=args.file_path,
+        chunksize=args.chunksize,
+        output_root=args.output_dir,
+        verbose=args.verbose,
+        workers=args.workers,
+        skip_rnaduplex=args.skip_rnaduplex,
+        filter_threshold=args.threshold,
+        profile=args.profile,
+        backend=args.backend,
+        queue_dir=args.queue_dir,
+        scheduler_address=args.scheduler_address,
+        join_queue=args.join,
+        adaptive_chunks=args.adaptive,
+        target_chunk_seconds=args.target_chunk_seconds,
+        worker_memory_mb=args.worker_memory_mb,
+        min_chunksize=args.min_chunksize,
+        max_chunksize=args.max_chunksize,
+        cache_mb=args.cache_mb,
+        region_mode=args.regions,
+        region_size=args.region_size,
+        prefilter=tuple(args.prefilter),
+        prefilter_bed=args.prefilter_bed,
+        mirna_panel_file=args.mirna_panel,
+        mirna_panel_query=args.mirna_query,
+        prune_pairs=args.prune,
+        prune_energy=args.prune_energy,
+        fold_workers=args.fold_workers,
+        cache_features=args.cache_features,
+        feature_cache_dir=args.feature_cache_dir,
+        rescore=args.rescore,
+        model_path=args.model,
+        shared_reference=not args.no_shared_reference,
+    )
@@ -0,0 +1,119 @@
+"""
+Calibration of the --prune-energy cutoff on a validation VCF.
+
+Run the pipeline once on the validation VCF with --cache-features (and without --prune-energy),
+then report, for every candidate cutoff, how many wt/mut pairs the cutoff would prune and how
+many result rows of the full run would be lost with them.
+
+Usage:
+    python synth.py validation.vcf -c 200 --cache-features
+    python -m scripts.energy_calibration validation.vcf -c 200 --cutoffs -5 -10 -15 -20
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from scripts.config import PipelineConfig
+from scripts.feature_cache import list_cached_chunks, require_chunk_features
+from scripts.globals import XGB_MODEL
+from scripts.pipeline_orchestration import predict_chunk
+
+DEFAULT_CUTOFFS = (-5.0, -7.5, -10.0, -12.5, -15.0, -17.5, -20.0, -25.0)
+
+
+def pair_energies_and_hits(features, id_array, binary_array, config):
+    """
+    Score one stored chunk and take the strongest energy of every wt/mut pair that covers the
+    mutation (the others are pruned without loss anyway).
+
+    Returns:
+        tuple: (strongest pred_energy per pair id as a Series, set of pair ids in the results)
+    """
+    pair_ids = id_array.str.rsplit("_", n=1).str[0].to_numpy()
+    strongest = features["pred_energy"].groupby(pair_ids).min()
+    strongest = strongest[binary_array.groupby(pair_ids).any()]
+    hits = set(predict_chunk(features, id_array, binary_array, config)["id"])
+    return strongest, hits
+
+
+def calibrate_energy_cutoffs(config, cutoffs=DEFAULT_CUTOFFS):
+    """
+    Count the pairs pruned and the result rows lost at each energy cutoff.
+
+    Args:
+        config (PipelineConfig): Settings of the validation run; the stored features are read
+            from config.feature_cache_path and scored with config.model_path and
+            config.filter_threshold.
+        cutoffs (iterable, optional): Candidate cutoffs in kcal/mol.
+
+    Returns:
+        pandas.DataFrame: One row per cutoff with pairs and hits kept and lost.
+    """
+    chunks = list_cached_chunks(config.feature_cache_path, config.vcf_id)
+    if not chunks:
+        raise FileNotFoundError(f"No stored features of {config.vcf_id} in {config.feature_cache_path}, "
+                                f"run the pipeline with --cache-features first")
+
+    energies, hit_energies = [], []
+    for _, _, path in chunks:
+        features, id_array, binary_array, key = require_chunk_features(path)
+        if key["pruning"][1] is not None:
+            logging.warning(f"{path} was stored with --prune-energy {key['pruning'][1]}, "
+                            f"pairs above that cutoff are missing from the calibration")
+        strongest, hits = pair_energies_and_hits(features, id_array, binary_array, config)
+        energies.append(strongest.to_numpy())
+        hit_energies.append(strongest[strongest.index.isin(hits)].to_numpy())
+
+    energies = np.concatenate(energies)
+    hit_energies = np.concatenate(hit_energies)
+
+    rows = []
+    for cutoff in sorted(cutoffs, reverse=True):
+        pruned = int((energies > cutoff).sum())
+        lost = int((hit_energies > cutoff).sum())
+        rows.append({
+            "cutoff": cutoff,
+            "pairs": len(energies),
+            "pairs_pruned": pruned,
+            "pairs_pruned_share": pruned / len(energies) if len(energies) else None,
+            "hits": len(hit_energies),
+            "hits_lost": lost,
+            "hits_lost_share": lost / len(hit_energies) if len(hit_energies) else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Report the pairs pruned and the results lost at each --prune-energy cutoff.')
+    parser.add_argument('file_path', type=str, help='Path to the validation VCF file')
+    parser.add_argument("-c", '--chunksize', default=200, type=int,
+                        help='Chunk size of the validation run')
+    parser.add_argument("-o", '--output_dir', type=str, default='./results',
+                        help='Output directory of the validation run')
+    parser.add_argument('--feature-cache-dir', type=str, default=None,
+                        help='Directory of the stored features (default: <output_dir>/features)')
+    parser.add_argument('--cutoffs', nargs='+', type=float, default=list(DEFAULT_CUTOFFS),
+                        help='Candidate energy cutoffs in kcal/mol')
+    parser.add_argument('-t', '--threshold', default=0.2, type=float,
+                        help='Threshold for filtering out pairs that have less prediction difference than the threshold')
+    parser.add_argument('--model', type=str, default=XGB_MODEL,
+                        help='XGBoost model to predict with')
+    args = parser.parse_args()
+
+    config = PipelineConfig(vcf_full_path=args.file_path, chunksize=args.chunksize,
+                            output_root=args.output_dir, feature_cache_dir=args.feature_cache_dir,
+                            filter_threshold=args.threshold, model_path=args.model)
+    report = calibrate_energy_cutoffs(config, args.cutoffs)
+
+    report_file = os.path.join(config.output_dir, f"energy_calibration_{config.vcf_id}.csv")
+    report.to_csv(report_file, index=False)
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    print(f"\nwritten to {report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+BACKENDS = ("thread", "process", "filequeue", "dask")
+
+
+def create_executor(backend, workers, queue_dir=None, scheduler_address=None,
+                    initializer=None, initargs=()):
+    """
+    Create the executor that run_pipeline submits process_chunk through.
+
+    Every backend returns a concurrent.futures.Executor, so the caller can use
+    submit() and as_completed() regardless of where the chunks actually run.
+
+    Args:
+        backend (str): One of "thread", "process", "filequeue" or "dask".
+        workers (int): Number of local workers to start.
+        queue_dir (str, optional): Shared directory used by the "filequeue" backend.
+        scheduler_address (str, optional): Address of a running dask scheduler. If None,
+            the "dask" backend starts a local cluster with `workers` processes.
+        initializer (callable, optional): Called with `initargs` in every worker process of the
+            "process" and "filequeue" backends, including filequeue workers that join from
+            other nodes (not in threads or dask workers).
+        initargs (tuple, optional): Arguments of `initializer`.
+
+    Returns:
+        concurrent.futures.Executor: The executor for the requested backend.
+    """
+    if backend == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+
+    if backend == "process":
+        return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+
+    if backend == "filequeue":
+        if queue_dir is None:
+            raise ValueError("The filequeue backend needs a queue directory")
+        return FileQueueExecutor(queue_dir, local_workers=workers,
+                                 initializer=initializer, initargs=initargs)
+
+    if backend == "dask":
+        try:
+            from dask.distributed import Client
+        except ImportError as e:
+            raise ImportError(
+                "The dask backend requires the 'distributed' package") from e
+
+        if scheduler_address:
+            client = Client(scheduler_address)
+        else:
+            client = Client(n_workers=workers,
+                            threads_per_worker=1, processes=True)
+        return DaskExecutor(client)
+
+    raise ValueError(
+        f"Unknown backend: {backend}. Choose one of {', '.join(BACKENDS)}")
+
+
+class DaskExecutor(Executor):
+    """
+    Executor of a dask client that also closes the client, and the local cluster it started,
+    on shutdown.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._executor = client.get_executor()
+
+    def submit(self, fn, /, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        try:
+            self._executor.shutdown(wait=wait)
+        finally:
+            self.client.close()
+
+
+###################################################
+# file-queue backend
+
+
+def _queue_subdirs(queue_dir):
+    return {name: os.path.join(queue_dir, name) for name in ("pending", "claimed", "done")}
+
+
+def _stop_file(queue_dir):
+    return os.path.join(queue_dir, "STOP")
+
+
+def _initializer_file(queue_dir):
+    return os.path.join(queue_dir, "initializer.pkl")
+
+
+def _load_initializer(queue_dir):
+    """
+    Read the (initializer, initargs) the driver of the run left in the queue directory.
+    """
+    with open(_initializer_file(queue_dir), 'rb') as f:
+        return pickle.load(f)
+
+
+def _atomic_pickle(obj, path):
+    """
+    Pickle an object next to its final path and rename it into place, so that
+    readers polling the directory never see a half-written file.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+# seconds between the touches a worker gives the task it is running
+HEARTBEAT_INTERVAL = 30
+# claims untouched for this long belong to a lost worker and are requeued
+CLAIM_TIMEOUT = 300
+# runs of a task (the first one included) before its future fails instead of requeueing it
+MAX_TASK_ATTEMPTS = 3
+
+
+def _worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claim_owner(filename):
+    """
+    Split a claimed file name '<task_id>.pkl.<host>:<pid>' into (task_id, host, pid).
+    """
+    task_id, _, owner = filename.partition(".pkl.")
+    host, _, pid = owner.rpartition(":")
+    return task_id, host, int(pid) if pid.isdigit() else None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but belongs to another user
+        return True
+    return True
+
+
+def _claim_next_task(queue_dir):
+    """
+    Claim the oldest pending task by renaming it into the claimed directory.
+
+    os.rename is atomic on a POSIX filesystem, so when several workers race for
+    the same file exactly one of them wins and the others move on to the next one.
+    The claimed file name carries the worker's host and PID, so the driver can requeue
+    the tasks of workers that died.
+
+    Returns:
+        tuple: (task_id, claimed_path), or None if there is nothing to claim.
+    """
+    dirs = _queue_subdirs(queue_dir)
+
+    for filename in sorted(os.listdir(dirs["pending"])):
+        if not filename.endswith(".pkl"):
+            continue
+        claimed_path = os.path.join(dirs["claimed"], f"{filename}.{_worker_name()}")
+        try:
+            os.rename(os.path.join(dirs["pending"], filename), claimed_path)
+        except FileNotFoundError:
+            # another worker got there first
+            continue
+        return filename[:-len(".pkl")], claimed_path
+
+    return None
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # requeued by the driver in the meantime
+        pass
+
+
+def _heartbeat(path, stop, interval):
+    while not stop.wait(interval):
+        _touch(path)
+
+
+def run_file_queue_worker(queue_dir, poll_interval=0.2, initializer=None, initargs=(),
+                          heartbeat_interval=HEARTBEAT_INTERVAL):
+    """
+    Execute tasks from a file queue until the driver writes the STOP file.
+
+    Workers on any node that mounts `queue_dir` can join a run; idle workers pick up
+    whatever is pending, so faster nodes naturally take more chunks. While a task runs the
+    worker touches its claimed file every `heartbeat_interval` seconds, so the driver can
+    tell it apart from the claim of a worker that is gone.
+
+    Args:
+        queue_dir (str): Shared queue directory created by FileQueueExecutor.
+        poll_interval (float, optional): Seconds to sleep when the queue is empty. Default is 0.2.
+        initializer (callable, optional): Called with `initargs` before the first task. When
+            omitted, e.g. for workers joining from other nodes, the initializer the driver
+            stored in the queue directory is used.
+        initargs (tuple, optional): Arguments of `initializer`.
+        heartbeat_interval (float, optional): Seconds between touches of the running task.
+    """
+    initialized = False
+    if initializer is not None:
+        initializer(*initargs)
+        initialized = True
+    dirs = _queue_subdirs(queue_dir)
+    worker_name = _worker_name()
+    logging.debug(f"File queue worker {worker_name} watching {queue_dir}")
+
+    while not os.path.exists(_stop_file(queue_dir)):
+        try:
+            task = _claim_next_task(queue_dir)
+        except FileNotFoundError:
+            # queue directory is being (re)created by the driver
+            task = None
+
+        if task is None:
+            time.sleep(poll_interval)
+            continue
+
+        task_id, claimed_path = task
+        # the rename kept the submit time as mtime, mark the claim as fresh right away
+        _touch(claimed_path)
+        if not initialized:
+            # written by the driver before its first task, so it belongs to the current run
+            initializer, initargs = _load_initializer(queue_dir)
+            if initializer is not None:
+                initializer(*initargs)
+            initialized = True
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, daemon=True,
+                                     args=(claimed_path, stop_heartbeat, heartbeat_interval))
+        heartbeat.start()
+        try:
+            with open(claimed_path, 'rb') as f:
+                fn, args, kwargs = pickle.load(f)
+            outcome = (True, fn(*args, **kwargs))
+        except Exception as e:
+            logging.error(f"Task {task_id} failed on {worker_name}: {str(e)}")
+            outcome = (False, e)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        try:
+            _atomic_pickle(outcome, os.path.join(dirs["done"], f"{task_id}.pkl"))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            _atomic_pickle((False, RuntimeError(f"Unpicklable outcome of {task_id}: {e}")),
+                           os.path.join(dirs["done"], f"{task_id}.pkl"))
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:
+            # requeued by the driver meanwhile; the driver ignores the second outcome
+            pass
+
+
+class FileQueueExecutor(Executor):
+    """
+    Executor that distributes tasks through a directory on a shared filesystem.
+
+    submit() pickles each task into `pending/`, workers claim tasks by renaming them into
+    `claimed/` and write their outcome to `done/`, and a collector thread in the driver
+    resolves the matching futures. `local_workers` worker processes are started on this
+    machine; more can join from other nodes with run_file_queue_worker(). The initializer and
+    its arguments are pickled into the queue directory, so joining workers run it too.
+
+    The collector also requeues the claims of workers that are gone: those of dead local
+    processes, and any claim whose heartbeat is older than `claim_timeout` seconds. A task
+    whose workers were lost MAX_TASK_ATTEMPTS times fails its future instead. Local worker
+    processes that died are replaced.
+    """
+
+    def __init__(self, queue_dir, local_workers=0, poll_interval=0.2, initializer=None, initargs=(),
+                 claim_timeout=CLAIM_TIMEOUT):
+        self.queue_dir = queue_dir
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self._dirs = _queue_subdirs(queue_dir)
+
+        # start from an empty queue, leftovers belong to an earlier run
+        for path in self._dirs.values():
+            os.makedirs(path, exist_ok=True)
+            for filename in os.listdir(path):
+                os.remove(os.path.join(path, filename))
+        if os.path.exists(_stop_file(queue_dir)):
+            os.remove(_stop_file(queue_dir))
+        # workers joining from other nodes run the same initializer as the local ones
+        _atomic_pickle((initializer, initargs), _initializer_file(queue_dir))
+
+        self._futures = {}
+        self._attempts = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+        self._worker_args = (queue_dir, poll_interval, initializer, initargs)
+        self._workers = [self._start_worker() for _ in range(local_workers)]
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _start_worker(self):
+        process = multiprocessing.Process(target=run_file_queue_worker, args=self._worker_args, daemon=True)
+        process.start()
+        return process
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            # zero padded counter keeps pending tasks in submission order
+            task_id = f"{self._counter:09d}_{uuid.uuid4().hex[:8]}"
+            self._counter += 1
+            future = Future()
+            self._futures[task_id] = future
+
+        _atomic_pickle((fn, args, kwargs), os.path.join(
+            self._dirs["pending"], f"{task_id}.pkl"))
+        return future
+
+    def _collect(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._shutdown and not self._futures:
+                        return
+
+                self._collect_done()
+                # reaps dead local workers first, so their PIDs are gone when claims are checked
+                self._replace_dead_workers()
+                self._requeue_lost_claims()
+                time.sleep(self.poll_interval)
+        finally:
+            # only now that no future is left waiting, tell local and remote workers to exit
+            open(_stop_file(self.queue_dir), 'w').close()
+            for process in self._workers:
+                process.join()
+
+    def _collect_done(self):
+        for filename in sorted(os.listdir(self._dirs["done"])):
+            if not filename.endswith(".pkl"):
+                continue
+            task_id = filename[:-len(".pkl")]
+            done_path = os.path.join(self._dirs["done"], filename)
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+                self._attempts.pop(task_id, None)
+            if future is None:
+                # second outcome of a requeued task, or of a cancelled one
+                os.remove(done_path)
+                continue
+
+            with open(done_path, 'rb') as f:
+                ok, value = pickle.load(f)
+            os.remove(done_path)
+
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _requeue_lost_claims(self):
+        now = time.time()
+        for filename in os.listdir(self._dirs["claimed"]):
+            task_id, host, pid = _claim_owner(filename)
+            claimed_path = os.path.join(self._dirs["claimed"], filename)
+            try:
+                stat = os.stat(claimed_path)
+            except FileNotFoundError:
+                # finished meanwhile
+                continue
+
+            dead = host == socket.gethostname() and pid is not None and not _pid_alive(pid)
+            # the rename of the claim updates ctime, every heartbeat mtime
+            stale = now - max(stat.st_mtime, stat.st_ctime) > self.claim_timeout
+            if not (dead or stale):
+                continue
+
+            with self._lock:
+                attempts = self._attempts[task_id] = self._attempts.get(task_id, 1) + 1
+                future = self._futures.get(task_id)
+                if future is not None and attempts > MAX_TASK_ATTEMPTS:
+                    del self._futures[task_id]
+            if future is None or attempts > MAX_TASK_ATTEMPTS:
+                os.remove(claimed_path)
+                if future is not None:
+                    future.set_exception(RuntimeError(
+                        f"Task {task_id} was lost with its worker {MAX_TASK_ATTEMPTS} times"))
+                continue
+
+            logging.warning(f"Requeueing task {task_id} of lost worker {host}:{pid}")
+            try:
+                os.rename(claimed_path, os.path.join(self._dirs["pending"], f"{task_id}.pkl"))
+            except FileNotFoundError:
+                pass
+
+    def _replace_dead_workers(self):
+        with self._lock:
+            if self._shutdown and not self._futures:
+                return
+        for i, process in enumerate(self._workers):
+            if not process.is_alive():
+                logging.warning(f"File queue worker {process.pid} exited with {process.exitcode}, "
+                                f"starting a new one")
+                self._workers[i] = self._start_worker()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                for future in self._futures.values():
+                    future.cancel()
+                self._futures.clear()
+
+        # the collector stops the workers once every remaining future is resolved
+        if wait:
+            self._collector.join()
@@ -0,0 +1,193 @@
+import functools
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from scripts.globals import NUCLEOTIDE_OFFSET, RNADUPLEX_LOCATION
+
+# bump when the layout of the cached arrays or the step 3 features change
+FEATURE_CACHE_VERSION = 1
+
+_CHUNK_FILE = re.compile(r"^(?P<vcf_id>.+)_(?P<start>\d+)_(?P<end>\d+)\.npz$")
+
+
+@functools.lru_cache(maxsize=None)
+def rnaduplex_version():
+    """
+    Identify the RNAduplex build the features were folded with.
+
+    Returns:
+        str: The first line of 'RNAduplex --version', or a hash of the executable when it does
+            not report a version, or "unknown" when it cannot be found.
+    """
+    try:
+        output = subprocess.run([RNADUPLEX_LOCATION, "--version"], stdin=subprocess.DEVNULL,
+                                capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        output = ""
+    if output.startswith("RNAduplex"):
+        return output.splitlines()[0]
+
+    try:
+        with open(RNADUPLEX_LOCATION, 'rb') as f:
+            return "sha1:" + hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return "unknown"
+
+
+def feature_cache_key(chunk, config):
+    """
+    Key the features of a chunk by everything that changes them: the chunk records, the flank
+    window, the RNAduplex build, the miRNA panel, the pre-filter and the pair pruning.
+
+    Args:
+        chunk (pandas.DataFrame): The chunk as submitted to process_chunk.
+        config (PipelineConfig): Settings of the run.
+
+    Returns:
+        dict: The key components, including their combined 'digest'.
+    """
+    key = {
+        "version": FEATURE_CACHE_VERSION,
+        "input_sha1": hashlib.sha1(chunk.to_csv(index=False).encode()).hexdigest(),
+        "window": NUCLEOTIDE_OFFSET,
+        "rnaduplex": rnaduplex_version(),
+        "mirna_panel": list(config.mirna_panel) if config.mirna_panel is not None else None,
+        "prefilter": [list(config.prefilter), config.prefilter_bed],
+        "pruning": [config.prune_pairs, config.prune_energy],
+    }
+    key["digest"] = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return key
+
+
+def chunk_feature_path(cache_dir, vcf_id, start_index, end_index):
+    return os.path.join(cache_dir, f"{vcf_id}_{start_index}_{end_index}.npz")
+
+
+def save_chunk_features(path, key, features, id_array, binary_array):
+    """
+    Store the step 3 feature matrix of a chunk as float32 with integer-coded pair keys.
+
+    Every row id ('{mutation_id}_{mirna_accession}_{wt|mut}') is stored as codes into the
+    chunk's mutation ids, miRNA accessions and wt/mut labels.
+
+    Args:
+        path (str): Path of the .npz file to write.
+        key (dict): Output of feature_cache_key.
+        features (pandas.DataFrame): Feature columns in prediction order.
+        id_array (pandas.Series): Row ids.
+        binary_array (pandas.Series): Whether the mutation lies in the MRE of the row.
+    """
+    parts = pd.Series(id_array, dtype=object).str.rsplit("_", n=2, expand=True)
+    if parts.empty:
+        parts = pd.DataFrame({0: [], 1: [], 2: []}, dtype=object)
+    mutation_codes, mutation_ids = pd.factorize(parts[0])
+    mirna_codes, mirnas = pd.factorize(parts[1])
+    label_codes, labels = pd.factorize(parts[2])
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path,
+             key=np.array(json.dumps(key, sort_keys=True)),
+             columns=np.asarray(features.columns, dtype=str),
+             features=features.to_numpy(dtype=np.float32, na_value=np.nan),
+             mutation_ids=np.asarray(mutation_ids, dtype=str),
+             mutation_codes=mutation_codes.astype(np.int32),
+             mirnas=np.asarray(mirnas, dtype=str),
+             mirna_codes=mirna_codes.astype(np.int32),
+             labels=np.asarray(labels, dtype=str),
+             label_codes=label_codes.astype(np.int8),
+             in_mre=np.asarray(binary_array, dtype=bool))
+    os.replace(tmp_path, path)
+
+
+def load_chunk_features(path, digest=None):
+    """
+    Load stored chunk features.
+
+    Args:
+        path (str): Path of the .npz file.
+        digest (str, optional): Only return the features if they were stored under this key.
+
+    Returns:
+        tuple: (features, id_array, binary_array, key) shaped like the output of
+            reorder_columns_for_prediction, or None if the file is missing or has another key.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path, allow_pickle=False) as data:
+        key = json.loads(str(data["key"]))
+        if key.get("version") != FEATURE_CACHE_VERSION or (digest is not None and key["digest"] != digest):
+            return None
+
+        features = pd.DataFrame(data["features"], columns=data["columns"])
+        ids = (pd.Series(data["mutation_ids"][data["mutation_codes"]], dtype=object) + "_"
+               + pd.Series(data["mirnas"][data["mirna_codes"]], dtype=object) + "_"
+               + pd.Series(data["labels"][data["label_codes"]], dtype=object))
+        binary_array = pd.Series(data["in_mre"], name="is_mutation_in_mre")
+
+    return features, ids.rename("id"), binary_array, key
+
+
+def require_chunk_features(path):
+    """
+    Load stored chunk features for --rescore or the energy calibration, which have nothing to
+    fall back on.
+
+    Returns:
+        tuple: (features, id_array, binary_array, key) as returned by load_chunk_features.
+
+    Raises:
+        FileNotFoundError: If the file is missing.
+        ValueError: If the file was written by another FEATURE_CACHE_VERSION.
+    """
+    stored = load_chunk_features(path)
+    if stored is None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Stored features {path} are missing, rerun with --cache-features")
+        raise ValueError(f"Stored features {path} were written by another feature cache version, "
+                         f"rerun with --cache-features")
+    return stored
+
+
+def list_cached_chunks(cache_dir, vcf_id):
+    """
+    Find the stored chunks of a VCF.
+
+    Returns:
+        list: (start_index, end_index, path) tuples in chunk order.
+    """
+    chunks = []
+    for path in glob.glob(os.path.join(cache_dir, f"{glob.escape(vcf_id)}_*.npz")):
+        match = _CHUNK_FILE.match(os.path.basename(path))
+        if match and match.group("vcf_id") == vcf_id:
+            chunks.append((int(match.group("start")), int(match.group("end")), path))
+    return sorted(chunks)
+
+
+def prune_cached_chunks(cache_dir, vcf_id, kept_labels):
+    """
+    Remove stored chunks of a VCF that the last run did not produce, e.g. after the chunk size
+    changed, so --rescore does not score their variants twice.
+
+    Args:
+        cache_dir (str): The feature cache directory.
+        vcf_id (str): The VCF whose chunks to prune.
+        kept_labels (set): '{start}_{end}' labels of the chunks to keep.
+
+    Returns:
+        int: Number of files removed.
+    """
+    removed = 0
+    for start_index, end_index, path in list_cached_chunks(cache_dir, vcf_id):
+        if f"{start_index}_{end_index}" not in kept_labels:
+            os.remove(path)
+            removed += 1
+    return removed
@@ -0,0 +1,383 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from scripts.globals import GENE_INDEX_NPZ
+
+# bump when the layout of the exported arrays changes
+GENE_INDEX_VERSION = 2
+# features the pre-filter of step 2 can keep variants in
+REGION_FEATURES = ("utr3", "exon", "gene")
+
+_loaded_indices = {}
+_load_lock = threading.Lock()
+
+
+def _sorted_intervals(contigs, starts, ends, *payload):
+    """
+    Sort intervals by contig and start, and return them with the payload arrays in the same order.
+    """
+    contigs = np.asarray(contigs, dtype=str)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    order = np.lexsort((ends, starts, contigs))
+    return [contigs[order], starts[order], ends[order]] + [np.asarray(p, dtype=str)[order] for p in payload]
+
+
+def three_prime_utr_intervals(transcript):
+    """
+    Cut the 3'UTR of a coding transcript out of its exons: every exonic base after the stop codon
+    in transcript direction.
+
+    Args:
+        transcript (pyensembl.Transcript): Transcript to cut.
+
+    Returns:
+        list: (start, end) tuples, 1-based and inclusive; empty without an annotated stop codon.
+    """
+    if not transcript.contains_stop_codon:
+        return []
+
+    stop_codon = transcript.stop_codon_positions
+    intervals = []
+    for exon in transcript.exons:
+        if transcript.strand == "+":
+            start, end = max(exon.start, max(stop_codon) + 1), exon.end
+        else:
+            start, end = exon.start, min(exon.end, min(stop_codon) - 1)
+        if start <= end:
+            intervals.append((start, end))
+    return intervals
+
+
+def export_gene_index(assembly, path=GENE_INDEX_NPZ):
+    """
+    Export the gene, exon and 3'UTR intervals of a pyensembl assembly into a compressed .npz file.
+
+    This is a one-time step per Ensembl release; afterwards step 5 annotates loci from the
+    arrays without touching the pyensembl SQLite database.
+
+    Args:
+        assembly (pyensembl.Genome): Indexed assembly, e.g. from import_pyensembl(37).
+        path (str, optional): Output path. Default is GENE_INDEX_NPZ.
+
+    Returns:
+        str: The path the index was written to.
+    """
+    genes = assembly.genes()
+    exons = assembly.exons()
+    utrs = [(t.contig, start, end) for t in assembly.transcripts()
+            for start, end in three_prime_utr_intervals(t)]
+
+    gene_contig, gene_start, gene_end, gene_id, gene_biotype = _sorted_intervals(
+        [g.contig for g in genes], [g.start for g in genes], [g.end for g in genes],
+        [g.gene_id for g in genes], [g.biotype for g in genes])
+    exon_contig, exon_start, exon_end = _sorted_intervals(
+        [e.contig for e in exons], [e.start for e in exons], [e.end for e in exons])
+    utr3_contig, utr3_start, utr3_end = _sorted_intervals(
+        [u[0] for u in utrs], [u[1] for u in utrs], [u[2] for u in utrs])
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez_compressed(path,
+                        version=np.array(GENE_INDEX_VERSION),
+                        release=np.array(str(assembly.release)),
+                        gene_contig=gene_contig, gene_start=gene_start, gene_end=gene_end,
+                        gene_id=gene_id, gene_biotype=gene_biotype,
+                        exon_contig=exon_contig, exon_start=exon_start, exon_end=exon_end,
+                        utr3_contig=utr3_contig, utr3_start=utr3_start, utr3_end=utr3_end)
+    return path
+
+
+class IntervalSet:
+    """
+    Sorted, possibly overlapping intervals of one feature type, split per contig.
+
+    For every contig the starts are sorted and the running maximum of the ends is kept,
+    so the first interval (in start order) covering each query position is found with two
+    binary searches per position, fully vectorized.
+    """
+
+    def __init__(self, contigs, starts, ends):
+        self.segments = {}
+        unique_contigs, first = np.unique(contigs, return_index=True)
+        bounds = sorted(first) + [len(contigs)]
+        for i in range(len(bounds) - 1):
+            lo, hi = bounds[i], bounds[i + 1]
+            seg_starts = starts[lo:hi]
+            seg_ends = ends[lo:hi]
+            self.segments[str(contigs[lo])] = (lo, seg_starts, np.maximum.accumulate(seg_ends))
+
+    def to_arrays(self):
+        """
+        Flatten the segments into arrays, e.g. to share them between processes.
+
+        Returns:
+            dict: 'contigs', 'offsets' and 'lengths' per segment, and the concatenated
+                'starts' and 'max_ends' of all segments.
+        """
+        contigs = list(self.segments)
+        segments = [self.segments[contig] for contig in contigs]
+        return {
+            "contigs": np.asarray(contigs, dtype=str),
+            "offsets": np.array([offset for offset, _, _ in segments], dtype=np.int64),
+            "lengths": np.array([len(starts) for _, starts, _ in segments], dtype=np.int64),
+            "starts": np.concatenate([starts for _, starts, _ in segments] or [np.zeros(0, np.int64)]),
+            "max_ends": np.concatenate([ends for _, _, ends in segments] or [np.zeros(0, np.int64)]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild an IntervalSet from to_arrays() output without copying 'starts' and 'max_ends',
+        so memory-mapped arrays stay mapped.
+        """
+        interval_set = cls.__new__(cls)
+        interval_set.segments = {}
+        position = 0
+        for contig, offset, length in zip(arrays["contigs"], arrays["offsets"], arrays["lengths"]):
+            end = position + int(length)
+            interval_set.segments[str(contig)] = (int(offset), arrays["starts"][position:end],
+                                                  arrays["max_ends"][position:end])
+            position = end
+        return interval_set
+
+    def first_overlap(self, contig, positions):
+        """
+        Find the first interval of a contig that covers each position.
+
+        Args:
+            contig (str): Contig name, e.g. "1" or "X".
+            positions (numpy.ndarray): 1-based positions.
+
+        Returns:
+            numpy.ndarray: Global index of the covering interval, or -1 where there is none.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        result = np.full(len(positions), -1, dtype=np.int64)
+        segment = self.segments.get(str(contig))
+        if segment is None:
+            return result
+
+        offset, starts, max_ends = segment
+        last_starting = np.searchsorted(starts, positions, side="right") - 1
+        # the running max of the ends only reaches a position at an interval that covers it
+        first_covering = np.searchsorted(max_ends, positions, side="left")
+        hit = first_covering <= last_starting
+        result[hit] = first_covering[hit] + offset
+        return result
+
+    def covers(self, chroms, positions):
+        """
+        Check which loci lie in any of the intervals.
+
+        Args:
+            chroms (array-like): Chromosome of each locus, with or without a 'chr' prefix.
+            positions (array-like): 1-based position of each locus.
+
+        Returns:
+            numpy.ndarray: Boolean mask over the loci.
+        """
+        chroms = np.char.replace(np.asarray(chroms).astype(str), "chr", "")
+        positions = np.asarray(positions, dtype=np.int64)
+        covered = np.zeros(len(positions), dtype=bool)
+        for contig in np.unique(chroms):
+            mask = chroms == contig
+            covered[mask] = self.first_overlap(contig, positions[mask]) >= 0
+        return covered
+
+
+class GeneIntervalIndex:
+    """
+    In-memory gene, exon and 3'UTR interval index loaded from export_gene_index() output.
+    """
+
+    def __init__(self, arrays):
+        self.release = str(arrays["release"])
+        self.gene_id = arrays["gene_id"]
+        self.gene_biotype = arrays["gene_biotype"]
+        self.genes = IntervalSet(arrays["gene_contig"], arrays["gene_start"], arrays["gene_end"])
+        self.exons = IntervalSet(arrays["exon_contig"], arrays["exon_start"], arrays["exon_end"])
+        self.utr3 = IntervalSet(arrays["utr3_contig"], arrays["utr3_start"], arrays["utr3_end"])
+
+    def features(self, name):
+        """
+        Returns:
+            IntervalSet: The 'utr3', 'exon' or 'gene' intervals.
+        """
+        return {"utr3": self.utr3, "exon": self.exons, "gene": self.genes}[name]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != GENE_INDEX_VERSION:
+                raise ValueError(f"{path} was written by another version of the gene index, "
+                                 f"export it again")
+            return cls({key: data[key] for key in data.files})
+
+    @staticmethod
+    def is_current(path):
+        """
+        Whether an index exported by this version of the code is at `path`.
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path, allow_pickle=False) as data:
+            return "version" in data.files and int(data["version"]) == GENE_INDEX_VERSION
+
+    def annotate(self, chroms, positions):
+        """
+        Assign gene ID, biotype and intron status to loci.
+
+        Where several genes overlap a locus the one starting first is reported, matching the
+        first entry pyensembl's gene_ids_at_locus returns. A locus is intronic when it lies
+        in a gene but in none of the exons.
+
+        Args:
+            chroms (array-like): Chromosome of each locus.
+            positions (array-like): 1-based position of each locus.
+
+        Returns:
+            pandas.DataFrame: Columns 'gene_id', 'biotype' (NaN outside genes) and 'is_intron'.
+        """
+        chroms = np.asarray(chroms).astype(str)
+        positions = np.asarray(positions, dtype=np.int64)
+        gene_hits = np.full(len(positions), -1, dtype=np.int64)
+        in_exon = np.zeros(len(positions), dtype=bool)
+
+        for contig in np.unique(chroms):
+            mask = chroms == contig
+            gene_hits[mask] = self.genes.first_overlap(contig, positions[mask])
+            in_exon[mask] = self.exons.first_overlap(contig, positions[mask]) >= 0
+
+        in_gene = gene_hits >= 0
+
+        return pd.DataFrame({
+            "gene_id": pd.Series(self.gene_id[gene_hits], dtype=object).where(in_gene, np.nan),
+            "biotype": pd.Series(self.gene_biotype[gene_hits], dtype=object).where(in_gene, np.nan),
+            "is_intron": in_gene & ~in_exon,
+        })
+
+
+def _default_assembly():
+    # the GRCh37 assembly the index is exported from, or None when pyensembl is not installed
+    try:
+        from scripts.pyensembl_operations import import_pyensembl
+        return import_pyensembl(37)
+    except ImportError:
+        return None
+
+
+def load_gene_index(assembly=None, path=GENE_INDEX_NPZ):
+    """
+    Load the gene interval index, exporting it first if it is not on disk yet or was written by
+    another version of the gene index.
+
+    The loaded index is kept per path, so repeated step 5 calls share one copy.
+
+    Args:
+        assembly (pyensembl.Genome, optional): Assembly to export the index from. When omitted
+            and the index has to be exported, the GRCh37 assembly is loaded with pyensembl.
+        path (str, optional): Location of the index. Default is GENE_INDEX_NPZ.
+
+    Returns:
+        GeneIntervalIndex: The loaded index.
+
+    Raises:
+        FileNotFoundError: If the index is missing or stale and pyensembl is not installed.
+    """
+    with _load_lock:
+        if path not in _loaded_indices:
+            if not GeneIntervalIndex.is_current(path):
+                if assembly is None:
+                    assembly = _default_assembly()
+                if assembly is None:
+                    state = "an outdated" if os.path.exists(path) else "no"
+                    raise FileNotFoundError(
+                        f"Found {state} gene index at {path} and pyensembl is not installed "
+                        f"to export one")
+                export_gene_index(assembly, path)
+            _loaded_indices[path] = GeneIntervalIndex.load(path)
+        return _loaded_indices[path]
+
+
+def annotate_gene_columns(df, index):
+    """
+    Add 'gene_id', 'biotype' and 'is_intron' columns from the 'chr' and 'pos' columns in one pass.
+
+    Args:
+        df (pandas.DataFrame): DataFrame with 'chr' and 'pos' columns.
+        index (GeneIntervalIndex): Loaded gene interval index.
+
+    Returns:
+        pandas.DataFrame: The input DataFrame with the three annotation columns added.
+    """
+    annotation = index.annotate(df["chr"].to_numpy(), df["pos"].to_numpy())
+    for col in annotation.columns:
+        df[col] = annotation[col].to_numpy()
+    return df
+
+
+def load_bed_intervals(path):
+    """
+    Load the intervals of a BED file (0-based, half-open) as 1-based inclusive intervals.
+
+    Only the first three columns are read; a 'chr' prefix on the contig names is dropped.
+
+    Args:
+        path (str): Path to the BED file.
+
+    Returns:
+        IntervalSet: The intervals, kept per path like the gene index.
+    """
+    with _load_lock:
+        key = ("bed", path)
+        if key not in _loaded_indices:
+            bed = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1, 2], comment="#",
+                              names=["contig", "start", "end"], dtype={"contig": str})
+            bed = bed[~bed["contig"].str.startswith(("track", "browser"))]
+            contigs, starts, ends = _sorted_intervals(
+                bed["contig"].str.removeprefix("chr"), bed["start"].astype(np.int64) + 1,
+                bed["end"].astype(np.int64))
+            _loaded_indices[key] = IntervalSet(contigs, starts, ends)
+        return _loaded_indices[key]
+
+
+def load_region_filter(features=(), bed_path=None, path=GENE_INDEX_NPZ):
+    """
+    Collect the interval sets the step 2 pre-filter keeps variants in.
+
+    Args:
+        features (iterable, optional): Names from REGION_FEATURES, looked up in the gene index.
+        bed_path (str, optional): BED file with further intervals to keep.
+        path (str, optional): Location of the gene index. Default is GENE_INDEX_NPZ.
+
+    Returns:
+        list: IntervalSet objects; a variant is kept when any of them covers it.
+    """
+    with _load_lock:
+        shared = _loaded_indices.get(_region_filter_key(features, bed_path, path))
+    if shared is not None:
+        return shared
+
+    interval_sets = []
+    if features:
+        index = load_gene_index(path=path)
+        interval_sets.extend(index.features(name) for name in features)
+    if bed_path:
+        interval_sets.append(load_bed_intervals(bed_path))
+    return interval_sets
+
+
+def _region_filter_key(features, bed_path, path):
+    return ("region_filter", tuple(features), bed_path, path)
+
+
+def share_region_filter(interval_sets, features=(), bed_path=None, path=GENE_INDEX_NPZ):
+    """
+    Make load_region_filter return `interval_sets` for these arguments in this process, e.g.
+    interval sets attached from a reference store instead of loaded from the gene index.
+    """
+    with _load_lock:
+        _loaded_indices[_region_filter_key(features, bed_path, path)] = interval_sets
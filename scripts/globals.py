@@ -1,3 +1,4 @@
+import os
 from socket import gethostname
 
 def get_pyensembl_cache_location():
@@ -19,9 +20,10 @@ def get_rnaduplex_location():
         return "/truba/home/mtasbas/miniconda3/envs/venv/bin/RNAduplex"
     
 PYENSEMBL_CACHE_DIR = get_pyensembl_cache_location()
-RNADUPLEX_LOCATION = get_rnaduplex_location()
+# MIRSCRIBE_RNADUPLEX and MIRSCRIBE_GRCH37_DIR let the benchmarks swap in a stub and a toy reference
+RNADUPLEX_LOCATION = os.environ.get("MIRSCRIBE_RNADUPLEX") or get_rnaduplex_location()
 
-GRCH37_DIR = "data/fasta/grch37"
+GRCH37_DIR = os.environ.get("MIRSCRIBE_GRCH37_DIR", "data/fasta/grch37")
 MIRNA_COORDS_DIR = "data/mirna_coordinates"
 TA_SPS_CSV = "data/ta_sps/ta_sps.csv"
 MIRNA_CSV = "data/mirna/mirna.csv"
@@ -29,10 +31,25 @@ XGB_MODEL = "misc/models/model_with_no_close_proximity.json"
 
 NUCLEOTIDE_OFFSET = 30
 
+# per-process memory budgets of the memoization caches in MB, scaled together by --cache-mb
+CACHE_BUDGETS_MB = {
+    "nucleotides_in_interval": 128,
+    "nucleotide_at_position": 32,
+    "upstream_sequence": 64,
+    "downstream_sequence": 64,
+    "mre_sequence": 32,
+    "split_mutation_id": 64,
+}
+
 
 AWK_SCRIPT_PATH = "scripts/rnaduplex_to_csv.awk"
 AWK_SCRIPT_PATH_NEW = "scripts/rnaduplex_to_csv_new.awk"
 
+# gene/exon intervals exported once from pyensembl by scripts.gene_index.export_gene_index
+GENE_INDEX_NPZ = "data/ensembl_index/ensembl75_grch37_intervals.npz"
+
 MUTSIG_PROBABILITIES = "data/mutsig_probabilities/probabilities.csv"
 MUTSIG_PROBABILITIES_560 = "data/mutsig_probabilities/probabilities_560.csv"
+# compact sample x context indices of the probability tables, rebuilt when a table changes
+MUTSIG_INDEX_DIR = "data/mutsig_probabilities/index"
 
@@ -1,33 +1,278 @@
 import os
 import csv
 from typing import List
-import pandas as pd
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from dataclasses import replace
 
-from scripts.pipeline_orchestration import *
-from scripts.utils.misc_utils import time_it
+from scripts.pipeline_orchestration import process_chunk, process_region, rescore_chunk
+from scripts.config import PipelineConfig
+from scripts.executors import create_executor
+from scripts.chunking import AdaptiveChunkSizer
+from scripts.feature_cache import list_cached_chunks, prune_cached_chunks
+from scripts.gene_index import load_region_filter
+from scripts.output_sink import open_output_sink, replay_outputs
+from scripts.reference_data import load_mirna_table
+from scripts.shared_reference import attach_reference_store, reference_store, uses_reference_store
+from scripts.vcf_reader import MAX_CHROMOSOME_REGION, open_vcf_reader, has_tabix_index, plan_regions
+from scripts.utils.cache_utils import configure_cache_budgets
+from scripts.utils.instrumentation import RunReport
 
-from scripts.config import WORKERS, PROFILER
 
+def run_pipeline(config: PipelineConfig) -> RunReport:
+    """
+    Split the VCF file into chunks, run process_chunk on each through the configured
+    executor and collect the per-chunk stage timings.
+
+    Args:
+        config (PipelineConfig): Settings of the run; chunk results go to config.output_dir.
+
+    Returns:
+        RunReport: Stage timings, row counts and memory figures of all chunks.
+    """
+    chunksize = config.chunksize
+    report = RunReport(config.vcf_id, settings={
+        "vcf": config.vcf_full_path, "chunksize": chunksize, "workers": config.workers,
+        "backend": config.backend, "adaptive": config.adaptive_chunks,
+        "threshold": config.filter_threshold, "prefilter": list(config.prefilter),
+        "prefilter_bed": config.prefilter_bed, "model": config.model_path,
+        "prune": config.prune_pairs, "prune_energy": config.prune_energy,
+        "fold_workers": config.fold_workers})
+
+    if not config.rescore and (config.prefilter or config.prefilter_bed):
+        # fail before any chunk is submitted when the gene index or the BED file is missing, and
+        # export an outdated gene index here once rather than in every worker
+        load_region_filter(config.prefilter, config.prefilter_bed)
+
+    if not config.rescore and config.mirna_panel is not None:
+        # folding cost scales with the panel, so the run records exactly which miRNAs it used
+        panel_mirnas = load_mirna_table(config.mirna_panel)["mirna_accession"]
+        report.extra["mirna_panel"] = {"file": config.mirna_panel_file, "query": config.mirna_panel_query,
+                                       "size": len(panel_mirnas), "mirnas": panel_mirnas.tolist()}
+        logging.info(f"miRNA panel of {len(panel_mirnas)} miRNAs")
+
+    # one writer thread owns every output file of the run; all writes are on disk once it closes
+    with reference_store(config) as (store_dir, store_bytes), open_output_sink() as sink:
+        if store_dir is not None:
+            report.extra["shared_reference"] = {"dir": store_dir, "mb": store_bytes / 1024 ** 2}
+        if config.rescore:
+            run_rescore(config, report)
+        elif config.region_mode:
+            run_regions(config, report)
+        else:
+            run_chunks(config, report)
+    report.extra["output_sink"] = sink.stats()
 
-@time_it(enabled=PROFILER)
-def run_pipeline(vcf_full_path: str, chunksize: int, output_dir: str, vcf_id: str):
-    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+    if config.cache_features and not config.rescore:
+        summarize_feature_cache(config, report)
 
-        futures = []
+    return report
+
+
+def run_chunks(config: PipelineConfig, report: RunReport):
+    """
+    Stream the VCF in chunks and submit process_chunk for each through the configured executor.
+
+    Args:
+        config (PipelineConfig): Settings of the run.
+        report (RunReport): Report the chunk records are added to.
+    """
+    chunksize = config.chunksize
+    reader = open_vcf_reader(config.vcf_full_path, chunksize, vcf_id=config.vcf_id)
+
+    sizer = None
+    if config.adaptive_chunks:
+        sizer = AdaptiveChunkSizer(chunksize, config.target_chunk_seconds, config.worker_memory_mb,
+                                   min_size=config.min_chunksize, max_size=config.max_chunksize)
+
+    # with --fold-workers 0, read up to one chunk per worker ahead to see whether the VCF
+    # has fewer chunks than there are workers
+    pending, exhausted = [], False
+    if config.fold_workers == 0:
+        while len(pending) < config.workers and not exhausted:
+            try:
+                pending.append(reader.get_chunk(chunksize))
+            except StopIteration:
+                exhausted = True
+        n_chunks = len(pending) if exhausted else None
+        config = replace(config, fold_workers=auto_fold_workers(n_chunks, config.workers))
+        report.extra["fold_workers"] = config.fold_workers
+
+    with open_executor(config) as executor:
+
+        futures = set()
         start_index = 0
-        for chunk in pd.read_csv(vcf_full_path, chunksize=chunksize, sep="\t", header=None, names=["chr", "pos", "id", "ref", "alt"]):
+        while True:
+            # in adaptive mode only keep one chunk per worker (plus one queued) in flight,
+            # so the size of every later chunk is based on the chunks that finished
+            while sizer is not None and len(futures) > config.workers:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk_record = future.result()[2]
+                    collect_chunk(report, chunk_record)
+                    sizer.record(chunk_record)
+
+            if pending:
+                chunk = pending.pop(0)
+            elif exhausted:
+                break
+            else:
+                try:
+                    chunk = reader.get_chunk(sizer.next_size() if sizer else chunksize)
+                except StopIteration:
+                    break
+            if chunk.empty:
+                # every record of the chunk had only symbolic or missing ALT alleles
+                continue
+
             end_index = start_index + len(chunk) - 1
             future = executor.submit(
-                process_chunk, chunk, start_index, end_index, output_dir, vcf_id)
-            futures.append(future)
+                process_chunk, chunk, start_index, end_index, config)
+            futures.add(future)
             start_index = end_index + 1
 
         for future in as_completed(futures):
-            start_index, end_index = future.result()
+            start_index, end_index, chunk_record = future.result()
+            collect_chunk(report, chunk_record)
+            if sizer is not None:
+                sizer.record(chunk_record)
+
+    if sizer is not None:
+        report.extra["adaptive_chunking"] = sizer.summary()
+        logging.info(f"Adaptive chunking summary: {sizer.summary()}")
+
+    report.extra["vcf_records"] = reader.records_read
+    report.extra["alleles_dropped"] = reader.alleles_dropped
+
+
+def init_worker(cache_mb=None, store_dir=None):
+    """
+    Prepare a worker process of the run: scale its cache budgets and attach it to the run's
+    reference store.
+
+    Args:
+        cache_mb (float, optional): Combined cache budget of the run, see configure_cache_budgets.
+        store_dir (str, optional): Reference store written by the driver.
+    """
+    if cache_mb is not None:
+        configure_cache_budgets(cache_mb)
+    if store_dir is not None:
+        attach_reference_store(store_dir)
+
+
+def open_executor(config: PipelineConfig):
+    """
+    Create the executor of the run; its worker processes, including filequeue workers joining
+    from other nodes, are prepared by init_worker.
+    """
+    store_dir = config.reference_store_path if uses_reference_store(config) else None
+    return create_executor(config.backend, config.workers, queue_dir=config.queue_path,
+                           scheduler_address=config.scheduler_address,
+                           initializer=init_worker, initargs=(config.cache_mb, store_dir))
+
+
+def collect_chunk(report: RunReport, chunk_record: dict):
+    """
+    Write the outputs a chunk collected in a worker process and add its record to the report.
+    """
+    replay_outputs(chunk_record)
+    report.add_chunk(chunk_record)
+
+
+def auto_fold_workers(n_chunks, workers):
+    """
+    Pick the RNAduplex processes per chunk for --fold-workers 0: spread the workers over the
+    chunks when there are fewer chunks than workers, otherwise fold every chunk in one process.
+
+    Args:
+        n_chunks (int): Number of chunks (or regions), None when there are at least `workers`.
+        workers (int): Number of concurrent workers of the run.
+
+    Returns:
+        int: RNAduplex processes per chunk.
+    """
+    if n_chunks is None or n_chunks >= workers:
+        return 1
+    return max(1, workers // max(n_chunks, 1))
+
+
+def run_rescore(config: PipelineConfig, report: RunReport):
+    """
+    Predict every chunk again from the features stored by an earlier run with cache_features,
+    without reading the VCF or running steps 1 to 3.
+
+    Args:
+        config (PipelineConfig): Settings of the run; 'model_path' selects the new model.
+        report (RunReport): Report the chunk records are added to.
+    """
+    cache_dir = config.feature_cache_path
+    chunks = list_cached_chunks(cache_dir, config.vcf_id)
+    if not chunks:
+        raise FileNotFoundError(f"No stored features of {config.vcf_id} in {cache_dir}, "
+                                f"run the pipeline with --cache-features first")
+
+    with open_executor(config) as executor:
+        futures = [executor.submit(rescore_chunk, path, start_index, end_index, config)
+                   for start_index, end_index, path in chunks]
+        for future in as_completed(futures):
+            collect_chunk(report, future.result()[2])
+
+    report.extra["rescore"] = {
+        "feature_cache": cache_dir, "chunks": len(chunks), "model": config.model_path,
+        "rnaduplex": sorted({chunk["rnaduplex"] for chunk in report.chunks}),
+        "window": sorted({chunk["window"] for chunk in report.chunks})}
+
+
+def summarize_feature_cache(config: PipelineConfig, report: RunReport):
+    """
+    Record the feature cache hits of the run and drop the stored chunks that do not hold this
+    run's features (older chunk boundaries, or chunks left with nothing to fold).
+    """
+    outcomes = [chunk.get("feature_cache") for chunk in report.chunks]
+    current = {chunk["chunk"] for chunk in report.chunks if chunk.get("feature_cache") in ("hit", "stored")}
+    pruned = prune_cached_chunks(config.feature_cache_path, config.vcf_id, current)
+    report.extra["feature_cache"] = {"dir": config.feature_cache_path, "hits": outcomes.count("hit"),
+                                     "stored": outcomes.count("stored"), "pruned": pruned}
+
+
+
 
+def run_regions(config: PipelineConfig, report: RunReport):
+    """
+    Submit one process_region task per region of a tabix-indexed VCF and collect their chunks.
+
+    Args:
+        config (PipelineConfig): Settings of the run with region_mode 'chromosome' or 'window'.
+        report (RunReport): Report the chunk records are added to.
+    """
+    if not has_tabix_index(config.vcf_full_path):
+        raise ValueError(f"--regions needs a tabix index next to {config.vcf_full_path}")
+    if config.adaptive_chunks:
+        logging.warning("--adaptive is ignored with --regions, chunks are cut per region")
+
+    if config.region_mode == "window":
+        regions = plan_regions(config.vcf_full_path, window_size=config.region_size)
+    else:
+        regions = plan_regions(config.vcf_full_path, max_region_size=MAX_CHROMOSOME_REGION)
+    if config.fold_workers == 0:
+        config = replace(config, fold_workers=auto_fold_workers(len(regions), config.workers))
+        report.extra["fold_workers"] = config.fold_workers
+    totals = {"regions": len(regions), "records": 0, "alleles_dropped": 0, "read_seconds": 0.0}
+
+    with open_executor(config) as executor:
+        futures = [executor.submit(process_region, region_index, region, config)
+                   for region_index, region in enumerate(regions)]
+
+        for future in as_completed(futures):
+            region_record = future.result()
+            for chunk_record in region_record["chunks"]:
+                collect_chunk(report, chunk_record)
+            for key in ("records", "alleles_dropped", "read_seconds"):
+                totals[key] += region_record[key]
 
+    report.extra["vcf_records"] = totals["records"]
+    report.extra["alleles_dropped"] = totals["alleles_dropped"]
+    report.extra["region_reading"] = totals
 
 
 def delete_fasta_files(directory: str):
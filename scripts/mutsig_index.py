@@ -0,0 +1,143 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from scripts.globals import MUTSIG_INDEX_DIR
+
+# bump when the layout of the cached arrays changes
+MUTSIG_INDEX_VERSION = 1
+
+_loaded_indices = {}
+_load_lock = threading.Lock()
+
+
+def _index_path(mutsig_file, index_dir):
+    name = os.path.splitext(os.path.basename(mutsig_file))[0]
+    # files with the same name in different folders get different indices
+    path_hash = hashlib.sha1(os.path.abspath(mutsig_file).encode()).hexdigest()[:8]
+    return os.path.join(index_dir, f"{name}_{path_hash}.npz")
+
+
+def _source_signature(mutsig_file):
+    stat = os.stat(mutsig_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def build_mutsig_index(mutsig_file, index_path):
+    """
+    Convert a probabilities CSV ('Sample Names', 'MutationTypes', 'mutsig') into a dense
+    sample × context matrix of signature codes and save it as .npz.
+
+    Args:
+        mutsig_file (str): Path of the probabilities CSV.
+        index_path (str): Path of the .npz file to write.
+    """
+    table = pd.read_csv(mutsig_file, usecols=["Sample Names", "MutationTypes", "mutsig"])
+    # later rows win, like building a dict from the rows in order
+    table = table.drop_duplicates(subset=["Sample Names", "MutationTypes"], keep="last")
+
+    sample_codes, samples = pd.factorize(table["Sample Names"], sort=True)
+    context_codes, contexts = pd.factorize(table["MutationTypes"], sort=True)
+    signature_codes, signatures = pd.factorize(table["mutsig"], sort=True)
+
+    matrix = np.full((len(samples), len(contexts)), -1, dtype=np.int16)
+    matrix[sample_codes, context_codes] = signature_codes
+
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path,
+             version=np.array(MUTSIG_INDEX_VERSION),
+             source=_source_signature(mutsig_file),
+             samples=np.asarray(samples, dtype=str),
+             contexts=np.asarray(contexts, dtype=str),
+             signatures=np.asarray(signatures, dtype=str),
+             matrix=matrix)
+    os.replace(tmp_path, index_path)
+
+
+class MutsigIndex:
+    """
+    Signature lookup by sample and mutation context from a cached code matrix.
+    """
+
+    def __init__(self, arrays):
+        self.samples = pd.Index(arrays["samples"])
+        self.contexts = pd.Index(arrays["contexts"])
+        self.signatures = pd.Index(arrays["signatures"])
+        self.matrix = arrays["matrix"]
+
+    @staticmethod
+    def _codes(values, index):
+        # code every distinct value once and broadcast through the categorical codes
+        categorical = pd.Categorical(values)
+        category_codes = index.get_indexer(categorical.categories.astype(str))
+        return np.where(categorical.codes >= 0, category_codes[categorical.codes], -1)
+
+    def lookup_codes(self, sample_codes, context_codes):
+        """
+        Look up signature codes for integer-coded samples and contexts (-1 means unknown).
+
+        Returns:
+            numpy.ndarray: Signature codes, -1 where there is no entry.
+        """
+        found = (sample_codes >= 0) & (context_codes >= 0)
+        result = np.full(len(sample_codes), -1, dtype=np.int16)
+        result[found] = self.matrix[sample_codes[found], context_codes[found]]
+        return result
+
+    def lookup(self, samples, contexts):
+        """
+        Look up the signature of every (sample, mutation context) pair.
+
+        Args:
+            samples (array-like): Sample names, e.g. the 'vcf_id' column.
+            contexts (array-like): SBS96 contexts, e.g. the 'mutation_context' column.
+
+        Returns:
+            pandas.Categorical: Signature names, NaN where the pair is not in the table.
+        """
+        codes = self.lookup_codes(self._codes(samples, self.samples),
+                                  self._codes(contexts, self.contexts))
+        return pd.Categorical.from_codes(codes, categories=self.signatures).remove_unused_categories()
+
+
+def load_mutsig_index(mutsig_file, index_dir=MUTSIG_INDEX_DIR):
+    """
+    Load the cached index of a probabilities CSV, rebuilding it if the CSV has changed.
+
+    The loaded index is kept in memory, so step 5 over many result files parses the
+    CSV at most once.
+
+    Args:
+        mutsig_file (str): Path of the probabilities CSV.
+        index_dir (str, optional): Directory of the cached indices. Default is MUTSIG_INDEX_DIR.
+
+    Returns:
+        MutsigIndex: The loaded index.
+    """
+    index_path = _index_path(mutsig_file, index_dir)
+
+    with _load_lock:
+        cached = _loaded_indices.get(mutsig_file)
+        source = _source_signature(mutsig_file)
+        if cached is not None and np.array_equal(cached[0], source):
+            return cached[1]
+
+        arrays = None
+        if os.path.exists(index_path):
+            with np.load(index_path, allow_pickle=False) as data:
+                if (int(data["version"]) == MUTSIG_INDEX_VERSION
+                        and np.array_equal(data["source"], source)):
+                    arrays = {key: data[key] for key in data.files}
+
+        if arrays is None:
+            build_mutsig_index(mutsig_file, index_path)
+            with np.load(index_path, allow_pickle=False) as data:
+                arrays = {key: data[key] for key in data.files}
+
+        index = MutsigIndex(arrays)
+        _loaded_indices[mutsig_file] = (source, index)
+        return index
@@ -0,0 +1,217 @@
+"""
+Single-writer sink for the files chunks produce: result files, case 2 files, the invalid rows
+report and the time_it log.
+
+During run_pipeline one writer thread in the driver owns every output handle. Chunks running in
+driver threads hand their writes to it through a bounded queue; chunks running in other
+processes (or on other nodes) collect their writes, which the driver replays into the sink when
+the chunk returns. Without an open sink (e.g. when the steps are called directly) the writes
+happen immediately, as before.
+"""
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+# writes waiting for the writer thread before the workers block
+OUTPUT_QUEUE_SIZE = 256
+# writes taken off the queue in one go, so appends to the same file are combined
+OUTPUT_BATCH_SIZE = 64
+
+_local = threading.local()
+_shared_sink = None
+
+
+def _write_now(operation):
+    kind, path, text, header = operation
+    if kind == "write":
+        with open(path, 'w') as f:
+            f.write(text)
+    else:
+        new_file = not os.path.isfile(path)
+        with open(path, 'a') as f:
+            if new_file and header:
+                f.write(header)
+            f.write(text)
+
+
+class OutputSink:
+    """
+    Writer thread that performs every queued write, keeping append handles open across writes.
+
+    Args:
+        max_queue (int, optional): Number of writes that may wait before callers block.
+    """
+
+    def __init__(self, max_queue=OUTPUT_QUEUE_SIZE):
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.writes = 0
+        self.batches = 0
+        self._handles = {}
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="output-sink", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation):
+        if self._error is not None:
+            raise RuntimeError("The output sink stopped after a failed write") from self._error
+        self.queue.put(operation)
+
+    def _append(self, path, text, header):
+        handle = self._handles.get(path)
+        if handle is None:
+            new_file = not os.path.isfile(path)
+            handle = self._handles[path] = open(path, 'a')
+            if new_file and header:
+                handle.write(header)
+        handle.write(text)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < OUTPUT_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            appends = {}
+            for operation in batch:
+                if operation is None:
+                    stop = True
+                    continue
+                kind, path, text, header = operation
+                if kind == "append":
+                    appends.setdefault((path, header), []).append(text)
+                elif self._error is None:
+                    try:
+                        _write_now(operation)
+                    except Exception as e:
+                        self._error = e
+                        logging.error(f"Writing {path} failed: {e}")
+
+            if self._error is None:
+                try:
+                    for (path, header), texts in appends.items():
+                        self._append(path, "".join(texts), header)
+                    for handle in self._handles.values():
+                        handle.flush()
+                except Exception as e:
+                    self._error = e
+                    logging.error(f"Appending to {path} failed: {e}")
+
+            if len(batch) > stop:
+                self.writes += len(batch) - stop
+                self.batches += 1
+
+    def close(self):
+        """
+        Wait for every queued write, close the handles and re-raise a failed write.
+        """
+        self.queue.put(None)
+        self._thread.join()
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+        if self._error is not None:
+            raise self._error
+
+    def stats(self):
+        return {"writes": self.writes, "batches": self.batches}
+
+
+class CollectingSink:
+    """
+    Records the writes of a chunk running outside the driver, to be replayed there.
+    """
+
+    def __init__(self):
+        self.operations = []
+
+    def submit(self, operation):
+        self.operations.append(operation)
+
+
+def current_sink():
+    sink = getattr(_local, "sink", None)
+    if sink is not None:
+        return sink
+    # a forked worker inherits the driver's sink object, but not its writer thread
+    if _shared_sink is not None and _shared_sink.pid == os.getpid():
+        return _shared_sink
+    return None
+
+
+def _submit(operation):
+    sink = current_sink()
+    if sink is None:
+        _write_now(operation)
+    else:
+        sink.submit(operation)
+
+
+def write_text(path, text):
+    """
+    Write a whole file, e.g. a chunk result CSV, through the current sink.
+    """
+    _submit(("write", path, text, None))
+
+
+def append_text(path, text, header=None):
+    """
+    Append to a shared file through the current sink, writing `header` first if the file is new.
+    """
+    _submit(("append", path, text, header))
+
+
+@contextmanager
+def open_output_sink(max_queue=OUTPUT_QUEUE_SIZE):
+    """
+    Start the driver's writer thread for the duration of the block.
+
+    Yields:
+        OutputSink: The sink; it is closed, and all writes are on disk, when the block ends.
+    """
+    global _shared_sink
+    sink = OutputSink(max_queue)
+    previous, _shared_sink = _shared_sink, sink
+    try:
+        yield sink
+    finally:
+        _shared_sink = previous
+        sink.close()
+
+
+@contextmanager
+def chunk_outputs():
+    """
+    Bind a CollectingSink to the current thread unless the driver's sink is reachable.
+
+    Yields:
+        CollectingSink: The collected writes, or None when they go to the driver's sink directly.
+    """
+    if current_sink() is not None:
+        yield None
+        return
+
+    collector = CollectingSink()
+    previous = getattr(_local, "sink", None)
+    _local.sink = collector
+    try:
+        yield collector
+    finally:
+        _local.sink = previous
+
+
+def replay_outputs(chunk_record):
+    """
+    Hand the writes a chunk collected in another process to the current sink (or write them).
+
+    Args:
+        chunk_record (dict): Chunk record; its 'outputs' entry is removed.
+    """
+    for operation in chunk_record.pop("outputs", None) or ():
+        _submit(tuple(operation))
@@ -1,118 +1,463 @@
+import io
 import pandas as pd
 import os
 import gc
-from scripts.utils.misc_utils import time_it
+import time
+from dataclasses import dataclass
+from scripts.utils.instrumentation import chunk_recorder, span
+from scripts.utils.cache_utils import cache_stats
 
-from scripts.pipeline_steps.step1 import *
-from scripts.pipeline_steps.step2 import *
-from scripts.pipeline_steps.step3 import *
-from scripts.pipeline_steps.step4 import *
+from scripts.pipeline_steps.step1 import (split_invalid_ref_rows, write_invalid_rows_report,
+                                          generate_is_mirna_column, add_sequence_columns)
+from scripts.pipeline_steps.step2 import (prefilter_case_1_mutations, split_mutation_cases,
+                                          write_case_2_mutations, prepare_job_fastas_sharded,
+                                          run_rnaduplex_and_awk_sharded, generate_job_fasta_records,
+                                          run_rnaduplex_on_string, rnaduplex_output_to_csv_lines)
+from scripts.pipeline_steps.step3 import (process_rnaduplex_output, mutation_in_mre_mask, prune_duplex_pairs,
+                                          generate_mirna_conservation_column,
+                                          split_mutation_ids, generate_mre_coordinate_columns,
+                                          generate_au_content_columns, generate_ta_sps_columns,
+                                          generate_alignment_string_from_dot_bracket,
+                                          generate_match_count_columns, generate_important_sites_column,
+                                          generate_seed_type_columns)
+from scripts.pipeline_steps.step4 import (reorder_columns_for_prediction, make_predictions_with_xgb,
+                                          create_results_df)
+from scripts.config import PipelineConfig
+from scripts.output_sink import chunk_outputs, write_text
+from scripts.feature_cache import (feature_cache_key, chunk_feature_path, load_chunk_features,
+                                   require_chunk_features, save_chunk_features)
+from scripts.gene_index import load_region_filter
+from scripts.reference_data import load_mirna_sequences
+from scripts.vcf_reader import RegionChunkReader
 
-from scripts.config import SKIP_RNADUPLEX, FILTER_THRESHOLD, PROFILER
+RESULT_COLUMNS = ["id", "wt_prediction", "mut_prediction", "pred_difference"]
+# row index offset between regions, so chunk file names stay unique in --regions mode
+REGION_ROW_STRIDE = 10 ** 8
 
-@time_it(enabled=PROFILER)
-def analysis_pipeline(df: pd.DataFrame, start_index: int, end_index: int, output_dir: str, vcf_id: str, verbose: bool = False,) -> pd.DataFrame:
 
-    rnaduplex_output_file = os.path.join(
-        output_dir, f"rnad_{vcf_id}_{start_index}_{end_index}.csv")
+def _dropping(func, columns):
+    # apply a feature function and drop the columns nothing after it reads
+    def step(df):
+        df = func(df)
+        df.drop(columns=columns, inplace=True)
+        return df
+    return step
+
+
+def add_mrna_sequence(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the 'mrna_sequence' each duplex was folded with (wt or mut flanks) and drop the
+    mutation columns split_mutation_ids added.
+    """
+    df['is_mutated'] = df['is_mutated'].isin(['mt', 'mut'])
+    df = add_sequence_columns(df)
+    df['mrna_sequence'] = df['wt_seq'].where(
+        ~df['is_mutated'], df['mut_seq'])
+    column_names = ["chr", "pos", "ref", "alt", "upstream_seq",
+                    "downstream_seq", "wt_seq", "mut_seq", "is_mutated"]
+    df.drop(columns=column_names, inplace=True)
+    return df
+
+
+def mark_mutation_in_mre(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the 'is_mutation_in_mre' column (see mutation_in_mre_mask).
+    """
+    df["is_mutation_in_mre"] = mutation_in_mre_mask(df)
+    return df
+
+
+def prediction_feature_steps(panel=None) -> list:
+    """
+    List the step 3 feature functions in the order add_prediction_features applies them.
+
+    Each function takes and returns the duplex table and drops the columns no later step
+    reads, so the benchmarks can time the steps one by one on exactly the pipeline's frames.
+
+    Args:
+        panel (MirnaPanel, optional): miRNA panel of the run. Default is every miRNA.
+
+    Returns:
+        list: (name, function) tuples.
+    """
+    return [
+        ("generate_mirna_conservation_column",
+         _dropping(lambda df: generate_mirna_conservation_column(df, panel), ["mirna_accession"])),
+        ("split_mutation_ids", split_mutation_ids),
+        ("add_mrna_sequence", add_mrna_sequence),
+        ("generate_mre_coordinate_columns", generate_mre_coordinate_columns),
+        ("mark_mutation_in_mre", mark_mutation_in_mre),
+        ("generate_au_content_columns",
+         _dropping(generate_au_content_columns,
+                   ["mrna_start", "mrna_end", "mre_start", "mre_end", "mrna_sequence"])),
+        ("generate_ta_sps_columns", generate_ta_sps_columns),
+        ("generate_alignment_string_from_dot_bracket",
+         _dropping(generate_alignment_string_from_dot_bracket,
+                   ["mirna_start", "mirna_end", "mirna_sequence"])),
+        ("generate_match_count_columns", generate_match_count_columns),
+        ("generate_important_sites_column", generate_important_sites_column),
+        ("generate_seed_type_columns", _dropping(generate_seed_type_columns, ["alignment_string"])),
+    ]
+
+
+def add_prediction_features(df: pd.DataFrame, panel=None) -> pd.DataFrame:
+    """
+    Turn parsed RNAduplex output into the feature table the XGBoost model expects (step 3).
+
+    Args:
+        df (pandas.DataFrame): Output of process_rnaduplex_output.
+        panel (MirnaPanel, optional): miRNA panel of the run. Default is every miRNA.
+
+    Returns:
+        pandas.DataFrame: One row per duplex with 'id', 'is_mutation_in_mre' and the model features.
+    """
+    for _, step in prediction_feature_steps(panel):
+        df = step(df)
+    return df
+
+
+@dataclass
+class ChunkFrames:
+    """
+    In-memory outputs of steps 1 to 3 for one chunk, as returned by compute_chunk_features.
+
+    'features', 'id_array' and 'binary_array' are None when nothing was folded or every
+    duplex pair was pruned.
+    """
+    invalid_rows: pd.DataFrame
+    case_2: pd.DataFrame
+    features: pd.DataFrame = None
+    id_array: pd.Series = None
+    binary_array: pd.Series = None
+
+
+def fold_in_memory(case_1: pd.DataFrame, panel=None, rnaduplex=run_rnaduplex_on_string):
+    """
+    Fold case 1 mutations against the miRNAs through pipes and parse the duplexes in memory.
 
-    if not SKIP_RNADUPLEX:
-        invalid_rows_report_file = os.path.join(
-            output_dir, f"invalid_rows_{vcf_id}.csv")
-        fasta_output_file = os.path.join(
-            output_dir, f"fasta_{vcf_id}_{start_index}_{end_index}.fa")
+    Args:
+        case_1 (pandas.DataFrame): Case 1 mutations with 'id' and 'wt_seq'/'mut_seq' columns.
+        panel (MirnaPanel, optional): miRNA panel of the run. Default is every miRNA.
+        rnaduplex (callable, optional): Function mapping RNAduplex input to its raw output.
+            Default runs RNAduplex through pipes.
 
-        df['id'] = df['id'].astype(str)
-        df['id'] += '_' + df['chr'].astype(str) + '_' + df['pos'].astype(
-            str) + '_' + df['ref'] + '_' + df['alt']
+    Returns:
+        pandas.DataFrame: The output of process_rnaduplex_output, or None if RNAduplex printed
+            no duplexes.
+    """
+    with span("fasta", rows_in=len(case_1)) as record:
+        fasta_string = "".join(generate_job_fasta_records(case_1, panel))
+        record["rows_out"] = len(case_1)
 
-        # Step 1: Data Preprocessing
-        df = validate_ref_nucleotides_sharded(df, invalid_rows_report_file)
+    with span("duplex"):
+        duplex_lines = rnaduplex_output_to_csv_lines(rnaduplex(fasta_string))
+    if not duplex_lines:
+        return None
+
+    with span("parse") as record:
+        df = process_rnaduplex_output(io.StringIO("\n".join(duplex_lines) + "\n"), panel)
+        record["rows_out"] = len(df)
+    return df
+
+
+def compute_chunk_features(df: pd.DataFrame, config: PipelineConfig, fold, chunk_stats: dict = None) -> ChunkFrames:
+    """
+    Run steps 1 to 3 on a chunk in memory: reference validation, miRNA locus flags, the
+    pre-filter, flanking sequences, folding, pair pruning and the feature table.
+
+    This is the chain process_chunk, the API and the benchmarks share; they differ only in
+    how the case 1 mutations are folded and in what they do with the returned frames.
+
+    Args:
+        df (pandas.DataFrame): Variants with 'chr', 'pos', 'id', 'ref' and 'alt' columns, as
+            read from the VCF; 'id' holds the sample name.
+        config (PipelineConfig): Settings of the run; the pre-filter, the miRNA panel and the
+            pair pruning are used.
+        fold (callable): Maps the case 1 mutations to the parsed duplex table (the output of
+            process_rnaduplex_output), or None when nothing was folded; see fold_in_memory.
+        chunk_stats (dict, optional): Chunk record the pre-filter, pruning and frame size
+            counters are added to.
+
+    Returns:
+        ChunkFrames: Invalid rows, case 2 mutations and the feature table in prediction order.
+    """
+    if chunk_stats is None:
+        chunk_stats = {}
+
+    df['id'] = df['id'].astype(str)
+    df['id'] += '_' + df['chr'].astype(str) + '_' + df['pos'].astype(
+        str) + '_' + df['ref'] + '_' + df['alt']
+
+    # Step 1: Data Preprocessing
+    with span("validate", rows_in=len(df)) as record:
+        df, invalid_rows = split_invalid_ref_rows(df)
+        record["rows_out"] = len(df)
+
+    with span("is_mirna", rows_in=len(df)) as record:
         df = generate_is_mirna_column(df, grch=37)
-        df = add_sequence_columns(df)
+        record["rows_out"] = len(df)
 
-        # Step 2: Data Processing
-        case_1 = classify_and_get_case_1_mutations(
-            df, vcf_id, start_index, end_index, output_dir)
-        
-        # gc
-        del df
-        gc.collect()
-        
-        prepare_job_fastas_sharded(case_1, fasta_output_file)
-        
-        # gc
-        del case_1
-        gc.collect()
-        
-        run_rnaduplex_and_awk_sharded(fasta_output_file, rnaduplex_output_file)
-
-        # Step 3: Prediction Preprocessing
-        df = process_rnaduplex_output(rnaduplex_output_file)
-        df = generate_mirna_conservation_column(df)
-        df.drop("mirna_accession", axis=1, inplace=True)
-        df = split_mutation_ids(df)
-        df['is_mutated'] = df['is_mutated'].isin(['mt', 'mut'])
+    if config.prefilter or config.prefilter_bed:
+        with span("prefilter", rows_in=len(df)) as record:
+            df, removed = prefilter_case_1_mutations(
+                df, load_region_filter(config.prefilter, config.prefilter_bed))
+            record["rows_out"] = len(df)
+
+        # every removed mutation would have been folded against every miRNA, wt and mut
+        chunk_stats["prefiltered_rows"] = removed
+        chunk_stats["duplexes_skipped"] = 2 * removed * len(load_mirna_sequences(config.mirna_panel))
+
+    with span("flanks", rows_in=len(df)) as record:
         df = add_sequence_columns(df)
-        df['mrna_sequence'] = df['wt_seq'].where(
-            ~df['is_mutated'], df['mut_seq'])
-        column_names = ["chr", "pos", "ref", "alt", "upstream_seq",
-                        "downstream_seq", "wt_seq", "mut_seq", "is_mutated"]
-        df.drop(columns=column_names, inplace=True)
-        
-        
-        df = generate_mre_sequence_column(df)
-        
-        # add a mask that checks if the mutation is in the MRE region
-        mask_if_mutation_in_mre = (df.mrna_start < 32) & (df.mrna_end > 30)
-        df["is_mutation_in_mre"] = mask_if_mutation_in_mre
-        df.drop(columns=["mrna_start", "mrna_end",
-                "mre_start", "mre_end"], inplace=True)
-        
-        df = generate_local_au_content_column(df)
-        df.drop("mrna_sequence", axis=1, inplace=True)
-        
-        df = generate_ta_sps_columns(df)
-        df = generate_alignment_string_from_dot_bracket(df)
-        df.drop(columns=["mirna_start", "mirna_end",
-                "mirna_sequence"], inplace=True)
-        
-        df = generate_match_count_columns(df)
-        df = generate_important_sites_column(df)
-        df = generate_seed_type_columns(df)
-        df.drop("alignment_string", axis=1, inplace=True)
-        
-        df = generate_mre_au_content_column(df)
-        df.drop("mre_region", axis=1, inplace=True)
-
-        # Step 4: Prediction
-        df, id_array, binary_array = reorder_columns_for_prediction(df)
-
-        predictions = make_predictions_with_xgb(df)
-        
+        record["rows_out"] = len(df)
+
+    # Step 2: Data Processing
+    case_1, case_2 = split_mutation_cases(df)
+    frames = ChunkFrames(invalid_rows, case_2)
+
+    # gc
+    del df
+    gc.collect()
+
+    if case_1.empty:
+        return frames
+
+    df = fold(case_1)
+
+    # gc
+    del case_1
+    gc.collect()
+
+    if df is None:
+        return frames
+
+    # Step 3: Prediction Preprocessing
+    if config.prune_pairs or config.prune_energy is not None:
+        with span("prune", rows_in=len(df)) as record:
+            df, no_overlap, too_weak = prune_duplex_pairs(df, config.prune_energy)
+            record["rows_out"] = len(df)
+        chunk_stats["pairs_pruned_overlap"] = no_overlap
+        chunk_stats["pairs_pruned_energy"] = too_weak
+        if df.empty:
+            return frames
+
+    # the parsed duplex table is the largest frame of the chunk
+    chunk_stats["folded_rows"] = len(df)
+    chunk_stats["frame_bytes"] = int(df.memory_usage(deep=True).sum())
+
+    with span("features", rows_in=len(df)) as record:
+        df = add_prediction_features(df, config.mirna_panel)
+        frames.features, frames.id_array, frames.binary_array = reorder_columns_for_prediction(df)
+        record["rows_out"] = len(frames.features)
+
+    return frames
+
+
+def analysis_pipeline(df: pd.DataFrame, start_index: int, end_index: int, config: PipelineConfig, chunk_stats: dict = None) -> pd.DataFrame:
+
+    output_dir = config.output_dir
+    vcf_id = config.vcf_id
+    rnaduplex_output_file = os.path.join(
+        output_dir, f"rnad_{vcf_id}_{start_index}_{end_index}.csv")
+
+    if config.skip_rnaduplex:
+        return df
+
+    invalid_rows_report_file = os.path.join(
+        output_dir, f"invalid_rows_{vcf_id}.csv")
+    fasta_output_file = os.path.join(
+        output_dir, f"fasta_{vcf_id}_{start_index}_{end_index}.fa")
+
+    feature_file = cache_key = None
+    if config.cache_features:
+        cache_key = feature_cache_key(df, config)
+        feature_file = chunk_feature_path(config.feature_cache_path, vcf_id, start_index, end_index)
+        with span("feature_cache") as record:
+            cached = load_chunk_features(feature_file, cache_key["digest"])
+            record["rows_out"] = len(cached[0]) if cached is not None else 0
+        if chunk_stats is not None:
+            chunk_stats["feature_cache"] = "miss" if cached is None else "hit"
+        if cached is not None:
+            # steps 1 to 3 (and their invalid row and case 2 reports) ran when the features were stored
+            features, id_array, binary_array, _ = cached
+            return predict_chunk(features, id_array, binary_array, config)
+
+    def fold_through_files(case_1):
+        # the FASTA and RNAduplex files stay in the output directory, as the run has always kept them
+        with span("fasta", rows_in=len(case_1)) as record:
+            prepare_job_fastas_sharded(case_1, fasta_output_file, config.mirna_panel)
+            record["rows_out"] = len(case_1)
+
+        with span("duplex"):
+            run_rnaduplex_and_awk_sharded(fasta_output_file, rnaduplex_output_file, config.fold_workers)
+        if chunk_stats is not None:
+            chunk_stats["fold_workers"] = max(1, config.fold_workers)
+
+        with span("parse") as record:
+            duplexes = process_rnaduplex_output(rnaduplex_output_file, config.mirna_panel)
+            record["rows_out"] = len(duplexes)
+        return duplexes
+
+    frames = compute_chunk_features(df, config, fold_through_files, chunk_stats)
+    del df
+
+    write_invalid_rows_report(frames.invalid_rows, invalid_rows_report_file)
+    write_case_2_mutations(frames.case_2, vcf_id, start_index, end_index, output_dir)
+    if frames.features is None:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    if feature_file is not None:
+        with span("feature_cache", rows_in=len(frames.features)):
+            save_chunk_features(feature_file, cache_key, frames.features, frames.id_array,
+                                frames.binary_array)
+        if chunk_stats is not None:
+            chunk_stats["feature_cache"] = "stored"
+
+    # Step 4: Prediction
+    return predict_chunk(frames.features, frames.id_array, frames.binary_array, config)
+
+
+def predict_chunk(features: pd.DataFrame, id_array: pd.Series, binary_array: pd.Series,
+                  config: PipelineConfig) -> pd.DataFrame:
+    """
+    Run step 4 on the feature table of a chunk.
+
+    Args:
+        features (pandas.DataFrame): Feature columns in prediction order.
+        id_array (pandas.Series): Row ids ('{mutation_id}_{mirna_accession}_{wt|mut}').
+        binary_array (pandas.Series): Whether the mutation lies in the MRE of the row.
+        config (PipelineConfig): Settings of the run; 'model_path' and 'filter_threshold' are used.
+
+    Returns:
+        pandas.DataFrame: The result rows of the chunk.
+    """
+    if features.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    with span("predict", rows_in=len(features)) as record:
+        predictions = make_predictions_with_xgb(features, config.model_path)
+        record["rows_out"] = len(predictions)
+
         # gc
-        del df
+        del features
         gc.collect()
-        
+
+    with span("pair", rows_in=len(predictions)) as record:
         df = create_results_df(id_array, predictions, binary_array,
-                               filter_range=FILTER_THRESHOLD)
-        
+                               filter_range=config.filter_threshold)
+
         df.drop(columns=["binary_array"], inplace=True)
+        record["rows_out"] = len(df)
 
     return df
 
 
-def process_chunk(chunk: pd.DataFrame, start_index: int, end_index: int, output_dir: str, vcf_id: str) -> tuple:
+def write_chunk_result(result: pd.DataFrame, start_index: int, end_index: int, config: PipelineConfig):
+    # Write the result to a CSV file in the output directory
+    with span("write", rows_in=len(result)) as record:
+        result_file = os.path.join(
+            config.output_dir, f'result_{start_index}_{end_index}.csv')
+        write_text(result_file, result.to_csv(index=False))
+        record["rows_out"] = len(result)
 
-    result = analysis_pipeline(
-        chunk, start_index, end_index, output_dir, vcf_id)
 
-    # Write the result to a CSV file in the output directory
-    result_file = os.path.join(
-        output_dir, f'result_{start_index}_{end_index}.csv')
-    result.to_csv(result_file, index=False)
+def process_chunk(chunk: pd.DataFrame, start_index: int, end_index: int, config: PipelineConfig) -> tuple:
+
+    with chunk_recorder(f"{start_index}_{end_index}") as recorder:
+        chunk_stats = recorder.stats
+        chunk_stats.update({"rows": len(chunk), "folded_rows": 0, "frame_bytes": 0,
+                            "prefiltered_rows": 0, "duplexes_skipped": 0,
+                            "pairs_pruned_overlap": 0, "pairs_pruned_energy": 0})
+        start_time = time.perf_counter()
+
+        with chunk_outputs() as outputs:
+            result = analysis_pipeline(
+                chunk, start_index, end_index, config, chunk_stats=chunk_stats)
+
+            write_chunk_result(result, start_index, end_index, config)
+
+        chunk_stats["seconds"] = time.perf_counter() - start_time
+        # cumulative counters of this worker process, merged per process in the run report
+        chunk_stats["pid"] = os.getpid()
+        chunk_stats["caches"] = cache_stats()
+        if outputs is not None:
+            # written by the driver, see output_sink.replay_outputs
+            chunk_stats["outputs"] = outputs.operations
+
+    return start_index, end_index, recorder.to_dict()
+
+
+def rescore_chunk(feature_file: str, start_index: int, end_index: int, config: PipelineConfig) -> tuple:
+    """
+    Run only step 4 over the stored features of a chunk and write its result file.
+
+    Args:
+        feature_file (str): Features stored by a run with cache_features.
+        start_index (int): First row of the chunk.
+        end_index (int): Last row of the chunk.
+        config (PipelineConfig): Settings of the run; 'model_path' selects the model.
+
+    Returns:
+        tuple: start_index, end_index and the chunk record, like process_chunk.
+    """
+    with chunk_recorder(f"{start_index}_{end_index}") as recorder:
+        chunk_stats = recorder.stats
+        start_time = time.perf_counter()
+
+        with span("feature_cache") as record:
+            features, id_array, binary_array, key = require_chunk_features(feature_file)
+            record["rows_out"] = len(features)
+        chunk_stats.update({"rows": int(id_array.str.rsplit("_", n=2).str[0].nunique()),
+                            "folded_rows": len(features), "frame_bytes": int(features.memory_usage().sum()),
+                            "feature_cache": "rescore", "rnaduplex": key["rnaduplex"],
+                            "window": key["window"]})
+
+        result = predict_chunk(features, id_array, binary_array, config)
+        with chunk_outputs() as outputs:
+            write_chunk_result(result, start_index, end_index, config)
+
+        chunk_stats["seconds"] = time.perf_counter() - start_time
+        chunk_stats["pid"] = os.getpid()
+        chunk_stats["caches"] = cache_stats()
+        if outputs is not None:
+            chunk_stats["outputs"] = outputs.operations
+
+    return start_index, end_index, recorder.to_dict()
+
+
+def process_region(region_index: int, region: tuple, config: PipelineConfig) -> dict:
+    """
+    Read one region of an indexed VCF and run process_chunk on it in chunks of config.chunksize.
 
-    return start_index, end_index
+    The worker reads its records itself, so reading is parallel across regions, and all its
+    chunks come from one stretch of one chromosome, which keeps the sequence caches warm. The
+    region is streamed, so only one chunk of it is held in memory at a time.
 
+    Args:
+        region_index (int): Position of the region in the plan; chunk rows are numbered from
+            region_index * REGION_ROW_STRIDE.
+        region (tuple): (contig, start, end) from vcf_reader.plan_regions.
+        config (PipelineConfig): Settings of the run.
 
+    Returns:
+        dict: Region, raw record count, dropped alleles, read time and the chunk records.
+    """
+    reader = RegionChunkReader(config.vcf_full_path, region, config.chunksize, config.vcf_id)
+    chunks = iter(reader)
+    read_seconds = 0.0
+    chunk_records = []
+    start_index = region_index * REGION_ROW_STRIDE
+    while True:
+        read_start = time.perf_counter()
+        chunk = next(chunks, None)
+        read_seconds += time.perf_counter() - read_start
+        if chunk is None:
+            break
+        if chunk.empty:
+            continue
+        end_index = start_index + len(chunk) - 1
+        chunk_records.append(process_chunk(chunk, start_index, end_index, config)[2])
+        start_index = end_index + 1
 
+    return {"region": list(region), "records": reader.records_read, "alleles_dropped": reader.alleles_dropped,
+            "read_seconds": read_seconds, "chunks": chunk_records}
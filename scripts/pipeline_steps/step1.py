@@ -1,35 +1,23 @@
 import logging
 import numpy as np
-import os
-from scripts.utils.sequence_utils import *
-from scripts.globals import *
-import pandas as pd
+from scripts.utils.sequence_utils import (get_nucleotides_in_interval, get_nucleotide_at_position,
+                                          get_upstream_sequence, get_downstream_sequence)
+from scripts.globals import NUCLEOTIDE_OFFSET
+from scripts.output_sink import append_text
+from scripts.reference_data import load_mirna_coordinates
 
 
-def validate_ref_nucleotides_sharded(df, report_path, verbose=False):
+def split_invalid_ref_rows(df):
     """
-    Check if the 'ref' column matches the 'nucleotide_at_position' column, fetched from FASTA, in a DataFrame.
-    Write invalid rows to a file and return the valid rows for downstream analysis.
-
-    The 'nucleotide_at_position' column is populated as follows:
-    - For rows where the reference length (ref_len) is greater than 1, the get_nucleotides_in_interval function
-      is used to fetch the nucleotides in the interval [pos, pos + ref_len - 1] for the given chromosome (chr).
-    - For rows where the reference length (ref_len) is 1, the get_nucleotide_at_position function is used to
-      fetch the nucleotide at the given position (pos) for the given chromosome (chr).
-    - For all other cases, an empty string is assigned.
+    Compare the 'ref' column with the reference genome and split the rows into valid and invalid ones.
+    See validate_ref_nucleotides_sharded for how the reference nucleotides are fetched.
 
     Args:
         df (pandas.DataFrame): The input DataFrame.
-        output_path (str, optional): The file path to write invalid rows to. Default is "invalid_rows.csv".
-        verbose (bool, optional): If True, log messages indicating the progress. Default is False.
 
     Returns:
-        pandas.DataFrame: The DataFrame containing valid rows with matching 'ref' and 'nucleotide_at_position',
-                           without the 'nucleotide_at_position' column.
+        tuple: (valid rows without the 'nuc_at_pos' column, invalid rows)
     """
-    if verbose:
-        logging.info("Validating reference nucleotides...")
-
     # Add ref_len and alt_len columns
     df["ref_len"] = df["ref"].str.len()
     df["alt_len"] = df["alt"].str.len()
@@ -56,29 +44,56 @@ def validate_ref_nucleotides_sharded(df, report_path, verbose=False):
     # Check if ref matches nucleotide_at_position
     mask = df['ref'] != df['nuc_at_pos']
 
-    # Isolate invalid rows
-    invalid_rows = df[mask]
+    return df[~mask].drop("nuc_at_pos", axis=1), df[mask]
+
+
+def validate_ref_nucleotides_sharded(df, report_path, verbose=False):
+    """
+    Check if the 'ref' column matches the 'nucleotide_at_position' column, fetched from FASTA, in a DataFrame.
+    Write invalid rows to a file and return the valid rows for downstream analysis.
+
+    The 'nucleotide_at_position' column is populated as follows:
+    - For rows where the reference length (ref_len) is greater than 1, the get_nucleotides_in_interval function
+      is used to fetch the nucleotides in the interval [pos, pos + ref_len - 1] for the given chromosome (chr).
+    - For rows where the reference length (ref_len) is 1, the get_nucleotide_at_position function is used to
+      fetch the nucleotide at the given position (pos) for the given chromosome (chr).
+    - For all other cases, an empty string is assigned.
+
+    Args:
+        df (pandas.DataFrame): The input DataFrame.
+        output_path (str, optional): The file path to write invalid rows to. Default is "invalid_rows.csv".
+        verbose (bool, optional): If True, log messages indicating the progress. Default is False.
+
+    Returns:
+        pandas.DataFrame: The DataFrame containing valid rows with matching 'ref' and 'nucleotide_at_position',
+                           without the 'nucleotide_at_position' column.
+    """
+    if verbose:
+        logging.info("Validating reference nucleotides...")
 
-    if not invalid_rows.empty:
-        if verbose:
-            logging.warning(
-                f"Writing {len(invalid_rows)} invalid rows to {report_path}")
+    valid_rows, invalid_rows = split_invalid_ref_rows(df)
 
-        # Check if the file exists
-        file_exists = os.path.isfile(report_path)
+    if verbose and not invalid_rows.empty:
+        logging.warning(
+            f"Writing {len(invalid_rows)} invalid rows to {report_path}")
+    write_invalid_rows_report(invalid_rows, report_path)
 
-        # Open the file in append mode ('a') or write mode ('w')
-        mode = 'a' if file_exists else 'w'
-        with open(report_path, mode) as f:
-            # If the file is new, write the header
-            if not file_exists:
-                f.write("id\n")
+    return valid_rows
 
-            # Write each invalid row to the file
-            for _, row in invalid_rows.iterrows():
-                f.write(f"{row['id']}\n")
 
-    return df[~mask].drop("nuc_at_pos", axis=1)
+def write_invalid_rows_report(invalid_rows, report_path):
+    """
+    Append the ids of rows whose 'ref' does not match the reference to the invalid rows report.
+
+    Args:
+        invalid_rows (pandas.DataFrame): Rows with an 'id' column, as split off by split_invalid_ref_rows.
+        report_path (str): The report shared by all chunks of the run.
+    """
+    if invalid_rows.empty:
+        return
+    # the report is shared by all chunks, so the appends go through the output sink
+    append_text(report_path, "".join(f"{row_id}\n" for row_id in invalid_rows["id"]),
+                header="id\n")
 
 
 def generate_is_mirna_column(df, grch):
@@ -94,12 +109,8 @@ def generate_is_mirna_column(df, grch):
     Returns:
         pandas.DataFrame: The input DataFrame with two additional columns ('is_mirna' and 'mirna_accession')
     """
-    # Construct the miRNA coordinates file path
-    mirna_coords_file = os.path.join(
-        MIRNA_COORDS_DIR, f"grch{grch}_coordinates.csv")
-
-    # Load miRNA coordinates
-    coords = pd.read_csv(mirna_coords_file)
+    # Load miRNA coordinates (read once per process)
+    coords = load_mirna_coordinates(grch)
 
     # Initialize new columns
     df['is_mirna'] = 0
@@ -126,6 +137,10 @@ def generate_is_mirna_column(df, grch):
 
 
 def add_sequence_columns(df):
+    if df.empty:
+        # groupby().apply() on an empty frame would not add the columns
+        return df.assign(upstream_seq="", downstream_seq="", wt_seq="", mut_seq="")
+
     grouped = df.groupby(['chr', 'pos'])
 
     def apply_func(group):
@@ -1,10 +1,51 @@
+import itertools
 import logging
 import os
-import pandas as pd
-from scripts.globals import *
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from scripts.globals import AWK_SCRIPT_PATH, RNADUPLEX_LOCATION
+from scripts.output_sink import write_text
+from scripts.reference_data import load_mirna_sequences
 import tempfile
 import subprocess
 
+# every RNAduplex input record is a header, the mRNA, the miRNA and an empty line
+FASTA_RECORD_LINES = 4
+
+
+def split_mutation_cases(df):
+    """
+    Split mutations into case 1 (outside miRNA loci) and case 2 (inside miRNA loci).
+
+    Returns:
+        tuple: (case_1, case_2) DataFrames with 'id', 'wt_seq' and 'mut_seq' columns.
+    """
+    case_1 = df[df.is_mirna == 0][["id", "wt_seq", "mut_seq"]]
+    case_2 = df[df.is_mirna == 1][["id", "wt_seq", "mut_seq"]]
+    return case_1, case_2
+
+
+def prefilter_case_1_mutations(df, interval_sets):
+    """
+    Drop case 1 mutations outside the given intervals, so they are never folded.
+
+    Case 2 mutations are kept whatever their location, they are not folded anyway.
+
+    Args:
+        df (pandas.DataFrame): DataFrame with 'chr', 'pos' and 'is_mirna' columns.
+        interval_sets (list): IntervalSet objects from gene_index.load_region_filter; a mutation
+            is kept when any of them covers its position.
+
+    Returns:
+        tuple: (kept mutations, number of case 1 mutations removed)
+    """
+    keep = (df.is_mirna == 1).to_numpy()
+    chroms, positions = df["chr"].to_numpy(), df["pos"].to_numpy()
+    for intervals in interval_sets:
+        keep |= intervals.covers(chroms, positions)
+    return df[keep], int((~keep).sum())
+
 
 def classify_and_get_case_1_mutations(df, vcf_id, start, end, output_dir):
     """
@@ -22,20 +63,27 @@ def classify_and_get_case_1_mutations(df, vcf_id, start, end, output_dir):
         pandas.DataFrame: DataFrame containing case 1 mutations.
     """
     # Classify case 1 and case 2 mutations
-    case_1 = df[df.is_mirna == 0][["id", "wt_seq", "mut_seq"]]
-    case_2 = df[df.is_mirna == 1][["id", "wt_seq", "mut_seq"]]
-    
-    
+    case_1, case_2 = split_mutation_cases(df)
+    write_case_2_mutations(case_2, vcf_id, start, end, output_dir)
+
+    return case_1
 
 
+def write_case_2_mutations(case_2, vcf_id, start, end, output_dir):
+    """
+    Save the case 2 mutations of a chunk to disk, if there are any.
+
+    Args:
+        case_2 (pandas.DataFrame): Case 2 mutations from split_mutation_cases.
+        vcf_id (str): ID of the VCF file.
+        start (int): Start position of the region.
+        end (int): End position of the region.
+        output_dir (str): Path to the output directory.
+    """
     if not case_2.empty:
-        # Save case 2 mutations to disk if any exist
         case_2_file = os.path.join(output_dir, f"{vcf_id}_{start}_{end}_case_2.csv")
-        case_2.to_csv(case_2_file, index=False)
+        write_text(case_2_file, case_2.to_csv(index=False))
         print(f"case 2 mutations: {len(case_2)}")
-        
-
-    return case_1
 
 
 def generate_fasta_representation_string(mrna_dict, mirna_dict, wild_type):
@@ -56,28 +104,85 @@ def generate_fasta_representation_string(mrna_dict, mirna_dict, wild_type):
             yield f">{mrna}-{mirna}-wt\n{mrna_dict[mrna]}\n{mirna_dict[mirna]}\n\n" if wild_type else f">{mrna}-{mirna}-mut\n{mrna_dict[mrna]}\n{mirna_dict[mirna]}\n\n"
 
 
-def prepare_job_fastas_sharded(case_1, fasta_output_file):
+def generate_job_fasta_records(case_1, panel=None):
+    """
+    Yield the FASTA records of every mutation × miRNA pair, all wild type records first.
 
+    Args:
+        case_1 (pandas.DataFrame): DataFrame with 'id' and 'wt_seq' columns.
+        panel (MirnaPanel, optional): miRNAs to pair with. Default is every miRNA.
+
+    Yields:
+        str: One RNAduplex input record.
+    """
     wild_type = True
-    mirna_dict = pd.read_csv(MIRNA_CSV).set_index(
-        'mirna_accession')['sequence'].to_dict()
+    mirna_dict = load_mirna_sequences(panel)
 
     sequence_column = 'wt_seq' if wild_type else 'mut_seq'
     mrna_dict = case_1.set_index('id')[sequence_column].to_dict()
 
+    yield from generate_fasta_representation_string(mrna_dict, mirna_dict, wild_type)
+    yield from generate_fasta_representation_string(mrna_dict, mirna_dict, not wild_type)
+
+
+def prepare_job_fastas_sharded(case_1, fasta_output_file, panel=None):
+
     with open(fasta_output_file, 'w') as file:
-        for string in generate_fasta_representation_string(mrna_dict, mirna_dict, wild_type):
-            file.write(string)
-        for string in generate_fasta_representation_string(mrna_dict, mirna_dict, not wild_type):
+        for string in generate_job_fasta_records(case_1, panel):
             file.write(string)
 
 
-def run_rnaduplex_and_awk_sharded(input_file, output_file):
+def fold_in_parallel(input_f, output_f, workers):
+    """
+    Run up to `workers` RNAduplex processes on contiguous blocks of the input records and write
+    their outputs to output_f one after the other, so the result is the same as from one process.
+
+    Args:
+        input_f (file): RNAduplex input, as written by prepare_job_fastas_sharded.
+        output_f (file): Where the RNAduplex output goes.
+        workers (int): Number of RNAduplex processes.
+
+    Raises:
+        subprocess.CalledProcessError: If any of the processes fails.
+    """
+    n_records = sum(1 for _ in input_f) // FASTA_RECORD_LINES
+    input_f.seek(0)
+    lines_per_part = max(1, -(-n_records // workers)) * FASTA_RECORD_LINES
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        processes = []
+        for part in range(workers):
+            part_input = os.path.join(tmp_dir, f"part_{part}.fa")
+            with open(part_input, 'w') as f:
+                f.writelines(itertools.islice(input_f, lines_per_part))
+            if processes and os.path.getsize(part_input) == 0:
+                break
+
+            # the earlier parts are already folding while the next one is written
+            part_output = os.path.join(tmp_dir, f"part_{part}.out")
+            with open(part_input, 'r') as stdin, open(part_output, 'w') as stdout:
+                processes.append((subprocess.Popen(RNADUPLEX_LOCATION, stdin=stdin, stdout=stdout),
+                                  part_output))
+
+        return_codes = [process.wait() for process, _ in processes]
+        for return_code in return_codes:
+            if return_code != 0:
+                raise subprocess.CalledProcessError(return_code, RNADUPLEX_LOCATION)
+
+        for _, part_output in processes:
+            with open(part_output, 'r') as f:
+                shutil.copyfileobj(f, output_f)
+
+
+def run_rnaduplex_and_awk_sharded(input_file, output_file, workers=1):
 
     try:
         with open(input_file, 'r') as input_f, tempfile.NamedTemporaryFile(mode='w+', delete=False) as temp_file:
-            subprocess.run(RNADUPLEX_LOCATION, stdin=input_f,
-                           stdout=temp_file, check=True, text=True)
+            if workers > 1:
+                fold_in_parallel(input_f, temp_file, workers)
+            else:
+                subprocess.run(RNADUPLEX_LOCATION, stdin=input_f,
+                               stdout=temp_file, check=True, text=True)
             temp_file_path = temp_file.name
     except (FileNotFoundError, subprocess.CalledProcessError) as e:
         logging.error(f"Error running RNAduplex on {input_file}: {str(e)}")
@@ -99,3 +204,62 @@ def run_rnaduplex_and_awk_sharded(input_file, output_file):
         except OSError as e:
             logging.warning(
                 f"Error removing temporary file {temp_file_path}: {str(e)}")
+
+
+def run_rnaduplex_on_string(fasta_string, workers=1):
+    """
+    Run RNAduplex on FASTA records held in memory, through its stdin and stdout.
+
+    Args:
+        fasta_string (str): RNAduplex input, as produced by generate_job_fasta_records.
+        workers (int, optional): Split the records over this many RNAduplex processes; the
+            outputs are joined in input order. Default is 1.
+
+    Returns:
+        str: The raw RNAduplex output.
+    """
+    def fold(part):
+        return subprocess.run(RNADUPLEX_LOCATION, input=part,
+                              capture_output=True, check=True, text=True).stdout
+
+    if workers <= 1 or not fasta_string:
+        return fold(fasta_string)
+
+    lines = fasta_string.splitlines(keepends=True)
+    n_records = len(lines) // FASTA_RECORD_LINES
+    lines_per_part = max(1, -(-n_records // workers)) * FASTA_RECORD_LINES
+    parts = ["".join(lines[i:i + lines_per_part]) for i in range(0, len(lines), lines_per_part)]
+    with ThreadPoolExecutor(len(parts)) as pool:
+        return "".join(pool.map(fold, parts))
+
+
+def rnaduplex_output_to_csv_lines(rnaduplex_output):
+    """
+    Convert raw RNAduplex output into the CSV lines rnaduplex_to_csv.awk produces.
+
+    Every '>' header ('{mutation_id}-{mirna_accession}-{wt|mut}') is followed by a structure line
+    like '((((&))))   3,6  :   1,4  (-4.50)', which becomes
+    '{mutation_id},{mirna_accession},((((,)))),3,6,1,4,-4.50,{wt|mut}'.
+
+    Args:
+        rnaduplex_output (str): The raw RNAduplex output.
+
+    Returns:
+        list: One CSV line (without newline) per duplex.
+    """
+    lines = []
+    output_lines = iter(rnaduplex_output.splitlines())
+    for line in output_lines:
+        if not line.startswith(">"):
+            continue
+        fields = line[1:].split("-")
+        fields += [""] * (3 - len(fields))
+        details = next(output_lines, "")
+
+        details = re.sub(r"  +", ",", details.replace("&", ",").replace(":", ""))
+        parts = details.split(",")
+        parts[-1] = re.sub(r"[()]", "", parts[-1])
+        details = ",".join(parts).replace(" ", "")
+
+        lines.append(f"{fields[0]},{fields[1]},{details},{fields[2]}")
+    return lines
@@ -1,11 +1,13 @@
 import numpy as np
 import pandas as pd
-from scripts.globals import *
-from functools import lru_cache
+from scripts.globals import CACHE_BUDGETS_MB
+from scripts.reference_data import load_mirna_sequences, load_mirna_conservation, load_ta_sps
+from scripts.utils.cache_utils import bounded_cache
 import re
 
 
-def process_rnaduplex_output(rnaduplex_output_file):
+def process_rnaduplex_output(rnaduplex_output_file, panel=None):
+    # rnaduplex_output_file may also be a file-like object, e.g. io.StringIO of in-memory output
     colnames = ["mutation_id", "mirna_accession", "mrna_dot_bracket_5to3", "mirna_dot_bracket_5to3",
                 "mrna_start", "mrna_end", "mirna_start", "mirna_end", "pred_energy", "is_mutated"]
     df = pd.read_csv(rnaduplex_output_file, header=None, names=colnames)
@@ -14,27 +16,69 @@ def process_rnaduplex_output(rnaduplex_output_file):
     df = df.sort_values(by=['id', 'is_mutated'], ascending=[False, True])
 
     # Add miRNA sequence
-    mirna_dict = pd.read_csv(MIRNA_CSV).set_index(
-        'mirna_accession')['sequence'].to_dict()
+    mirna_dict = load_mirna_sequences(panel)
+    if panel is not None:
+        # duplexes of miRNAs outside the panel (e.g. from output folded for another panel)
+        df = df[df["mirna_accession"].isin(mirna_dict)]
     df["mirna_sequence"] = df["mirna_accession"].map(mirna_dict)
     return df
 
 
-def generate_mirna_conservation_column(df):
+def mutation_in_mre_mask(df):
+    """
+    Mark the duplexes whose mRNA part covers the mutated base (position 31 of the mRNA sequence,
+    after the 30 upstream flank bases).
+
+    Args:
+        df (pandas.DataFrame): DataFrame with 'mrna_start' and 'mrna_end' columns.
+
+    Returns:
+        pandas.Series: Boolean mask.
+    """
+    return (df.mrna_start < 32) & (df.mrna_end > 30)
+
+
+def prune_duplex_pairs(df, energy_cutoff=None):
+    """
+    Drop wt/mut duplex pairs that cannot, or are unlikely to, produce a result row.
+
+    A pair (a mutation and a miRNA) is dropped when neither of its duplexes covers the mutated
+    base, which create_results_df would filter out anyway, and, with `energy_cutoff`, when both
+    of its duplexes are weaker than the cutoff (pred_energy above it). Only the energy rule can
+    lose result rows; see scripts.energy_calibration for choosing the cutoff.
+
+    Args:
+        df (pandas.DataFrame): Output of process_rnaduplex_output.
+        energy_cutoff (float, optional): Energy in kcal/mol, e.g. -10. Default keeps every energy.
+
+    Returns:
+        tuple: (kept duplexes, number of pairs without overlap, number of further pairs
+            above the energy cutoff)
+    """
+    pair_ids = df["mutation_id"] + "_" + df["mirna_accession"]
+    overlapping = mutation_in_mre_mask(df).groupby(pair_ids).transform("any")
+    keep = overlapping
+    if energy_cutoff is not None:
+        keep = keep & (df["pred_energy"] <= energy_cutoff).groupby(pair_ids).transform("any")
+
+    no_overlap = pair_ids[~overlapping].nunique()
+    too_weak = pair_ids[overlapping & ~keep].nunique()
+    return df[keep], int(no_overlap), int(too_weak)
+
+
+def generate_mirna_conservation_column(df, panel=None):
     """
     Add a 'mirna_conservation' column to the input DataFrame based on miRNA conservation data.
     Automatically downcast the 'mirna_conservation' column to the most appropriate numerical dtype.
 
     Args:
         df (pandas.DataFrame): A DataFrame containing the 'mirna_accession' column.
+        panel (MirnaPanel, optional): miRNA panel of the run. Default is every miRNA.
 
     Returns:
         pandas.DataFrame: The input DataFrame with a 'mirna_conservation' column added and automatically downcasted.
     """
-    mirna_df = (pd.read_csv(MIRNA_CSV,
-                            usecols=["mirna_accession", "conservation"])
-                .rename(columns={"conservation": "mirna_conservation"})
-                [["mirna_accession", "mirna_conservation"]])
+    mirna_df = load_mirna_conservation(panel)
 
     df = df.merge(mirna_df, on="mirna_accession", how="left")
 
@@ -45,7 +89,7 @@ def generate_mirna_conservation_column(df):
     return df
 
 
-@lru_cache(maxsize=None)
+@bounded_cache("split_mutation_id", CACHE_BUDGETS_MB["split_mutation_id"])
 def split_mutation_id_cached(mutation_id):
     return mutation_id.split('_')
 
@@ -64,46 +108,84 @@ def split_mutation_ids(df):
     return df
 
 
-def generate_mre_sequence_column(df):
+def generate_mre_coordinate_columns(df):
     """
-    Generate the miRNA response element (MRE) sequence for each row in the input DataFrame.
+    Locate the miRNA response element (MRE) of each row in its mRNA sequence.
 
     Args:
-        df (pandas.DataFrame): A DataFrame containing columns 'mrna_sequence', 'mrna_end', 'mirna_start', and 'mirna_sequence'.
+        df (pandas.DataFrame): A DataFrame containing columns 'mrna_end', 'mirna_start', and 'mirna_sequence'.
 
     Returns:
-        pandas.DataFrame: The input DataFrame with new columns 'mre_start', 'mre_end', and 'mre_region' added.
+        pandas.DataFrame: The input DataFrame with new columns 'mre_start' and 'mre_end' added, the
+            0-based, end-exclusive slice of 'mrna_sequence' holding the MRE.
     """
-    # Calculate miRNA length
-    df["mirna_length"] = df["mirna_sequence"].str.len()
-
-    # Calculate MRE coordinates
     df["mre_end"] = df["mrna_end"] + df["mirna_start"]
-    df["mre_start"] = df["mre_end"] - df["mirna_length"]
-
     # Ensure MRE start is not negative
-    df["mre_start"] = df["mre_start"].clip(lower=0)
+    df["mre_start"] = (df["mre_end"] - df["mirna_sequence"].str.len()).clip(lower=0)
+    return df
 
-    # Extract MRE sequence using list comprehension for better performance
-    df["mre_region"] = [mrna_seq[start:end] for mrna_seq, start,
-                        end in zip(df["mrna_sequence"], df["mre_start"], df["mre_end"])]
 
-    # Drop temporary column
-    df.drop(columns=["mirna_length"], inplace=True)
+def sequence_matrix(sequences):
+    """
+    Pack sequences into a zero-padded ASCII matrix, one row per sequence.
 
-    return df
+    Args:
+        sequences (pandas.Series): Sequences of A, C, G, T/U and N.
 
+    Returns:
+        tuple: (uint8 matrix of shape (n, longest sequence), int64 array of sequence lengths)
+    """
+    sequences = sequences.tolist()
+    encoded = np.array(sequences, dtype="S")
+    matrix = np.frombuffer(encoded.tobytes(), dtype=np.uint8).reshape(len(encoded), encoded.dtype.itemsize)
+    return matrix, np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
 
-@lru_cache(maxsize=None)
-def calculate_au_content(sequence):
-    au_count = sequence.count(
-        'A') + sequence.count('T') + sequence.count('U')
-    return None if len(sequence) == 0 else au_count / len(sequence)
 
+# A, T and U by ASCII code
+_IS_AU = np.zeros(256, dtype=np.uint8)
+_IS_AU[[ord("A"), ord("T"), ord("U")]] = 1
+
+
+def _slice_bounds(bound, lengths):
+    # the bounds Python slicing would use for seq[bound] on sequences of these lengths
+    return np.clip(np.where(bound < 0, lengths + bound, bound), 0, lengths)
+
+
+def generate_au_content_columns(df):
+    """
+    Add 'local_au_content', 'mre_au_content' and 'anchor_a' from the mRNA sequence and the MRE
+    coordinates, without cutting the MRE out of the sequences.
 
-def generate_local_au_content_column(df):
-    # Apply the cached calculate_au_content function to each mrna_sequence in the DataFrame
-    df["local_au_content"] = df['mrna_sequence'].apply(calculate_au_content)
+    The AU counts of every sequence prefix come from one cumulative sum over a uint8 matrix of
+    the sequences, kept in int16 for the short mRNA windows, so the AU content of any slice is a
+    difference of two prefix counts. The AU contents are NaN for empty sequences or MREs.
+
+    Args:
+        df (pandas.DataFrame): A DataFrame containing columns 'mrna_sequence', 'mre_start' and 'mre_end'.
+
+    Returns:
+        pandas.DataFrame: The input DataFrame with the three columns added.
+    """
+    matrix, lengths = sequence_matrix(df["mrna_sequence"])
+    # mRNA windows are 2 * NUCLEOTIDE_OFFSET plus the reference allele long, so int16 counts
+    # keep the prefix matrix at twice the size of the sequences
+    count_dtype = np.int16 if matrix.shape[1] <= np.iinfo(np.int16).max else np.int32
+    au_prefix = np.zeros((len(matrix), matrix.shape[1] + 1), dtype=count_dtype)
+    np.cumsum(_IS_AU[matrix], axis=1, dtype=count_dtype, out=au_prefix[:, 1:])
+
+    rows = np.arange(len(matrix))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["local_au_content"] = np.where(lengths > 0, au_prefix[rows, lengths] / lengths, np.nan)
+
+        mre_start = _slice_bounds(df["mre_start"].to_numpy(dtype=np.int64), lengths)
+        mre_end = _slice_bounds(df["mre_end"].to_numpy(dtype=np.int64), lengths)
+        mre_length = mre_end - mre_start
+        df["mre_au_content"] = np.where(
+            mre_length > 0, (au_prefix[rows, mre_end] - au_prefix[rows, mre_start]) / mre_length, np.nan)
+
+    # Anchor site: the MRE ends in an A
+    last_base = matrix[rows, np.maximum(mre_end - 1, 0)]
+    df["anchor_a"] = ((mre_length > 0) & (last_base == ord("A"))).astype(np.int8)
     return df
 
 
@@ -121,10 +203,8 @@ def generate_ta_sps_columns(df):
     # Generate temporary seed column
     df["seed"] = df["mirna_sequence"].str.slice(
         1, 8).replace({'T': 'U'}, regex=True)
-    # Read ta sps data
-    ta_sps_df = pd.read_csv(TA_SPS_CSV, usecols=[
-                            "seed_8mer", "ta_log10", "sps_mean"])
-    ta_sps_df = ta_sps_df.rename(columns={"seed_8mer": "seed"})
+    # Read ta sps data (loaded once per process)
+    ta_sps_df = load_ta_sps()
     # Merge dataframes on seed column
     df = df.merge(ta_sps_df, on="seed", how="left")
     # Downcast the new columns
@@ -186,7 +266,7 @@ def generate_important_sites_column(df):
     Downcast binary columns to the smallest integer dtype.
 
     Args:
-        df (pandas.DataFrame): A DataFrame containing the 'mre_region' and 'alignment_string' columns.
+        df (pandas.DataFrame): A DataFrame containing the 'alignment_string' column.
 
     Returns:
         pandas.DataFrame: The input DataFrame with additional columns for important site features.
@@ -194,9 +274,6 @@ def generate_important_sites_column(df):
     # Precompile the regular expression for consecutive matches
     consecutive_match_re = re.compile("1{9,}")
 
-    # Anchor site
-    df["anchor_a"] = df["mre_region"].str.endswith("A").astype(np.int8)
-
     # Pre-calculate slices of 'alignment_string' to avoid repeated operations
     alignment_slice_1_7 = df["alignment_string"].str[1:7]
     alignment_slice_7 = df["alignment_string"].str[7]
@@ -274,9 +351,3 @@ def generate_seed_type_columns(df):
     df['seed_clash_5'] = (has_many_basepairs & ~has_6mer_seed).astype(np.int8)
 
     return df
-
-
-def generate_mre_au_content_column(df):
-    # Apply the cached calculate_au_content function to each mre_region in the DataFrame
-    df["mre_au_content"] = df['mre_region'].apply(calculate_au_content)
-    return df
@@ -1,7 +1,9 @@
-import xgboost as xgb
+import threading
 import pandas as pd
 from scripts.globals import XGB_MODEL
-from scripts.config import FILTER_THRESHOLD
+
+_models = {}
+_models_lock = threading.Lock()
 
 
 def reorder_columns_for_prediction(df):
@@ -40,15 +42,32 @@ def reorder_columns_for_prediction(df):
     return df, id_array, binary_array
 
 
-def make_predictions_with_xgb(df):
-    model = xgb.Booster()
-    model.load_model(XGB_MODEL)
+def load_xgb_model(model_path=XGB_MODEL):
+    """
+    Load an XGBoost model once per process.
+
+    xgboost is imported here rather than at module level, so importing the pipeline steps
+    (and spawning worker processes) does not pay for it until a prediction is made.
+    """
+    with _models_lock:
+        if model_path not in _models:
+            import xgboost as xgb
+
+            model = xgb.Booster()
+            model.load_model(model_path)
+            _models[model_path] = model
+        return _models[model_path]
+
+
+def make_predictions_with_xgb(df, model_path=XGB_MODEL):
+    import xgboost as xgb
 
+    model = load_xgb_model(model_path)
     data_matrix = xgb.DMatrix(df)
     return model.predict(data_matrix)
 
 
-def create_results_df(id_array, predictions, binary_array, filter_range=FILTER_THRESHOLD):
+def create_results_df(id_array, predictions, binary_array, filter_range=0.2):
 
     df = pd.DataFrame({'id': id_array, 'prediction': predictions, "binary_array": binary_array})
     df[['id', 'is_mutated']] = df['id'].str.rsplit('_', n=1, expand=True)
@@ -1,10 +1,13 @@
 import pandas as pd
-from scripts.utils.sequence_utils import get_nucleotide_at_position
-from scripts.pyensembl_operations import *
-from scripts.globals import *
+import numpy as np
+from scripts.utils.sequence_utils import get_nucleotide_at_position, get_nucleotides_at_positions
+from scripts.gene_index import load_gene_index, annotate_gene_columns
+from scripts.mutsig_index import load_mutsig_index
 import os
 import sqlite3
-from scripts.globals import MUTSIG_PROBABILITIES
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from scripts.globals import GENE_INDEX_NPZ, MUTSIG_PROBABILITIES
 
 
 def filter_rows_with_same_prediction(df, threshold=0.5):
@@ -37,67 +40,104 @@ def create_mutation_context_string(row):
 
 
 
-def generate_mutation_context_column(df):
-    df['before'] = df.apply(lambda x: get_nucleotide_at_position(x['chr'], x['pos']-1), axis=1)
-    df['after'] = df.apply(lambda x: get_nucleotide_at_position(x['chr'], x['pos']+1), axis=1)
-    df['mutation_context'] = df.apply(create_mutation_context_string, axis=1)
-    df['mutsig_key'] = df['vcf_id'].astype(str) + '_' + df['mutation_context']
-    df.drop(columns=['before', 'after', 'ref', 'alt'], inplace=True)
-    return df
-
-
-
-def add_mutsig_probabilities(df, mutsig_file):
-    mutsig_df = pd.read_csv(mutsig_file)
-    mutsig_df['mutsig_key'] = mutsig_df['Sample Names'] + '_' + mutsig_df['MutationTypes']
-    mutsig_dict = dict(zip(mutsig_df['mutsig_key'], mutsig_df['mutsig']))
-    df['mutsig'] = df['mutsig_key'].map(mutsig_dict)
-    return df
-
-
-
+# byte lookup table complementing A/C/G/T and leaving every other byte unchanged
+COMPLEMENT_TABLE = np.arange(256, dtype=np.uint8)
+for _base, _complement in COMPLEMENT.items():
+    COMPLEMENT_TABLE[ord(_base)] = ord(_complement)
 
-def generate_is_intron_column(df, assembly):
+_ACGT_CODES = np.frombuffer(b"ACGT", dtype=np.uint8)
+_PURINE_CODES = np.frombuffer(b"AG", dtype=np.uint8)
 
-    @lru_cache(maxsize=None)
-    def cached_pyensembl_call(locus):
 
-        chrom, pos = locus.split(':')
-        result = assembly.exons_at_locus(chrom, int(pos))
+def _single_base_codes(series):
+    # ASCII codes of a column of single characters
+    return series.to_numpy(dtype=str).astype("S1").view(np.uint8)
 
-        return np.nan if len(result) == 0 else result[0].exon_id
-
-    unique_loci = df['locus'].unique()
-    map_dict = {locus: cached_pyensembl_call(locus) for locus in unique_loci}
-    df['is_exon'] = df['locus'].map(map_dict)
-    
-    mask = (df.is_exon.isna()) & (~df.gene_id.isna())
-
-    df["is_intron"] = mask
-
-    df.drop(columns=["is_exon"], inplace=True)
 
+def generate_mutation_context_column(df):
+    """
+    Add the pyrimidine-normalised SBS96 context ('mutation_context', e.g. "A[C>T]G") and
+    'mutsig_key' ("{vcf_id}_{context}") columns, and drop 'ref' and 'alt'.
+
+    The flanking bases of all rows are fetched with one batched read per chromosome and
+    purine-reference rows are complemented with a byte lookup table. Rows the vectorized
+    path does not cover (indels, bases outside A/C/G/T, positions at the chromosome ends)
+    go through create_mutation_context_string, so the output is the same as row by row.
+
+    Args:
+        df (pandas.DataFrame): DataFrame with 'vcf_id', 'chr', 'pos', 'ref' and 'alt' columns.
+
+    Returns:
+        pandas.DataFrame: The input DataFrame with the two context columns added.
+    """
+    chroms = df['chr'].to_numpy(dtype=str)
+    positions = df['pos'].to_numpy(dtype=np.int64)
+    before = np.zeros(len(df), dtype=np.uint8)
+    after = np.zeros(len(df), dtype=np.uint8)
+    for chrom in np.unique(chroms):
+        mask = chroms == chrom
+        before[mask] = get_nucleotides_at_positions(chrom, positions[mask] - 1)
+        after[mask] = get_nucleotides_at_positions(chrom, positions[mask] + 1)
+
+    ref = df['ref'].astype(str)
+    alt = df['alt'].astype(str)
+    vectorized = ((ref.str.len() == 1) & (alt.str.len() == 1)).to_numpy()
+
+    ref_codes = np.zeros(len(df), dtype=np.uint8)
+    alt_codes = np.zeros(len(df), dtype=np.uint8)
+    ref_codes[vectorized] = _single_base_codes(ref[vectorized])
+    alt_codes[vectorized] = _single_base_codes(alt[vectorized])
+
+    purine = np.isin(ref_codes, _PURINE_CODES)
+    vectorized &= np.isin(ref_codes, _ACGT_CODES) & (before > 0) & (after > 0)
+    # complementing needs every base of a purine row to be one of A/C/G/T
+    vectorized &= ~purine | (np.isin(alt_codes, _ACGT_CODES) & np.isin(before, _ACGT_CODES)
+                             & np.isin(after, _ACGT_CODES))
+
+    context = np.empty((int(vectorized.sum()), 7), dtype=np.uint8)
+    p = purine[vectorized]
+    b, a = before[vectorized], after[vectorized]
+    context[:, 0] = np.where(p, COMPLEMENT_TABLE[a], b)
+    context[:, 1] = ord('[')
+    context[:, 2] = np.where(p, COMPLEMENT_TABLE[ref_codes[vectorized]], ref_codes[vectorized])
+    context[:, 3] = ord('>')
+    context[:, 4] = np.where(p, COMPLEMENT_TABLE[alt_codes[vectorized]], alt_codes[vectorized])
+    context[:, 5] = ord(']')
+    context[:, 6] = np.where(p, COMPLEMENT_TABLE[b], a)
+
+    mutation_context = np.empty(len(df), dtype=object)
+    mutation_context[vectorized] = context.view("S7").ravel().astype(str)
+
+    remaining = ~vectorized
+    if remaining.any():
+        rest = df.loc[remaining, ['chr', 'pos', 'ref', 'alt']].copy()
+        rest['before'] = rest.apply(lambda x: get_nucleotide_at_position(x['chr'], x['pos']-1), axis=1)
+        rest['after'] = rest.apply(lambda x: get_nucleotide_at_position(x['chr'], x['pos']+1), axis=1)
+        mutation_context[remaining] = rest.apply(create_mutation_context_string, axis=1).to_numpy()
+
+    df['mutation_context'] = mutation_context
+    df['mutsig_key'] = df['vcf_id'].astype(str) + '_' + df['mutation_context']
+    df.drop(columns=['ref', 'alt'], inplace=True)
     return df
 
 
 
-###################################################
-
-
-def generate_gene_id_column(df, assembly):
-    unique_loci = df['locus'].unique()
-    
-    @lru_cache(maxsize=None)
-    def cached_pyensembl_call(locus):
-
-        chrom, pos = locus.split(':')
-        result = assembly.gene_ids_at_locus(chrom, int(pos))
+def add_mutsig_probabilities(df, mutsig_file):
+    """
+    Add the 'mutsig' column, the dominant signature of each (vcf_id, mutation_context) pair.
 
-        return np.nan if len(result) == 0 else result[0]
+    The probabilities CSV is converted once into a cached sample × context index (see
+    scripts.mutsig_index), so repeated calls neither re-read the CSV nor build string keys.
 
-    gene_id_dict = {locus: cached_pyensembl_call(locus) for locus in unique_loci}
-    df['gene_id'] = df['locus'].map(gene_id_dict)
+    Args:
+        df (pandas.DataFrame): DataFrame with 'vcf_id' and 'mutation_context' columns.
+        mutsig_file (str): Path of the probabilities CSV.
 
+    Returns:
+        pandas.DataFrame: The input DataFrame with a categorical 'mutsig' column (NaN if not found).
+    """
+    index = load_mutsig_index(mutsig_file)
+    df['mutsig'] = index.lookup(df['vcf_id'], df['mutation_context'])
     return df
 
 
@@ -118,12 +158,10 @@ def apply_step_5(file_path, assembly, mutsig_probabilities):
     for col in cat_columns:
         df[col] = df[col].astype('category')
     
-    # column needed in pyensembl operations
-    df["locus"] = df["chr"].astype(str) + ":" + df["pos"].astype(str)
-    df = generate_gene_id_column(df, assembly)
+    # gene_id, biotype and is_intron from the offline Ensembl interval index
+    df = annotate_gene_columns(df, load_gene_index(assembly))
     df['gene_id'] = df['gene_id'].astype('category')
-    df = generate_is_intron_column(df, assembly)
-    df.drop(columns=["locus"], inplace=True)
+    df['biotype'] = df['biotype'].astype('category')
     
     # remove last character of vcf_id col if it is "+" to get the mutsigs
     df = generate_mutation_context_column(df)
@@ -141,7 +179,7 @@ def apply_step_5(file_path, assembly, mutsig_probabilities):
     df["is_gene_upregulated"] = (df.wt_prediction > df.mut_prediction).astype('bool')
 
     # fill in columns that will produce nan
-    for col in ["gene_id", "mutsig"]:
+    for col in ["gene_id", "biotype", "mutsig"]:
         existing_categories = df[col].cat.categories
         new_categories = existing_categories.append(pd.Index(['not_found']))
         df[col] = df[col].cat.set_categories(new_categories)
@@ -149,74 +187,244 @@ def apply_step_5(file_path, assembly, mutsig_probabilities):
 
     return df
 
-def crawl_and_import_results(folder_path, ending_string, db_path, table_name, assembly):
+RESULTS_TABLE_COLUMNS = {
+    "id": "TEXT PRIMARY KEY",
+    "wt_prediction": "REAL",
+    "mut_prediction": "REAL",
+    "pred_difference": "REAL",
+    "vcf_id": "TEXT",
+    "mirna_accession": "TEXT",
+    "gene_id": "TEXT",
+    "biotype": "TEXT",
+    "mutation_context": "TEXT",
+    "mutsig": "TEXT",
+    "is_intron": "BOOLEAN",
+    "is_gain": "BOOLEAN",
+    "is_gene_upregulated": "BOOLEAN",
+}
+
+# secondary indexes, built after the rows are in but inside the loading transaction
+RESULTS_TABLE_INDEXES = ("vcf_id", "gene_id")
+
+
+def find_result_files(folder_path, ending_string):
+    """
+    Find the result CSV files below a folder whose names end with `ending_string`.
+
+    Args:
+        folder_path (str): Root folder to search.
+        ending_string (str): Required file name ending, without the .csv extension.
+
+    Returns:
+        list: Sorted list of file paths.
+    """
     csv_files = []
-
-    # Find CSV files
     for root, _, files in os.walk(folder_path):
         csv_files.extend(
             os.path.join(root, file)
             for file in files
             if file.endswith(f"{ending_string}.csv")
         )
-
-    # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
+    return sorted(csv_files)
+
+
+def _init_step_5_worker(index_path):
+    # load the gene index once per worker process, so tasks do not carry the assembly
+    load_gene_index(path=index_path)
+
+
+def iter_step_5_frames(csv_files, assembly, mutsig_probabilities, workers=1):
+    """
+    Run apply_step_5 over result files, optionally in a process pool, and yield the frames.
+
+    Frames are yielded in file order. With several workers at most two files per worker are
+    in flight, so frames are not piling up faster than the consumer handles them; the gene
+    index is exported once here and loaded once per worker.
+
+    Args:
+        csv_files (list): Result files to process.
+        assembly (pyensembl.Genome): Assembly used to export the gene index if it is missing.
+        mutsig_probabilities (str): Path of the mutational signature probabilities CSV.
+        workers (int, optional): Number of worker processes. Default is 1 (no pool).
+
+    Yields:
+        pandas.DataFrame: The step 5 output of one file.
+    """
+    if workers <= 1:
+        for file_path in csv_files:
+            yield apply_step_5(file_path, assembly, mutsig_probabilities)
+        return
+
+    # export the gene index once here instead of racing to do it in every worker
+    load_gene_index(assembly)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_step_5_worker,
+                             initargs=(GENE_INDEX_NPZ,)) as executor:
+        pending = deque()
+        for file_path in csv_files:
+            pending.append(executor.submit(apply_step_5, file_path, None, mutsig_probabilities))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _rows_for_sqlite(df, columns):
+    """
+    Convert DataFrame columns into a list of row tuples of plain Python values.
+
+    sqlite3 cannot bind numpy scalars such as float32, and categorical missing values must
+    become None, so every column is converted as a whole before zipping.
+    """
+    converted = []
+    for col in columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+            values = series.astype(object).where(series.notna(), None).tolist()
+        elif pd.api.types.is_bool_dtype(series.dtype):
+            values = series.astype(np.int8).tolist()
+        elif pd.api.types.is_float_dtype(series.dtype):
+            values = series.astype(np.float64).where(series.notna(), None).tolist()
+        else:
+            values = series.tolist()
+        converted.append(values)
+    return list(zip(*converted))
+
+
+def crawl_and_import_results(folder_path, ending_string, db_path, table_name, assembly,
+                             workers=1, batch_size=50_000):
+    """
+    Run step 5 on every result file below a folder and bulk load the rows into SQLite.
+
+    Loading uses executemany in batches, with the rows of every file sorted by the id primary
+    key, WAL journaling (the previous journal mode is restored afterwards) and relaxed
+    synchronous/cache pragmas. All files and the indexes on vcf_id and gene_id go in one
+    transaction, so a failure (e.g. a duplicate id) rolls the whole load back. With workers > 1
+    the files are preprocessed in a process pool while this thread stays the only writer.
+
+    Args:
+        folder_path (str): Root folder of the result files.
+        ending_string (str): Required file name ending, without the .csv extension.
+        db_path (str): Path of the SQLite database.
+        table_name (str): Table to load into, created if it does not exist.
+        assembly (pyensembl.Genome): Assembly used to export the gene index if it is missing.
+        workers (int, optional): Number of preprocessing processes. Default is 1.
+        batch_size (int, optional): Rows per executemany call. Default is 50,000.
+    """
+    csv_files = find_result_files(folder_path, ending_string)
+
+    # Connect to SQLite database; transactions are managed explicitly below
+    conn = sqlite3.connect(db_path, isolation_level=None)
     cursor = conn.cursor()
 
+    # WAL is stored in the database file, so the journal mode of the user's DB is put back after
+    # the load
+    previous_journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-262144")  # 256 MB
+
     # Create table if it doesn't exist
+    column_definitions = ",\n            ".join(
+        f"{name} {sql_type}" for name, sql_type in RESULTS_TABLE_COLUMNS.items())
     cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS {table_name} (
-            id TEXT PRIMARY KEY,
-            wt_prediction REAL,
-            mut_prediction REAL,
-            pred_difference REAL,
-            vcf_id TEXT,
-            mirna_accession TEXT,
-            gene_id TEXT,
-            mutation_context TEXT,
-            mutsig TEXT,
-            is_intron BOOLEAN,
-            is_gain BOOLEAN,
-            is_gene_upregulated BOOLEAN
+            {column_definitions}
         )
     """)
 
-    # Import CSV files into the table
-    for file_path in csv_files:
-        
-        df = apply_step_5(file_path, assembly, MUTSIG_PROBABILITIES)
-
-        columns = ', '.join(df.columns)
-        placeholders = ', '.join(['?'] * len(df.columns))
-
-        # Insert data into the table
-        for row in df.values:
-            cursor.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})", row)
-
-    # Commit changes and close the connection
-    conn.commit()
-    conn.close()
-
-
-
-def crawl_and_import_results_into_df(folder_path, ending_string, assembly):
-    csv_files = []
-
-    # Find CSV files
-    for root, _, files in os.walk(folder_path):
-        csv_files.extend(
-            os.path.join(root, file)
-            for file in files
-            if file.endswith(f"{ending_string}.csv")
-        )
-
-    # Create a list to store DataFrames
-    dataframes = []
-
-    # Process each CSV file
-    for file_path in csv_files:
-        df = apply_step_5(file_path, assembly, MUTSIG_PROBABILITIES)
-        dataframes.append(df)
-
-    return pd.concat(dataframes, ignore_index=True)
+    # tables created before a column was added to the schema get it appended
+    table_info = list(cursor.execute(f"PRAGMA table_info({table_name})"))
+    existing_columns = {row[1] for row in table_info}
+    for name, sql_type in RESULTS_TABLE_COLUMNS.items():
+        if name not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {name} {sql_type.replace(' PRIMARY KEY', '')}")
+    id_is_key = any(row[1] == "id" and row[5] for row in table_info)
+
+    try:
+        cursor.execute("BEGIN")
+        if not id_is_key:
+            # tables loaded without the primary key still reject duplicate ids on insert
+            cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_id ON {table_name} (id)")
+
+        # Import CSV files into the table
+        for df in iter_step_5_frames(csv_files, assembly, MUTSIG_PROBABILITIES, workers=workers):
+            # inserting in key order appends to the primary key B-tree instead of splitting pages
+            df = df.sort_values("id", ignore_index=True)
+            columns = list(df.columns)
+            placeholders = ', '.join(['?'] * len(columns))
+            insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+            for start in range(0, len(df), batch_size):
+                cursor.executemany(insert_sql, _rows_for_sqlite(
+                    df.iloc[start:start + batch_size], columns))
+
+        for column in RESULTS_TABLE_INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_{column} ON {table_name} ({column})")
+        cursor.execute("COMMIT")
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA journal_mode={previous_journal_mode}")
+        conn.close()
+
+
+
+def concat_with_union_categoricals(frames):
+    """
+    Concatenate DataFrames whose categorical columns have different category sets.
+
+    pd.concat turns such columns into object dtype. Here every categorical column is first
+    recast to the union of its categories across all frames, so the result stays categorical.
+
+    Args:
+        frames (list): DataFrames with the same columns.
+
+    Returns:
+        pandas.DataFrame: The concatenated DataFrame with a fresh RangeIndex.
+    """
+    if not frames:
+        return pd.DataFrame()
+
+    categorical_columns = {col for df in frames for col in df.columns
+                           if isinstance(df[col].dtype, pd.CategoricalDtype)}
+
+    for col in categorical_columns:
+        categories = pd.Index([])
+        for df in frames:
+            values = df[col].cat.categories if isinstance(df[col].dtype, pd.CategoricalDtype) \
+                else pd.Index(df[col].dropna().unique())
+            categories = categories.union(values)
+
+        dtype = pd.CategoricalDtype(categories)
+        for df in frames:
+            df[col] = df[col].astype(dtype)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def crawl_and_import_results_into_df(folder_path, ending_string, assembly, workers=1, lazy=False):
+    """
+    Run step 5 on every result file below a folder and combine the outputs.
+
+    Args:
+        folder_path (str): Root folder of the result files.
+        ending_string (str): Required file name ending, without the .csv extension.
+        assembly (pyensembl.Genome): Assembly used to export the gene index if it is missing.
+        workers (int, optional): Number of processes running apply_step_5. Default is 1.
+        lazy (bool, optional): If True, return an iterator over the per-file frames instead of
+            one combined frame, for cohorts that do not fit in memory. Default is False.
+
+    Returns:
+        pandas.DataFrame or iterator: The combined frame with categoricals unified across files,
+            or an iterator of per-file frames (in file order) if lazy is True.
+    """
+    csv_files = find_result_files(folder_path, ending_string)
+
+    frames = iter_step_5_frames(csv_files, assembly, MUTSIG_PROBABILITIES, workers=workers)
+    if lazy:
+        return frames
+
+    return concat_with_union_categoricals(list(frames))
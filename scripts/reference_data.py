@@ -0,0 +1,156 @@
+import logging
+import os
+import re
+import threading
+
+import pandas as pd
+
+from scripts.globals import MIRNA_COORDS_DIR, MIRNA_CSV, TA_SPS_CSV
+
+_tables = {}
+# reentrant, the panel tables are built from other cached tables
+_tables_lock = threading.RLock()
+
+
+def _cached(key, loader):
+    """
+    Load a table once per process and hand out the same object afterwards.
+
+    Callers must treat the returned tables as read-only.
+    """
+    with _tables_lock:
+        if key not in _tables:
+            _tables[key] = loader()
+        return _tables[key]
+
+
+def read_panel_file(path):
+    """
+    Read the miRNA accessions or names listed in a panel file.
+
+    The first field of every line is used, so plain lists as well as CSV or TSV files with
+    the miRNA in the first column work; empty lines, '#' comments and header names are skipped.
+
+    Returns:
+        set: The listed miRNAs.
+    """
+    with open(path) as f:
+        fields = [re.split(r"[,\t ]", line.strip(), maxsplit=1)[0] for line in f]
+    return {field for field in fields
+            if field and not field.startswith("#") and field not in ("mirna_accession", "mirna_name")}
+
+
+def select_mirna_panel(mirnas, panel):
+    """
+    Restrict the miRNA table to a panel.
+
+    Args:
+        mirnas (pandas.DataFrame): The miRNA table, as read from MIRNA_CSV.
+        panel (MirnaPanel): Panel file and/or query; None keeps every miRNA.
+
+    Returns:
+        pandas.DataFrame: The miRNAs of the panel.
+    """
+    if panel is None:
+        return mirnas
+
+    selected = mirnas
+    if panel.query:
+        selected = selected.query(panel.query)
+    if panel.file:
+        listed = read_panel_file(panel.file)
+        unknown = listed - set(mirnas["mirna_accession"]) - set(mirnas["mirna_name"])
+        if unknown:
+            logging.warning(f"{len(unknown)} miRNAs of {panel.file} are not in {MIRNA_CSV}, "
+                            f"e.g. {sorted(unknown)[:5]}")
+        selected = selected[selected["mirna_accession"].isin(listed) | selected["mirna_name"].isin(listed)]
+
+    if selected.empty:
+        raise ValueError(f"The miRNA panel {panel} selects no miRNAs")
+    return selected.reset_index(drop=True)
+
+
+def load_mirna_table(panel=None):
+    """
+    Args:
+        panel (MirnaPanel, optional): Restrict the table to a panel. Default keeps every miRNA.
+
+    Returns:
+        pandas.DataFrame: The rows of MIRNA_CSV in the panel.
+    """
+    return _cached(("mirna_table", MIRNA_CSV, panel),
+                   lambda: select_mirna_panel(pd.read_csv(MIRNA_CSV), panel))
+
+
+def load_mirna_sequences(panel=None):
+    """
+    Args:
+        panel (MirnaPanel, optional): Restrict to a panel. Default keeps every miRNA.
+
+    Returns:
+        dict: miRNA accession mapped to its sequence, from MIRNA_CSV.
+    """
+    return _cached(("mirna_sequences", MIRNA_CSV, panel), lambda: load_mirna_table(panel).set_index(
+        'mirna_accession')['sequence'].to_dict())
+
+
+def load_mirna_conservation(panel=None):
+    """
+    Args:
+        panel (MirnaPanel, optional): Restrict to a panel. Default keeps every miRNA.
+
+    Returns:
+        pandas.DataFrame: 'mirna_accession' and 'mirna_conservation' columns, from MIRNA_CSV.
+    """
+    return _cached(("mirna_conservation", MIRNA_CSV, panel), lambda: (
+        load_mirna_table(panel)[["mirna_accession", "conservation"]]
+        .rename(columns={"conservation": "mirna_conservation"})
+        .reset_index(drop=True)))
+
+
+def load_ta_sps():
+    """
+    Returns:
+        pandas.DataFrame: 'seed', 'ta_log10' and 'sps_mean' columns, from TA_SPS_CSV.
+    """
+    return _cached(("ta_sps", TA_SPS_CSV), lambda: (
+        pd.read_csv(TA_SPS_CSV, usecols=["seed_8mer", "ta_log10", "sps_mean"])
+        .rename(columns={"seed_8mer": "seed"})))
+
+
+def load_mirna_coordinates(grch):
+    """
+    Args:
+        grch (int): The genome reference coordinate system version (e.g., 37, 38).
+
+    Returns:
+        pandas.DataFrame: miRNA coordinates of the assembly.
+    """
+    mirna_coords_file = os.path.join(MIRNA_COORDS_DIR, f"grch{grch}_coordinates.csv")
+    return _cached(("mirna_coordinates", mirna_coords_file), lambda: pd.read_csv(mirna_coords_file))
+
+
+def warm_up(grch=37, model_path=None, panel=None):
+    """
+    Load every reference table (and the XGBoost model) into this process ahead of the first request.
+
+    Args:
+        grch (int, optional): Assembly of the miRNA coordinates. Default is 37.
+        model_path (str, optional): Model to load. Default is the step 4 model, XGB_MODEL.
+        panel (MirnaPanel, optional): miRNA panel the requests are scored against.
+    """
+    from scripts.pipeline_steps.step4 import load_xgb_model
+
+    load_mirna_sequences(panel)
+    load_mirna_conservation(panel)
+    load_ta_sps()
+    load_mirna_coordinates(grch)
+    if model_path is None:
+        load_xgb_model()
+    else:
+        load_xgb_model(model_path)
+
+
+def clear_reference_data():
+    with _tables_lock:
+        _tables.clear()
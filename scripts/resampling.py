@@ -0,0 +1,212 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from statsmodels.stats.multitest import multipletests
+
+# replicates generated and reduced at once by bootstrap_comparison
+REPLICATE_BLOCK_SIZE = 100
+
+
+def count_matrices(frames, genes=None):
+    """
+    Count up- and downregulated targets per gene for several pipeline result frames.
+
+    Args:
+        frames (list): DataFrames with 'gene_name' and 'is_gene_upregulated' columns, one per
+            replicate (e.g. one per synthetic run).
+        genes (array-like, optional): Genes to report, in this order. Default is every gene
+            seen in any frame, sorted.
+
+    Returns:
+        tuple: (genes, up, down) with `genes` a pandas.Index and `up`/`down` integer matrices
+            of shape (genes, replicates).
+    """
+    if genes is None:
+        genes = pd.Index(sorted(set().union(*(frame['gene_name'].dropna().unique() for frame in frames))))
+    else:
+        genes = pd.Index(genes)
+
+    up = np.zeros((len(genes), len(frames)), dtype=np.int64)
+    down = np.zeros((len(genes), len(frames)), dtype=np.int64)
+
+    for column, frame in enumerate(frames):
+        codes = genes.get_indexer(frame['gene_name'])
+        known = codes >= 0
+        upregulated = frame['is_gene_upregulated'].to_numpy(dtype=bool)
+        up[:, column] = np.bincount(codes[known & upregulated], minlength=len(genes))
+        down[:, column] = np.bincount(codes[known & ~upregulated], minlength=len(genes))
+
+    return genes, up, down
+
+
+def log2_ratios(up, down):
+    """
+    Pseudocount log2 ratio of up- to downregulated counts, as stats.safe_log2_ratio, for arrays.
+    """
+    return np.log2((up + 1) / (down + 1))
+
+
+class NullAccumulator:
+    """
+    Running summary of a per-gene null distribution that arrives in blocks of replicates.
+
+    Only sums and exceedance counts are kept, so replicate blocks can be reduced in worker
+    processes and merged afterwards.
+
+    Args:
+        observed (numpy.ndarray): Observed statistic per gene.
+    """
+
+    def __init__(self, observed):
+        self.observed = np.asarray(observed, dtype=float)
+        self.n = 0
+        self.total = np.zeros(len(self.observed))
+        self.total_squares = np.zeros(len(self.observed))
+        self.at_least = np.zeros(len(self.observed), dtype=np.int64)
+        self.at_most = np.zeros(len(self.observed), dtype=np.int64)
+
+    def update(self, null_block):
+        """
+        Add a (genes x replicates) block of null statistics.
+        """
+        null_block = np.asarray(null_block, dtype=float)
+        self.n += null_block.shape[1]
+        self.total += null_block.sum(axis=1)
+        self.total_squares += np.square(null_block).sum(axis=1)
+        self.at_least += (null_block >= self.observed[:, None]).sum(axis=1)
+        self.at_most += (null_block <= self.observed[:, None]).sum(axis=1)
+        return self
+
+    def merge(self, other):
+        self.n += other.n
+        self.total += other.total
+        self.total_squares += other.total_squares
+        self.at_least += other.at_least
+        self.at_most += other.at_most
+        return self
+
+    def summary(self, genes):
+        """
+        Per-gene null mean and standard deviation, z-score and empirical p-values.
+
+        Empirical p-values use the (1 + exceedances) / (1 + replicates) estimate; the
+        two-sided value is twice the smaller tail, capped at 1.
+
+        Args:
+            genes (pandas.Index): Gene names in the order of the observed statistic.
+
+        Returns:
+            pandas.DataFrame: One row per gene.
+        """
+        if self.n == 0:
+            raise ValueError("No null replicates were added")
+
+        mean = self.total / self.n
+        variance = np.maximum(self.total_squares / self.n - np.square(mean), 0.0)
+        if self.n > 1:
+            variance *= self.n / (self.n - 1)
+        std = np.sqrt(variance)
+
+        epsilon = 1e-10
+        p_upper = (self.at_least + 1) / (self.n + 1)
+        p_lower = (self.at_most + 1) / (self.n + 1)
+        p_value = np.minimum(1.0, 2 * np.minimum(p_upper, p_lower))
+
+        result = pd.DataFrame({
+            'observed': self.observed,
+            'null_mean': mean,
+            'null_std': std,
+            'z_score': (self.observed - mean) / (std + epsilon),
+            'p_upper': p_upper,
+            'p_lower': p_lower,
+            'empirical_p_value': p_value,
+        }, index=genes)
+        result['adjusted_empirical_p_value'] = multipletests(
+            result['empirical_p_value'], method='fdr_bh')[1] if len(result) else []
+        return result
+
+
+def replicate_comparison(genes, real_up, real_down, synth_up, synth_down):
+    """
+    Compare the real log2 ratio of every gene with its distribution over synthetic replicates.
+
+    Args:
+        genes (pandas.Index): Gene names, as returned by count_matrices.
+        real_up, real_down (numpy.ndarray): Real counts per gene (a single column matrix or a vector).
+        synth_up, synth_down (numpy.ndarray): Synthetic counts of shape (genes, replicates).
+
+    Returns:
+        pandas.DataFrame: NullAccumulator.summary() with 'real_log2_ratio' as the observed value.
+    """
+    observed = log2_ratios(np.asarray(real_up).reshape(len(genes), -1).sum(axis=1),
+                           np.asarray(real_down).reshape(len(genes), -1).sum(axis=1))
+    accumulator = NullAccumulator(observed).update(log2_ratios(synth_up, synth_down))
+    return accumulator.summary(genes).rename(columns={'observed': 'real_log2_ratio'})
+
+
+def _bootstrap_block(observed, probabilities, n_variants, n_replicates, seed):
+    """
+    Draw `n_replicates` bootstrap count tables and reduce them into a NullAccumulator.
+    """
+    rng = np.random.default_rng(seed)
+    n_genes = len(observed)
+    # every replicate resamples n_variants targets over the (gene, direction) cells
+    draws = rng.multinomial(n_variants, probabilities, size=n_replicates).T
+    return NullAccumulator(observed).update(log2_ratios(draws[:n_genes], draws[n_genes:]))
+
+
+def bootstrap_comparison(genes, real_up, real_down, synth_up, synth_down, n_replicates=1000,
+                         workers=1, seed=0, block_size=REPLICATE_BLOCK_SIZE, n_variants=None):
+    """
+    Compare real log2 ratios with a bootstrap null drawn from the pooled synthetic counts.
+
+    The synthetic targets of all given replicates are pooled into (gene, direction) cell
+    frequencies, and every bootstrap replicate redraws as many targets as the real data
+    holds. The pseudocount of log2_ratios makes the spread of the null depend on that depth,
+    so drawing at the real depth keeps the null comparable with the observed ratios.
+    Replicates are generated and reduced in blocks, optionally spread over worker processes;
+    results depend only on `seed`, not on `workers`.
+
+    Args:
+        genes (pandas.Index): Gene names, as returned by count_matrices.
+        real_up, real_down (numpy.ndarray): Real counts per gene.
+        synth_up, synth_down (numpy.ndarray): Synthetic counts of shape (genes, replicates).
+        n_replicates (int, optional): Number of bootstrap replicates. Default is 1000.
+        workers (int, optional): Worker processes; 1 runs in this process. Default is 1.
+        seed (int, optional): Seed of the random generator. Default is 0.
+        block_size (int, optional): Replicates per block. Default is REPLICATE_BLOCK_SIZE.
+        n_variants (int, optional): Targets drawn per replicate. Default is the real depth,
+            the sum of `real_up` and `real_down`.
+
+    Returns:
+        pandas.DataFrame: NullAccumulator.summary() with 'real_log2_ratio' as the observed value.
+    """
+    synth_up = np.asarray(synth_up).reshape(len(genes), -1)
+    synth_down = np.asarray(synth_down).reshape(len(genes), -1)
+    real_up = np.asarray(real_up).reshape(len(genes), -1).sum(axis=1)
+    real_down = np.asarray(real_down).reshape(len(genes), -1).sum(axis=1)
+    observed = log2_ratios(real_up, real_down)
+
+    cells = np.concatenate([synth_up.sum(axis=1), synth_down.sum(axis=1)]).astype(float)
+    if cells.sum() == 0:
+        raise ValueError("The synthetic counts are all zero")
+    probabilities = cells / cells.sum()
+    if n_variants is None:
+        n_variants = int(real_up.sum() + real_down.sum())
+
+    sizes = [min(block_size, n_replicates - start) for start in range(0, n_replicates, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(observed, probabilities, n_variants, size, block_seed)
+             for size, block_seed in zip(sizes, seeds)]
+
+    accumulator = NullAccumulator(observed)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for block in executor.map(_bootstrap_block, *zip(*tasks)):
+                accumulator.merge(block)
+    else:
+        for task in tasks:
+            accumulator.merge(_bootstrap_block(*task))
+
+    return accumulator.summary(genes).rename(columns={'observed': 'real_log2_ratio'})
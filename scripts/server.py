@@ -0,0 +1,342 @@
+"""
+Long-running scoring server that keeps the pipeline state warm between requests.
+
+Reference tables, sequence caches and the XGBoost model are loaded once at startup, RNAduplex
+results are memoized per (mRNA, miRNA) pair, and requests arriving close together are scored
+as one micro-batch. Everything runs locally; nothing is fetched over the network.
+
+Usage:
+    python -m scripts.server --port 8765
+    curl -X POST localhost:8765/score -d '{"variants": [{"chr": 1, "pos": 1141, "ref": "G", "alt": "A"}]}'
+    curl localhost:8765/stats
+
+Endpoints:
+    POST /score   {"variants": [...records...], "id": "sample"} -> results, invalid_ids, case_2_ids
+    GET  /stats   latency percentiles, batch sizes and duplex cache counters
+    GET  /health  "ok" once the server is warm
+
+Malformed variants, or variants on chromosomes without a reference FASTA, are answered with
+400 before they join a micro-batch; if scoring a batch still fails, its requests are scored
+one at a time so only the failing one gets the error.
+"""
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from scripts.api import prepare_variants, score_variants
+from scripts.config import PipelineConfig
+from scripts.pipeline_steps.step2 import run_rnaduplex_on_string
+from scripts.reference_data import warm_up
+from scripts.utils.cache_utils import BoundedCache
+
+DEFAULT_PORT = 8765
+DUPLEX_CACHE_MB = 256
+# latencies kept for the percentiles reported by /stats
+LATENCY_WINDOW = 10_000
+
+
+def parse_fasta_records(fasta_string):
+    """
+    Split RNAduplex input into (header, mrna_sequence, mirna_sequence) records.
+    """
+    lines = [line for line in fasta_string.splitlines() if line]
+    return [tuple(lines[i:i + 3]) for i in range(0, len(lines) - 2, 3)]
+
+
+class CachedRNAduplex:
+    """
+    RNAduplex runner that memoizes the structure line of every (mRNA, miRNA) sequence pair.
+
+    Only the pairs missing from the cache are sent to RNAduplex; the output is reassembled in
+    input order with the original headers, so callers see exactly what RNAduplex would print.
+
+    Args:
+        max_mb (float, optional): Memory budget of the cache. Default is DUPLEX_CACHE_MB.
+        rnaduplex (callable, optional): Function mapping RNAduplex input to its raw output.
+    """
+
+    def __init__(self, max_mb=DUPLEX_CACHE_MB, rnaduplex=run_rnaduplex_on_string):
+        self.cache = BoundedCache("duplex", max_mb)
+        self.rnaduplex = rnaduplex
+
+    def __call__(self, fasta_string):
+        records = parse_fasta_records(fasta_string)
+        structures = [self.cache.get((mrna, mirna), None) for _, mrna, mirna in records]
+
+        missing = [i for i, structure in enumerate(structures) if structure is None]
+        if missing:
+            # number the missing records so the output can be matched back to them
+            fasta_missing = "".join(f">{n}\n{records[i][1]}\n{records[i][2]}\n\n"
+                                    for n, i in enumerate(missing))
+            output = self.rnaduplex(fasta_missing).splitlines()
+            for line_number, line in enumerate(output[:-1]):
+                if line.startswith(">"):
+                    i = missing[int(line[1:].split()[0])]
+                    structures[i] = output[line_number + 1]
+                    self.cache.put((records[i][1], records[i][2]), structures[i])
+
+        return "".join(f"{header}\n{structure}\n"
+                       for (header, _, _), structure in zip(records, structures)
+                       if structure is not None)
+
+
+class MicroBatcher:
+    """
+    Collect scoring requests for up to `window_ms` and score them with one score_variants call.
+
+    Args:
+        config (PipelineConfig): Settings passed to score_variants.
+        rnaduplex (callable): RNAduplex runner, e.g. a CachedRNAduplex.
+        window_ms (float, optional): How long to wait for more requests after the first one.
+        max_variants (int, optional): Score the batch right away once it holds this many variants.
+    """
+
+    def __init__(self, config, rnaduplex, window_ms=20, max_variants=500):
+        self.config = config
+        self.rnaduplex = rnaduplex
+        self.window = window_ms / 1000
+        self.max_variants = max_variants
+        self.requests = queue.Queue()
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, variants, vcf_id):
+        """
+        Queue variants for scoring.
+
+        Malformed variants are rejected here (see api.check_variants), so they never join a batch.
+
+        Returns:
+            concurrent.futures.Future: Resolves to a dict with 'results', 'invalid_ids' and 'case_2_ids'.
+
+        Raises:
+            ValueError: If the variants cannot be scored.
+        """
+        df = prepare_variants(variants, vcf_id)
+        future = Future()
+        self.requests.put((df, future))
+        return future
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+        n_variants = len(batch[0][0])
+        while n_variants < self.max_variants:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_variants += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.batch_sizes.append(len(batch))
+            try:
+                self._score(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._fail(batch[0][1], e)
+                    continue
+                # one bad request must not fail the others, so score them one at a time
+                logging.exception(f"Scoring a batch of {len(batch)} requests failed, retrying them one by one")
+                for request in batch:
+                    if request[1].done():
+                        continue
+                    try:
+                        self._score([request])
+                    except Exception as e:
+                        self._fail(request[1], e)
+
+    @staticmethod
+    def _fail(future, error):
+        # called from an except block, so the traceback is logged too
+        logging.exception("Scoring a request failed")
+        if not future.done():
+            future.set_exception(error)
+
+    def _score(self, batch):
+        variants = pd.concat([df for df, _ in batch], ignore_index=True)
+        results, details = score_variants(variants, self.config, rnaduplex=self.rnaduplex,
+                                          return_details=True)
+        # result ids are '{variant id}_{mirna accession}'
+        result_variant_ids = results["id"].str.rsplit("_", n=1).str[0]
+
+        for df, future in batch:
+            variant_ids = set(df["id"].astype(str) + "_" + df["chr"].astype(str) + "_"
+                              + df["pos"].astype(str) + "_" + df["ref"] + "_" + df["alt"])
+            future.set_result({
+                "results": results[result_variant_ids.isin(variant_ids)].to_dict(orient="records"),
+                "invalid_ids": [i for i in details["invalid_ids"] if i in variant_ids],
+                "case_2_ids": [i for i in details["case_2_ids"] if i in variant_ids],
+            })
+
+
+class ScoringService:
+    """
+    Warm pipeline state shared by all request handler threads.
+    """
+
+    def __init__(self, config=None, window_ms=20, max_variants=500, duplex_cache_mb=DUPLEX_CACHE_MB):
+        self.config = config or PipelineConfig()
+        warm_up(panel=self.config.mirna_panel)
+        self.duplex = CachedRNAduplex(duplex_cache_mb)
+        self.batcher = MicroBatcher(self.config, self.duplex, window_ms, max_variants)
+        self.latencies_ms = deque(maxlen=LATENCY_WINDOW)
+        self.requests_served = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def score(self, payload):
+        start = time.perf_counter()
+        response = self.batcher.submit(payload["variants"], payload.get("id", "api")).result()
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.latencies_ms.append(latency_ms)
+            self.requests_served += 1
+        response["latency_ms"] = latency_ms
+        return response
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self.latencies_ms)
+            served = self.requests_served
+        percentiles = ({f"p{p}": float(np.percentile(latencies, p)) for p in (50, 90, 95, 99)}
+                       if len(latencies) else {})
+        batch_sizes = list(self.batcher.batch_sizes)
+        return {
+            "requests": served,
+            "uptime_seconds": time.time() - self.started,
+            "latency_ms": {**percentiles, "max": float(latencies.max()) if len(latencies) else None},
+            "batches": len(batch_sizes),
+            "mean_requests_per_batch": float(np.mean(batch_sizes)) if batch_sizes else None,
+            "duplex_cache": self.duplex.cache.stats(),
+        }
+
+
+def make_handler(service):
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, body):
+            data = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, service.stats())
+            elif self.path == "/health":
+                self._send_json(200, "ok")
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/score":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                self._send_json(200, service.score(payload))
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_json(400, {"error": str(e)})
+            except Exception as e:
+                logging.exception("Request failed")
+                self._send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return ScoringHandler
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, **service_kwargs):
+    """
+    Start the scoring server and block until it is interrupted.
+    """
+    service = ScoringService(**service_kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Scoring server listening on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def score_remote(variants, url=f"http://127.0.0.1:{DEFAULT_PORT}", vcf_id="api", timeout=600):
+    """
+    Local client: score variants on a running server.
+
+    Args:
+        variants (pandas.DataFrame or list): Variants with 'chr', 'pos', 'ref', 'alt' (and optionally 'id').
+        url (str, optional): Base URL of the server.
+        vcf_id (str, optional): Sample name for variants without 'id'. Default is "api".
+
+    Returns:
+        dict: The server response; 'results' is a DataFrame.
+    """
+    if isinstance(variants, pd.DataFrame):
+        variants = variants.to_dict(orient="records")
+    request = urllib.request.Request(
+        f"{url}/score", data=json.dumps({"variants": variants, "id": vcf_id}, default=int).encode(),
+        headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = json.loads(response.read())
+    body["results"] = pd.DataFrame(body["results"], columns=["id", "wt_prediction",
+                                                             "mut_prediction", "pred_difference"])
+    return body
+
+
+def fetch_stats(url=f"http://127.0.0.1:{DEFAULT_PORT}", timeout=10):
+    with urllib.request.urlopen(f"{url}/stats", timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve variant scoring over HTTP with warm state.')
+    parser.add_argument('--host', default="127.0.0.1", type=str, help='Address to bind to')
+    parser.add_argument('--port', default=DEFAULT_PORT, type=int, help='Port to listen on')
+    parser.add_argument('-t', '--threshold', default=0.2, type=float,
+                        help='Threshold for filtering out pairs that have less prediction difference than the threshold')
+    parser.add_argument('--batch-window-ms', default=20, type=float,
+                        help='How long to wait for more requests before scoring a micro-batch')
+    parser.add_argument('--max-batch-variants', default=500, type=int,
+                        help='Score a micro-batch right away once it holds this many variants')
+    parser.add_argument('--mirna-panel', type=str, default=None,
+                        help='File listing the miRNAs (accessions or names, one per line) to fold against')
+    parser.add_argument('--mirna-query', type=str, default=None,
+                        help='Pandas query selecting miRNAs from the miRNA table, e.g. "conservation >= 2"')
+    parser.add_argument('--duplex-cache-mb', default=DUPLEX_CACHE_MB, type=float,
+                        help='Memory budget of the RNAduplex result cache')
+    args = parser.parse_args()
+
+    config = PipelineConfig(filter_threshold=args.threshold, mirna_panel_file=args.mirna_panel,
+                            mirna_panel_query=args.mirna_query)
+    serve(args.host, args.port, config=config,
+          window_ms=args.batch_window_ms, max_variants=args.max_batch_variants,
+          duplex_cache_mb=args.duplex_cache_mb)
+
+
+if __name__ == "__main__":
+    main()
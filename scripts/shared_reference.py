@@ -0,0 +1,146 @@
+"""
+Read-only pre-filter intervals shared by the worker processes of a run.
+
+The interval arrays of the step 2 pre-filter (Ensembl 3'UTRs, exons or genes, and BED
+intervals) are the only large reference data a chunk reads. Before the chunks are submitted,
+the driver writes them to a directory of .npy files. Worker processes attach to it in their
+initializer and memory map the arrays read-only, so all workers share one copy through the page
+cache instead of each loading the gene index.
+
+This only saves memory in workers that do not fork from the driver: process pools under the
+spawn or forkserver start method (macOS, Windows, and Linux from Python 3.14) and filequeue
+workers joining with `synth.py --join`. Forked workers inherit the intervals run_pipeline
+loads in the driver and share them copy-on-write either way. With 1M BED intervals
+(`python -m benchmarks.run_benchmarks --worker-memory`), a spawned worker holds about 135 MB
+of private memory (USS) without the store and about 59 MB with it. A forked worker holds
+about 35 MB either way.
+
+The memory each worker keeps to itself is the XGBoost model (about 37 MB) and the miRNA,
+TA/SPS and coordinate tables (about 5 MB), which scripts.reference_data loads per process;
+the store does not share them.
+"""
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from scripts.gene_index import IntervalSet, load_region_filter, share_region_filter
+
+# bump when the layout of the store changes
+REFERENCE_STORE_VERSION = 2
+# backends whose workers are processes started on this machine by the executor
+SHARED_REFERENCE_BACKENDS = ("process", "filequeue")
+_MANIFEST = "manifest.json"
+
+# the store this process is attached to
+_attached = None
+
+
+def _save_array(store_dir, name, array):
+    np.save(os.path.join(store_dir, f"{name}.npy"), array, allow_pickle=False)
+    return f"{name}.npy"
+
+
+def _load_array(store_dir, filename):
+    # a plain ndarray view of the read-only mapping
+    return np.load(os.path.join(store_dir, filename), mmap_mode="r", allow_pickle=False).view(np.ndarray)
+
+
+def pack_reference_store(config, store_dir):
+    """
+    Write the pre-filter intervals of a run into `store_dir`.
+
+    The store is written next to its final location and renamed into place, so workers never
+    attach to a half-written store.
+
+    Args:
+        config (PipelineConfig): Settings of the run with a pre-filter.
+        store_dir (str): Directory of the store; an existing store there is replaced.
+
+    Returns:
+        int: Size of the stored arrays in bytes.
+    """
+    tmp_dir = f"{store_dir}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(tmp_dir)
+    try:
+        size = _write_store(config, tmp_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    return size
+
+
+def _write_store(config, tmp_dir):
+    interval_sets = []
+    for i, interval_set in enumerate(load_region_filter(config.prefilter, config.prefilter_bed)):
+        interval_sets.append({name: _save_array(tmp_dir, f"intervals{i}_{name}", array)
+                              for name, array in interval_set.to_arrays().items()})
+
+    with open(os.path.join(tmp_dir, _MANIFEST), 'w') as f:
+        json.dump({"version": REFERENCE_STORE_VERSION, "features": list(config.prefilter),
+                   "bed_path": config.prefilter_bed, "interval_sets": interval_sets}, f)
+
+    return sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))
+
+
+def attach_reference_store(store_dir):
+    """
+    Serve the pre-filter of this process from a store written by pack_reference_store.
+
+    Used as the initializer of the worker processes; attaching to the same store twice is a no-op.
+
+    Args:
+        store_dir (str): Directory of the store.
+    """
+    global _attached
+    if _attached == store_dir:
+        return
+
+    with open(os.path.join(store_dir, _MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest["version"] != REFERENCE_STORE_VERSION:
+        raise ValueError(f"{store_dir} was written by another version of the reference store")
+
+    interval_sets = [IntervalSet.from_arrays({name: _load_array(store_dir, filename)
+                                              for name, filename in arrays.items()})
+                     for arrays in manifest["interval_sets"]]
+    share_region_filter(interval_sets, tuple(manifest["features"]), manifest["bed_path"])
+
+    _attached = store_dir
+
+
+def uses_reference_store(config):
+    """
+    Whether the workers of a run attach to a reference store: only for runs with a pre-filter
+    on backends whose workers are processes started on this machine, since threads share the
+    driver's intervals anyway.
+    """
+    return (config.shared_reference and config.backend in SHARED_REFERENCE_BACKENDS
+            and not config.rescore and bool(config.prefilter or config.prefilter_bed))
+
+
+@contextmanager
+def reference_store(config):
+    """
+    Pack the reference store of a run that uses one.
+
+    Yields:
+        tuple: (store directory, size in bytes), or (None, 0) when the run does not use a store
+            (see uses_reference_store). The store is removed when the block ends.
+    """
+    if not uses_reference_store(config):
+        yield None, 0
+        return
+
+    store_dir = config.reference_store_path
+    size = pack_reference_store(config, store_dir)
+    try:
+        yield store_dir, size
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
@@ -1,7 +1,12 @@
 import pandas as pd
 import numpy as np
 from statsmodels.stats.multitest import multipletests
-from scipy.stats import fisher_exact
+from scipy.special import gammaln
+
+# relative tolerance under which a table counts as exactly as likely as the observed one
+FISHER_TIE_TOLERANCE = 1e-7
+# upper bound on the cells of one padded support matrix in fisher_exact_pvalues
+FISHER_BATCH_CELLS = 4_000_000
 
 
 def safe_log2_ratio(df):
@@ -17,10 +22,85 @@ def process_data(df, name):
     return grouped.sort_values('log2_ratio', ascending=False)
 
 
-def compare_datasets(real_df, synth_df):
+def _log_choose(n, k):
+    return gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+
+
+def _fisher_unique_tables(tables):
+    """
+    Two-sided Fisher p-values of distinct 2x2 tables with nonzero margins.
+
+    The tables are processed in groups of similar support length; every group is padded to
+    a (tables x support) matrix of hypergeometric log-probabilities.
+    """
+    a, b, c, d = tables.T
+    row1, row2, col1 = a + b, c + d, a + c
+    total = row1 + row2
+    low = np.maximum(0, col1 - row2)
+    high = np.minimum(col1, row1)
+    support = high - low + 1
+
+    pvalues = np.empty(len(tables))
+    order = np.argsort(support, kind="stable")
+    start = 0
+    while start < len(order):
+        # grow the batch while the padded matrix stays within the cell budget
+        stop = start + 1
+        while stop < len(order) and support[order[stop]] * (stop + 1 - start) <= FISHER_BATCH_CELLS:
+            stop += 1
+        batch = order[start:stop]
+        width = support[batch].max()
+
+        k = low[batch, None] + np.arange(width)[None, :]
+        valid = k <= high[batch, None]
+        k = np.where(valid, k, low[batch, None])
+
+        log_norm = _log_choose(total[batch], col1[batch])[:, None]
+        log_pmf = (_log_choose(row1[batch, None], k)
+                   + _log_choose(row2[batch, None], col1[batch, None] - k) - log_norm)
+        log_observed = (_log_choose(row1[batch], a[batch])
+                        + _log_choose(row2[batch], c[batch]) - log_norm[:, 0])
+
+        as_extreme = valid & (log_pmf <= log_observed[:, None] + np.log1p(FISHER_TIE_TOLERANCE))
+        pvalues[batch] = np.where(as_extreme, np.exp(log_pmf), 0.0).sum(axis=1)
+        start = stop
+
+    return np.minimum(pvalues, 1.0)
+
+
+def fisher_exact_pvalues(a, b, c, d):
+    """
+    Two-sided Fisher's exact test for many 2x2 tables [[a, b], [c, d]] at once.
+
+    Gives the same p-values as scipy.stats.fisher_exact: the summed probability of all
+    tables with the observed margins that are at most as likely as the observed table, and
+    1 when a row or column sum is zero. Each distinct table is evaluated only once.
+
+    Args:
+        a, b, c, d (array-like): Non-negative integer cells of the tables.
+
+    Returns:
+        numpy.ndarray: One p-value per table.
+    """
+    tables = np.column_stack([np.asarray(x, dtype=np.int64) for x in (a, b, c, d)])
+    if len(tables) == 0:
+        return np.empty(0)
+    if (tables < 0).any():
+        raise ValueError("All values in the tables must be nonnegative.")
+
+    unique_tables, inverse = np.unique(tables, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    ua, ub, uc, ud = unique_tables.T
+    degenerate = (ua + ub == 0) | (uc + ud == 0) | (ua + uc == 0) | (ub + ud == 0)
+
+    unique_pvalues = np.ones(len(unique_tables))
+    if (~degenerate).any():
+        unique_pvalues[~degenerate] = _fisher_unique_tables(unique_tables[~degenerate])
+    return unique_pvalues[inverse]
+
+
+def _comparison_frame(real_df, synth_df):
     common_genes = list(set(real_df.index) & set(synth_df.index))
-    print(f"\nNumber of common genes: {len(common_genes)}")
-
     real_subset = real_df.loc[common_genes]
     synth_subset = synth_df.loc[common_genes]
 
@@ -41,13 +121,28 @@ def compare_datasets(real_df, synth_df):
     result['z_score'] = (result['log2fc'] - result['log2fc'].mean()
                          ) / (result['log2fc'].std() + epsilon)
 
-    # Calculate Fisher's exact test p-values
-    result['fisher_p_value'] = result.apply(lambda row: fisher_exact([[row['real_upregulated'], row['real_downregulated']],
-                                                               [row['synth_upregulated'], row['synth_downregulated']]])[1], axis=1)
+    return result
+
 
+def _fisher_columns(result):
+    return [result['real_upregulated'], result['real_downregulated'],
+            result['synth_upregulated'], result['synth_downregulated']]
+
+
+def _add_adjusted_p_values(result, p_values):
+    result['fisher_p_value'] = p_values
     # Adjust p-values for multiple testing
     result['adjusted_fisher_p_value'] = multipletests(
-        result['fisher_p_value'], method='fdr_bh')[1]
+        result['fisher_p_value'], method='fdr_bh')[1] if len(result) else []
+    return result
+
+
+def compare_datasets(real_df, synth_df):
+    result = _comparison_frame(real_df, synth_df)
+    print(f"\nNumber of common genes: {len(result)}")
+
+    # Calculate Fisher's exact test p-values
+    _add_adjusted_p_values(result, fisher_exact_pvalues(*_fisher_columns(result)))
 
     print(f"\nShape of result dataframe: {result.shape}")
     print(
@@ -58,6 +153,35 @@ def compare_datasets(real_df, synth_df):
     return result
 
 
+def compare_many(pairs):
+    """
+    Run compare_datasets on many real/synthetic pairs without the per-pair printing.
+
+    The Fisher tests of all pairs are evaluated in a single fisher_exact_pvalues call, so
+    tables shared between pairs are computed once. Multiple testing correction stays per pair.
+
+    Args:
+        pairs (dict): Label mapped to a (real_df, synth_df) tuple of process_data() outputs.
+
+    Returns:
+        dict: Label mapped to the compare_datasets() result of that pair.
+    """
+    results = {label: _comparison_frame(real_df, synth_df)
+               for label, (real_df, synth_df) in pairs.items()}
+    if not results:
+        return results
+
+    cells = [np.concatenate(columns) for columns in
+             zip(*(_fisher_columns(result) for result in results.values()))]
+    p_values = fisher_exact_pvalues(*cells)
+
+    offset = 0
+    for result in results.values():
+        _add_adjusted_p_values(result, p_values[offset:offset + len(result)])
+        offset += len(result)
+    return results
+
+
 def filter_and_categorize(df, z_threshold=2, log2_threshold=0.32, p_threshold=0.05):
     filtered = df[(abs(df['z_score']) > z_threshold) &
                   (abs(df['log2fc']) > log2_threshold) &
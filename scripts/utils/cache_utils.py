@@ -0,0 +1,180 @@
+import functools
+import sys
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+_KWARGS_MARK = object()
+
+# every cache created by bounded_cache, by name
+_REGISTRY = {}
+
+
+def _sizeof(obj):
+    """
+    Approximate the memory held by a cache key or value (containers are counted shallowly).
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(sys.getsizeof(item) for item in obj)
+    return size
+
+
+class BoundedCache:
+    """
+    Thread-safe LRU mapping bounded by an approximate memory budget.
+
+    The least recently used entries are evicted once the summed size of keys and values
+    exceeds `max_mb`. Hits, misses and evictions are counted for the run report.
+
+    Args:
+        name (str): Name the cache is reported under.
+        max_mb (float): Memory budget in megabytes.
+    """
+
+    def __init__(self, name, max_mb):
+        self.name = name
+        self.max_bytes = max_mb * 1024 ** 2
+        self.default_mb = max_mb
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _sizeof(key) + _sizeof(value)
+        with self._lock:
+            if key in self._data or size > self.max_bytes:
+                return
+            self._data[key] = (value, size)
+            self.current_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._data:
+            _, (_, size) = self._data.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def resize(self, max_mb):
+        with self._lock:
+            self.max_bytes = max_mb * 1024 ** 2
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "entries": len(self._data),
+                "evictions": self.evictions,
+                "size_mb": self.current_bytes / (1024 ** 2),
+                "budget_mb": self.max_bytes / (1024 ** 2),
+            }
+
+
+def bounded_cache(name, max_mb):
+    """
+    Memoize a function in a BoundedCache, as a size-limited replacement for lru_cache.
+
+    The wrapped function keeps lru_cache's cache_clear() and gains a `cache` attribute
+    pointing to its BoundedCache.
+
+    Args:
+        name (str): Name the cache is reported under in cache_stats().
+        max_mb (float): Memory budget in megabytes.
+    """
+    def decorator(func):
+        cache = BoundedCache(name, max_mb)
+        _REGISTRY[name] = cache
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = args
+            if kwargs:
+                key = args + (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+
+            value = cache.get(key)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.put(key, value)
+            return value
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def configure_cache_budgets(total_mb):
+    """
+    Scale the budgets of all caches so that together they use at most `total_mb`.
+
+    The split between caches stays proportional to their default budgets.
+
+    Args:
+        total_mb (float): Combined memory budget of all caches in megabytes.
+    """
+    default_total = sum(cache.default_mb for cache in _REGISTRY.values())
+    if default_total == 0:
+        return
+    for cache in _REGISTRY.values():
+        cache.resize(total_mb * cache.default_mb / default_total)
+
+
+def cache_stats():
+    """
+    Return hit/miss/size counters of every cache in this process.
+
+    Returns:
+        dict: Cache name mapped to its counters.
+    """
+    return {name: cache.stats() for name, cache in _REGISTRY.items()}
+
+
+def merge_cache_stats(snapshots):
+    """
+    Combine cache_stats() snapshots from several worker processes.
+
+    Counters are cumulative per process, so the caller passes the newest snapshot of
+    every process and the counters are summed across processes.
+
+    Args:
+        snapshots (list): One cache_stats() dictionary per process.
+
+    Returns:
+        dict: Cache name mapped to the summed counters.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, stats in snapshot.items():
+            total = merged.setdefault(name, {"hits": 0, "misses": 0, "entries": 0,
+                                             "evictions": 0, "size_mb": 0.0, "budget_mb": 0.0})
+            for key in total:
+                total[key] += stats[key]
+
+    for total in merged.values():
+        lookups = total["hits"] + total["misses"]
+        total["hit_rate"] = total["hits"] / lookups if lookups else None
+    return merged
@@ -0,0 +1,291 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from scripts.utils.cache_utils import merge_cache_stats
+
+# order in which stages are listed in the run report
+PIPELINE_STAGES = ["validate", "is_mirna", "prefilter", "flanks", "fasta", "duplex",
+                   "parse", "prune", "features", "feature_cache", "predict", "pair", "write"]
+
+# seconds between the RSS samples taken while a chunk runs
+RSS_SAMPLE_INTERVAL = 0.05
+
+_local = threading.local()
+
+
+class RssSampler:
+    """
+    Samples the resident set size of this process on a background thread and keeps the
+    highest value seen between start and stop.
+
+    Args:
+        interval (float, optional): Seconds between samples. Default is RSS_SAMPLE_INTERVAL.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        import psutil
+
+        self._process = psutil.Process()
+        self.start_mb = self.peak_mb = self._rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="rss-sampler",
+                                        daemon=True)
+        self._thread.start()
+
+    def _rss_mb(self):
+        return self._process.memory_info().rss / (1024 ** 2)
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.peak_mb = max(self.peak_mb, self._rss_mb())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, self._rss_mb())
+        return self
+
+
+class ChunkRecorder:
+    """
+    Collects the stage spans of a single chunk.
+
+    A recorder is bound to the thread that processes the chunk, so spans opened by the
+    step functions end up in the right chunk even when several chunks run concurrently.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.spans = []
+        self.stats = {}
+
+    def to_dict(self):
+        return {"chunk": self.label, "spans": self.spans, **self.stats}
+
+
+@contextmanager
+def chunk_recorder(label):
+    """
+    Bind a new ChunkRecorder to the current thread for the duration of the block.
+
+    Args:
+        label (str): Name of the chunk, e.g. "0_199".
+
+    Yields:
+        ChunkRecorder: The recorder collecting the spans of this chunk.
+    """
+    recorder = ChunkRecorder(label)
+    previous = getattr(_local, "recorder", None)
+    _local.recorder = recorder
+    sampler = RssSampler()
+    try:
+        yield recorder
+    finally:
+        # RSS is per process: on the thread backend the peak includes concurrent chunks
+        sampler.stop()
+        recorder.stats["rss_start_mb"] = round(sampler.start_mb, 1)
+        recorder.stats["peak_rss_mb"] = round(sampler.peak_mb, 1)
+        _local.recorder = previous
+
+
+@contextmanager
+def span(stage, rows_in=None):
+    """
+    Time a pipeline stage and record it in the current chunk.
+
+    Wall time comes from perf_counter and CPU time from thread_time, so the CPU figure
+    belongs to this thread only and does not include external tools such as RNAduplex.
+    Set "rows_out" on the yielded record to report how many rows the stage produced.
+
+    Args:
+        stage (str): Name of the stage, one of PIPELINE_STAGES for the chunk stages.
+        rows_in (int, optional): Number of rows that entered the stage.
+
+    Yields:
+        dict: The span record.
+    """
+    record = {"stage": stage, "rows_in": rows_in, "rows_out": None}
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = time.perf_counter() - start_wall
+        record["cpu_seconds"] = time.thread_time() - start_cpu
+        recorder = getattr(_local, "recorder", None)
+        if recorder is not None:
+            recorder.spans.append(record)
+
+
+class RunReport:
+    """
+    Aggregates chunk records into a per-stage report for the whole run.
+
+    Chunk records are plain dictionaries, so they can be produced in worker processes
+    and shipped back with the chunk result before being added here.
+    """
+
+    def __init__(self, vcf_id, settings=None):
+        self.vcf_id = vcf_id
+        self.settings = settings or {}
+        self.chunks = []
+        self.driver_spans = []
+        self.extra = {}
+        self.start_time = time.time()
+        self.wall_seconds = None
+
+    def add_chunk(self, chunk_record):
+        self.chunks.append(chunk_record)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage that runs in the driver rather than per chunk (e.g. stitching).
+        """
+        with span(name) as record:
+            yield record
+        self.driver_spans.append(record)
+
+    def finish(self):
+        self.wall_seconds = time.time() - self.start_time
+
+    def stage_totals(self):
+        """
+        Sum the spans of all chunks per stage.
+
+        Returns:
+            dict: Stage name mapped to calls, wall and CPU seconds, rows in and out.
+        """
+        totals = {}
+        for chunk in self.chunks:
+            for record in chunk["spans"]:
+                total = totals.setdefault(record["stage"], {
+                    "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                    "rows_in": 0, "rows_out": 0})
+                total["calls"] += 1
+                total["wall_seconds"] += record["wall_seconds"]
+                total["cpu_seconds"] += record["cpu_seconds"]
+                total["rows_in"] += record["rows_in"] or 0
+                total["rows_out"] += record["rows_out"] or 0
+
+        order = {stage: i for i, stage in enumerate(PIPELINE_STAGES)}
+        return dict(sorted(totals.items(), key=lambda item: order.get(item[0], len(order))))
+
+    def cache_totals(self):
+        """
+        Sum the cache counters over worker processes, using the newest snapshot of each process.
+
+        Returns:
+            dict: Cache name mapped to hits, misses, hit rate, entries, evictions and size.
+        """
+        newest = {}
+        for chunk in self.chunks:
+            snapshot = chunk.get("caches")
+            if not snapshot:
+                continue
+            lookups = sum(stats["hits"] + stats["misses"] for stats in snapshot.values())
+            pid = chunk.get("pid")
+            if pid not in newest or lookups >= newest[pid][0]:
+                newest[pid] = (lookups, snapshot)
+        return merge_cache_stats([snapshot for _, snapshot in newest.values()])
+
+    def prefilter_totals(self):
+        """
+        Sum the folding work the step 2 pre-filter removed.
+
+        Returns:
+            dict: Case 1 variants removed, duplexes skipped and folded, and the skipped share.
+        """
+        removed = sum(chunk.get("prefiltered_rows", 0) for chunk in self.chunks)
+        skipped = sum(chunk.get("duplexes_skipped", 0) for chunk in self.chunks)
+        folded = sum(chunk.get("folded_rows", 0) for chunk in self.chunks)
+        return {"variants_removed": removed, "duplexes_skipped": skipped, "duplexes_folded": folded,
+                "skipped_share": skipped / (skipped + folded) if skipped + folded else None}
+
+    def pruning_totals(self):
+        """
+        Sum the wt/mut pairs the early pruning after duplex parsing removed.
+
+        Returns:
+            dict: Pairs pruned for not covering the mutation and for weak energies.
+        """
+        return {"pairs_without_overlap": sum(chunk.get("pairs_pruned_overlap", 0) for chunk in self.chunks),
+                "pairs_above_energy_cutoff": sum(chunk.get("pairs_pruned_energy", 0) for chunk in self.chunks)}
+
+    def to_dict(self):
+        frame_bytes = [chunk.get("frame_bytes", 0) for chunk in self.chunks]
+        peak_rss = [chunk.get("peak_rss_mb", 0) for chunk in self.chunks]
+        rss_growth = [chunk.get("peak_rss_mb", 0) - chunk.get("rss_start_mb", 0) for chunk in self.chunks]
+        return {
+            "vcf_id": self.vcf_id,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_time)),
+            "wall_seconds": self.wall_seconds,
+            "settings": self.settings,
+            "chunks_processed": len(self.chunks),
+            "rows": sum(chunk.get("rows", 0) for chunk in self.chunks),
+            "max_chunk_frame_mb": max(frame_bytes, default=0) / (1024 ** 2),
+            "max_chunk_peak_mb": max(peak_rss, default=0),
+            "max_chunk_rss_growth_mb": max(rss_growth, default=0),
+            "stages": self.stage_totals(),
+            "driver_stages": self.driver_spans,
+            "caches": self.cache_totals(),
+            "prefilter": self.prefilter_totals(),
+            "pruning": self.pruning_totals(),
+            **self.extra,
+            "chunks": self.chunks,
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+    def format_summary(self):
+        """
+        Format the stage totals as a plain-text table.
+
+        Returns:
+            str: Human readable summary of the run.
+        """
+        totals = self.stage_totals()
+        stage_wall = sum(total["wall_seconds"] for total in totals.values())
+
+        lines = [f"run report for {self.vcf_id}: {len(self.chunks)} chunks, "
+                 f"{sum(chunk.get('rows', 0) for chunk in self.chunks)} rows, "
+                 f"{self.wall_seconds or 0:.1f} s wall"]
+        lines.append(f"{'stage':<10} {'wall s':>10} {'cpu s':>10} {'share':>7} "
+                     f"{'rows in':>12} {'rows out':>12}")
+        for stage, total in totals.items():
+            share = total["wall_seconds"] / stage_wall if stage_wall else 0
+            lines.append(f"{stage:<10} {total['wall_seconds']:>10.2f} {total['cpu_seconds']:>10.2f} "
+                         f"{share:>7.1%} {total['rows_in']:>12} {total['rows_out']:>12}")
+        for record in self.driver_spans:
+            lines.append(f"{record['stage']:<10} {record['wall_seconds']:>10.2f} "
+                         f"{record['cpu_seconds']:>10.2f} {'(driver)':>7}")
+
+        summary = self.to_dict()
+        lines.append(f"largest chunk frame: {summary['max_chunk_frame_mb']:.1f} MB, "
+                     f"largest peak RSS during a chunk: {summary['max_chunk_peak_mb']:.1f} MB "
+                     f"(+{summary['max_chunk_rss_growth_mb']:.1f} MB over its start)")
+
+        prefilter = summary["prefilter"]
+        if prefilter["variants_removed"]:
+            lines.append(f"pre-filter: {prefilter['variants_removed']} variants removed, "
+                         f"{prefilter['duplexes_skipped']} of "
+                         f"{prefilter['duplexes_skipped'] + prefilter['duplexes_folded']} duplexes "
+                         f"skipped ({prefilter['skipped_share']:.1%})")
+
+        pruning = summary["pruning"]
+        if pruning["pairs_without_overlap"] or pruning["pairs_above_energy_cutoff"]:
+            lines.append(f"pruning: {pruning['pairs_without_overlap']} pairs without overlap, "
+                         f"{pruning['pairs_above_energy_cutoff']} pairs above the energy cutoff")
+
+        if summary["caches"]:
+            lines.append(f"{'cache':<24} {'hit rate':>8} {'entries':>10} {'evictions':>10} "
+                         f"{'MB':>8} {'budget':>8}")
+            for name, stats in summary["caches"].items():
+                hit_rate = f"{stats['hit_rate']:.1%}" if stats["hit_rate"] is not None else "-"
+                lines.append(f"{name:<24} {hit_rate:>8} {stats['entries']:>10} {stats['evictions']:>10} "
+                             f"{stats['size_mb']:>8.1f} {stats['budget_mb']:>8.1f}")
+        return "\n".join(lines)
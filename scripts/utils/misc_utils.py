@@ -1,17 +1,19 @@
-import psutil
 import time
 import os
 import json
 import pandas as pd
 
-from scripts.config import OUTPUT_DIR
+from scripts.output_sink import append_text
 
-def time_it(func=None, enabled=True):
+
+def time_it(func=None, enabled=True, output_dir="."):
     def decorator(f):
         if not enabled:
             return f
 
         def wrapper(*args, **kwargs):
+            import psutil
+
             process = psutil.Process()
 
             if hasattr(os, 'getloadavg'):
@@ -48,10 +50,8 @@ def time_it(func=None, enabled=True):
                 "load_after": load_after
             }
 
-            json_file = os.path.join(OUTPUT_DIR, 'function_timings.json')
-            with open(json_file, 'a') as file:
-                json.dump(log_entry, file)
-                file.write('\n')
+            json_file = os.path.join(output_dir, 'function_timings.json')
+            append_text(json_file, json.dumps(log_entry) + '\n')
 
             return result
         return wrapper
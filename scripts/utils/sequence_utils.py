@@ -1,6 +1,12 @@
-from functools import lru_cache
+import threading
+import numpy as np
 import pandas as pd
-from scripts.globals import *
+from scripts.globals import CACHE_BUDGETS_MB, GRCH37_DIR
+from scripts.utils.cache_utils import bounded_cache
+
+# (header length, line length) of each chromosome FASTA, read once per file
+_fasta_layouts = {}
+_fasta_layouts_lock = threading.Lock()
 
 
 def calculate_au_content(sequence):
@@ -9,7 +15,7 @@ def calculate_au_content(sequence):
     return au_count / total_length if total_length > 0 else None
 
 
-@lru_cache(maxsize=None)
+@bounded_cache("nucleotides_in_interval", CACHE_BUDGETS_MB["nucleotides_in_interval"])
 def get_nucleotides_in_interval(chrom, start, end):
     """
     Given a chromosome name, start and end positions, this function reads the DNA sequence from the corresponding FASTA file and returns the nucleotides in the specified interval.
@@ -48,7 +54,7 @@ def get_nucleotides_in_interval(chrom, start, end):
     return nucleotides
 
 
-@lru_cache(maxsize=None)
+@bounded_cache("nucleotide_at_position", CACHE_BUDGETS_MB["nucleotide_at_position"])
 def get_nucleotide_at_position(chrom, position):
     """
     Given a chromosome name and a position, this function reads the DNA sequence from the corresponding FASTA file and returns the nucleotide at the specified position.
@@ -75,7 +81,7 @@ def get_nucleotide_at_position(chrom, position):
     return nucleotide
 
 
-@lru_cache(maxsize=None)
+@bounded_cache("upstream_sequence", CACHE_BUDGETS_MB["upstream_sequence"])
 def get_upstream_sequence(chrom, pos, n=30):
     """
     Get the upstream sequence of length n from the given position.
@@ -93,7 +99,7 @@ def get_upstream_sequence(chrom, pos, n=30):
     return get_nucleotides_in_interval(chrom, upstream_start, upstream_end)
 
 
-@lru_cache(maxsize=None)
+@bounded_cache("downstream_sequence", CACHE_BUDGETS_MB["downstream_sequence"])
 def get_downstream_sequence(chrom, pos, ref, n=30):
     """
     Get the downstream sequence of length n from the given position.
@@ -114,9 +120,50 @@ def get_downstream_sequence(chrom, pos, ref, n=30):
     return get_nucleotides_in_interval(chrom, downstream_start, downstream_end)
 
 
-@lru_cache(maxsize=None)
+@bounded_cache("mre_sequence", CACHE_BUDGETS_MB["mre_sequence"])
 def get_mre_sequence(mrna_sequence, mrna_end, mirna_start, mirna_length):
     mre_end = mrna_end + mirna_start
     # Ensure MRE start is not negative
     mre_start = max(mre_end - mirna_length, 0)
     return mrna_sequence[mre_start:mre_end]
+
+
+def get_fasta_layout(file_path):
+    """
+    Return the byte length of the header line and the sequence line length of a FASTA file.
+    """
+    with _fasta_layouts_lock:
+        if file_path not in _fasta_layouts:
+            with open(file_path, 'rb') as file:
+                header_length = len(file.readline())
+                line_length = len(file.readline().strip())
+            _fasta_layouts[file_path] = (header_length, line_length)
+        return _fasta_layouts[file_path]
+
+
+def get_nucleotides_at_positions(chrom, positions):
+    """
+    Fetch the nucleotides at many positions of one chromosome in a single batched read.
+
+    The chromosome FASTA is memory mapped and the byte offset of every position is computed
+    from the fixed line length, the same way get_nucleotide_at_position does for one position.
+
+    Args:
+        chrom (str): The name of the chromosome.
+        positions (array-like): 1-based positions.
+
+    Returns:
+        numpy.ndarray: ASCII codes (uint8) of the nucleotides, 0 where a position lies
+            outside the sequence.
+    """
+    file_path = f"{GRCH37_DIR}/Homo_sapiens.GRCh37.dna.chromosome.{chrom}.fa"
+    header_length, line_length = get_fasta_layout(file_path)
+    data = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+    offsets = np.asarray(positions, dtype=np.int64) - 1
+    byte_positions = header_length + offsets + offsets // line_length
+
+    result = np.zeros(len(offsets), dtype=np.uint8)
+    inside = (offsets >= 0) & (byte_positions < len(data))
+    result[inside] = data[byte_positions[inside]]
+    return result
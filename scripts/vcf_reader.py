@@ -0,0 +1,331 @@
+import gzip
+import itertools
+import logging
+import math
+import os
+import re
+import subprocess
+
+import pandas as pd
+
+from scripts.globals import GRCH37_DIR
+from scripts.utils.sequence_utils import get_fasta_layout
+
+VCF_COLUMNS = ["chr", "pos", "id", "ref", "alt"]
+# alleles the pipeline can fold; symbolic (<DEL>), missing (.) and spanning (*) alleles are dropped
+_PLAIN_ALLELE = re.compile(r"^[ACGTN]+$")
+# the ids are split on '_' in step 3 and the RNAduplex headers on '-' by the awk script
+_ID_SEPARATORS = re.compile(r"[_\-]")
+# --regions chromosome splits longer contigs into equal parts, so chromosome 1 does not
+# hold up a run whose other regions are done
+MAX_CHROMOSOME_REGION = 50_000_000
+
+
+def _open_text(path):
+    # gzip also reads bgzip files, which are a series of gzip members
+    with open(path, 'rb') as f:
+        is_gzip = f.read(2) == b"\x1f\x8b"
+    return gzip.open(path, 'rt') if is_gzip else open(path, 'r')
+
+
+def normalize_chromosomes(chroms):
+    """
+    Strip a 'chr' prefix and give the column the type pd.read_csv infers for a headerless VCF chunk
+    (int when every chromosome is numeric, str otherwise), so the reference FASTA names match.
+
+    Args:
+        chroms (pandas.Series): Chromosome names.
+
+    Returns:
+        pandas.Series: The normalized chromosomes.
+    """
+    chroms = chroms.astype(str).str.removeprefix("chr").replace({"M": "MT"})
+    return chroms.astype(int) if chroms.str.isdigit().all() else chroms
+
+
+def sample_name_from_header(header_lines, vcf_id):
+    """
+    Pick the id the records of a headered VCF get: the first sample column of the '#CHROM'
+    line, or `vcf_id` for sites-only files, without the '_' and '-' separators of the ids.
+    """
+    for line in header_lines:
+        if line.startswith("#CHROM"):
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) > 9:
+                vcf_id = columns[9]
+
+    if vcf_id and _ID_SEPARATORS.search(vcf_id):
+        sample = _ID_SEPARATORS.sub("", vcf_id)
+        logging.warning(f"Sample name {vcf_id} contains '_' or '-', using {sample} as id")
+        vcf_id = sample
+    return vcf_id
+
+
+def prepare_records(chunk, has_header, vcf_id):
+    """
+    Prepare raw records of a headered VCF: normalize the chromosomes, set the sample id, split
+    multi-allelic records and drop alleles that cannot be folded. Records of headerless files
+    are returned as read.
+
+    Returns:
+        tuple: (prepared records, number of dropped alleles)
+    """
+    if not has_header:
+        return chunk, 0
+
+    chunk["chr"] = normalize_chromosomes(chunk["chr"])
+    chunk["id"] = vcf_id
+    if chunk["alt"].str.contains(",", regex=False).any():
+        chunk = chunk.assign(alt=chunk["alt"].str.split(",")).explode("alt")
+
+    plain = chunk["alt"].str.match(_PLAIN_ALLELE) & chunk["ref"].str.match(_PLAIN_ALLELE)
+    dropped = int((~plain).sum())
+    return chunk[plain].reset_index(drop=True), dropped
+
+
+class VcfChunkReader:
+    """
+    Streaming reader that yields VCF records in the chr, pos, id, ref, alt layout of the pipeline.
+
+    Plain and bgzipped files are read directly. In files with a header ('##' meta lines and the
+    '#CHROM' line) only the first five columns are parsed, multi-allelic records are split into
+    one row per ALT allele and the 'id' column is set to the sample name the pipeline expects
+    there: the first sample column of the '#CHROM' line, or `vcf_id` for sites-only files.
+    Headerless 5-column files (the format of the converted inputs) pass through unchanged.
+
+    Args:
+        path (str): Path to the .vcf or .vcf.gz file.
+        chunksize (int): Number of records per chunk returned by iteration.
+        vcf_id (str, optional): Sample name for headered VCFs without sample columns.
+    """
+
+    def __init__(self, path, chunksize, vcf_id=None):
+        self.chunksize = chunksize
+        self.vcf_id = vcf_id
+        self.has_header = False
+        self.records_read = 0
+        self.alleles_dropped = 0
+
+        self._handle = _open_text(path)
+        header_lines = []
+        position = self._handle.tell()
+        line = self._handle.readline()
+        while line.startswith("#"):
+            header_lines.append(line)
+            position = self._handle.tell()
+            line = self._handle.readline()
+        self._handle.seek(position)
+
+        if header_lines:
+            self.has_header = True
+            self.vcf_id = sample_name_from_header(header_lines, vcf_id)
+
+        # headerless files keep the column types pd.read_csv infers, as before this reader
+        dtype = {"chr": str, "ref": str, "alt": str} if self.has_header else None
+        self._reader = pd.read_csv(self._handle, sep="\t", header=None, usecols=range(5),
+                                   names=VCF_COLUMNS, dtype=dtype, chunksize=chunksize)
+
+    def _prepare(self, chunk):
+        self.records_read += len(chunk)
+        chunk, dropped = prepare_records(chunk, self.has_header, self.vcf_id)
+        self.alleles_dropped += dropped
+        return chunk
+
+    def get_chunk(self, size=None):
+        """
+        Read the next `size` records (default: chunksize).
+
+        Raises:
+            StopIteration: At the end of the file.
+        """
+        try:
+            return self._prepare(self._reader.get_chunk(size or self.chunksize))
+        except StopIteration:
+            self.close()
+            raise
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get_chunk()
+
+    def close(self):
+        self._reader.close()
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_vcf_reader(path, chunksize, vcf_id=None):
+    """
+    Open a VcfChunkReader; see its docstring for the supported formats.
+    """
+    return VcfChunkReader(path, chunksize, vcf_id=vcf_id)
+
+
+def has_tabix_index(path):
+    return os.path.exists(f"{path}.tbi") or os.path.exists(f"{path}.csi")
+
+
+class TabixVcf:
+    """
+    Random access to a bgzipped, tabix-indexed VCF through pysam, or the tabix command line
+    tool when pysam is not installed.
+
+    Args:
+        path (str): Path to the .vcf.gz file; the .tbi or .csi index must sit next to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            import pysam
+        except ImportError:
+            self._tabix = None
+        else:
+            self._tabix = pysam.TabixFile(path)
+
+    def _cli(self, args):
+        try:
+            return subprocess.run(["tabix", *args], capture_output=True, check=True,
+                                  text=True).stdout.splitlines()
+        except FileNotFoundError:
+            raise RuntimeError("Reading regions needs pysam or the tabix command line tool") from None
+
+    def _cli_lines(self, args):
+        # like _cli, but streams the output instead of holding it in memory
+        try:
+            process = subprocess.Popen(["tabix", *args], stdout=subprocess.PIPE, text=True)
+        except FileNotFoundError:
+            raise RuntimeError("Reading regions needs pysam or the tabix command line tool") from None
+        with process:
+            for line in process.stdout:
+                yield line.rstrip("\n")
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, ["tabix", *args])
+
+    def contigs(self):
+        return list(self._tabix.contigs) if self._tabix is not None else self._cli(["-l", self.path])
+
+    def header(self):
+        return list(self._tabix.header) if self._tabix is not None else self._cli(["-H", self.path])
+
+    def fetch(self, contig, start, end=None):
+        """
+        Yield the raw lines of the records starting in [start, end] (1-based, inclusive).
+
+        Tabix also returns records that start before `start` and overlap it (deletions spanning
+        a window boundary); they belong to the previous window and are left out here.
+        """
+        if self._tabix is not None:
+            lines = self._tabix.fetch(contig, start - 1, end)
+        else:
+            region = f"{contig}:{start}-{end}" if end is not None else f"{contig}:{start}"
+            lines = self._cli_lines([self.path, region])
+        return (line for line in lines if int(line.split("\t", 2)[1]) >= start)
+
+
+def contig_lengths(header_lines):
+    """
+    Read the contig lengths declared in '##contig=<ID=...,length=...>' header lines.
+    """
+    lengths = {}
+    for line in header_lines:
+        match = re.match(r"##contig=<ID=([^,>]+),.*length=(\d+)", line)
+        if match:
+            lengths[match.group(1)] = int(match.group(2))
+    return lengths
+
+
+def reference_length(contig):
+    """
+    Length of a chromosome of the reference FASTA, from its file size and line layout, or None.
+    """
+    file_path = os.path.join(
+        GRCH37_DIR, f"Homo_sapiens.GRCh37.dna.chromosome.{str(contig).removeprefix('chr')}.fa")
+    if not os.path.exists(file_path):
+        return None
+    header_length, line_length = get_fasta_layout(file_path)
+    sequence_bytes = os.path.getsize(file_path) - header_length
+    return sequence_bytes - sequence_bytes // (line_length + 1)
+
+
+def plan_regions(path, window_size=None, max_region_size=None):
+    """
+    Partition the contigs of an indexed VCF into regions for parallel reading.
+
+    Args:
+        path (str): Path to the bgzipped, tabix-indexed VCF.
+        window_size (int, optional): Region size in bases. Default is one region per contig.
+        max_region_size (int, optional): Without window_size, split contigs longer than this
+            into equal parts no longer than it. Default keeps every contig whole.
+
+    Returns:
+        list: (contig, start, end) tuples, 1-based and inclusive; end is None for "to the end".
+    """
+    tabix = TabixVcf(path)
+    lengths = contig_lengths(tabix.header())
+    regions = []
+    unknown_lengths = []
+    for contig in tabix.contigs():
+        length = lengths.get(contig) or reference_length(contig)
+        size = window_size
+        if size is None and max_region_size is not None and length is not None:
+            # equal parts, e.g. 249 Mb in five parts of 49.8 Mb rather than four of 50 Mb and a rest
+            size = math.ceil(length / math.ceil(length / max_region_size))
+        if size is None or length is None:
+            if length is None and (window_size or max_region_size):
+                unknown_lengths.append(contig)
+            regions.append((contig, 1, None))
+            continue
+        for start in range(1, length + 1, size):
+            regions.append((contig, start, min(start + size - 1, length)))
+
+    if unknown_lengths:
+        logging.warning(f"{len(unknown_lengths)} contigs have no length in the VCF header or the reference "
+                        f"and are read as one region each, which does not balance the load: "
+                        f"{unknown_lengths[:5]}")
+    return regions
+
+
+class RegionChunkReader:
+    """
+    Streaming reader of one region of an indexed VCF, yielding the records in chunks like
+    VcfChunkReader: every chunk holds the alleles of up to `chunksize` raw records, and only
+    one chunk of raw lines is held in memory at a time.
+
+    Args:
+        path (str): Path to the bgzipped, tabix-indexed VCF.
+        region (tuple): (contig, start, end) as returned by plan_regions.
+        chunksize (int): Number of raw records per chunk.
+        vcf_id (str, optional): Sample name for sites-only VCFs.
+    """
+
+    def __init__(self, path, region, chunksize, vcf_id=None):
+        self.path = path
+        self.region = region
+        self.chunksize = chunksize
+        self.vcf_id = vcf_id
+        self.records_read = 0
+        self.alleles_dropped = 0
+
+    def __iter__(self):
+        tabix = TabixVcf(self.path)
+        vcf_id = sample_name_from_header(tabix.header(), self.vcf_id)
+        lines = tabix.fetch(*self.region)
+
+        while True:
+            rows = [line.split("\t", 5)[:5] for line in itertools.islice(lines, self.chunksize)]
+            if not rows:
+                return
+            self.records_read += len(rows)
+            chunk = pd.DataFrame(rows, columns=VCF_COLUMNS)
+            chunk["pos"] = chunk["pos"].astype(int)
+            chunk, dropped = prepare_records(chunk, True, vcf_id)
+            self.alleles_dropped += dropped
+            yield chunk
@@ -1,33 +1,57 @@
 import os
-from scripts.main_operations import *
-from scripts.config import *
-import time
-from memory_profiler import profile
+from scripts.main_operations import (run_pipeline, stitch_and_cleanup_csv_files,
+                                     delete_fasta_files, delete_files)
+from scripts.config import parse_arguments
+from scripts.executors import run_file_queue_worker
+from scripts.utils.cache_utils import configure_cache_budgets
+from scripts.utils.misc_utils import time_it
 
-def main():
+def main(config):
+
+    output_dir = config.output_dir
+    vcf_id = config.vcf_id
 
     # Create the output directory if it doesn't exist
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if config.cache_mb is not None:
+        configure_cache_budgets(config.cache_mb)
 
-    run_pipeline(VCF_FULL_PATH, CHUNKSIZE, OUTPUT_DIR, VCF_ID)
+    if config.join_queue:
+        # extra worker for a filequeue run driven from another node; it runs the initializer
+        # the driver stored in the queue directory
+        run_file_queue_worker(config.queue_path)
+        return
+
+    run = time_it(run_pipeline, enabled=config.profile, output_dir=output_dir)
+    report = run(config)
     print("run_pipeline         ✓")
 
-    results_filename = f"results_{VCF_ID}.csv"
-    
-    stitch_and_cleanup_csv_files(OUTPUT_DIR, results_filename)
+    results_filename = f"results_{vcf_id}.csv"
+
+    with report.stage("stitch"):
+        stitch_and_cleanup_csv_files(output_dir, results_filename)
     print("stitch_and_cleanup   ✓")
-    
-    delete_fasta_files(OUTPUT_DIR)
+
+    with report.stage("cleanup"):
+        delete_fasta_files(output_dir)
+        delete_files(output_dir, "rnad", ".csv")
     print("delete_fasta_files   ✓")
 
-    delete_files(OUTPUT_DIR, "rnad", ".csv")
+    report.finish()
+    report.write_json(os.path.join(output_dir, f"run_report_{vcf_id}.json"))
+    print()
+    print(report.format_summary())
+
 
-    
 if __name__ == '__main__':
-    if PROFILER:
-        profile(main)()
+    config = parse_arguments()
+    if config.profile:
+        from memory_profiler import profile
+
+        profile(main)(config)
     else:
-        main()
+        main(config)
 
 
 
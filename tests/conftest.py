@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from benchmarks.synthetic_data import make_toy_reference
+
+RNADUPLEX_STUB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "benchmarks", "rnaduplex_stub.py")
+
+
+def _clear_sequence_caches():
+    from scripts.utils import cache_utils, sequence_utils
+
+    for cache in cache_utils._REGISTRY.values():
+        cache.clear()
+    sequence_utils._fasta_layouts.clear()
+
+
+@pytest.fixture(scope="module")
+def toy_genome(tmp_path_factory):
+    """
+    Point the pipeline at a toy reference and the deterministic RNAduplex stub, as the
+    benchmarks do, and return the reference sequences.
+    """
+    from scripts import feature_cache, vcf_reader
+    from scripts.pipeline_steps import step2
+    from scripts.utils import sequence_utils
+
+    reference_dir = str(tmp_path_factory.mktemp("grch37"))
+    sequences = make_toy_reference(reference_dir)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(sequence_utils, "GRCH37_DIR", reference_dir)
+        monkeypatch.setattr(vcf_reader, "GRCH37_DIR", reference_dir)
+        monkeypatch.setattr(step2, "RNADUPLEX_LOCATION", RNADUPLEX_STUB)
+        monkeypatch.setattr(feature_cache, "RNADUPLEX_LOCATION", RNADUPLEX_STUB)
+        _clear_sequence_caches()
+        yield sequences
+    _clear_sequence_caches()
@@ -0,0 +1,52 @@
+import glob
+import os
+
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_synthetic_vcf
+from scripts.api import score_variants
+from scripts.config import PipelineConfig
+from scripts.main_operations import run_pipeline
+from scripts.vcf_reader import VCF_COLUMNS
+
+
+def _sorted(results):
+    return results.sort_values("id").reset_index(drop=True)
+
+
+def _pipeline_results(config):
+    run_pipeline(config)
+    files = glob.glob(os.path.join(config.output_dir, "result_*.csv"))
+    return pd.concat([pd.read_csv(path) for path in files], ignore_index=True)
+
+
+def _configs(tmp_path, toy_genome, **settings):
+    vcf_path = str(tmp_path / "PD10010a.vcf")
+    generate_synthetic_vcf(vcf_path, toy_genome, n_variants=20, invalid_fraction=0.2, seed=3)
+    config = PipelineConfig(vcf_full_path=vcf_path, chunksize=8, workers=1,
+                            output_root=str(tmp_path / "out"), **settings)
+    os.makedirs(config.output_dir)
+    variants = pd.read_csv(vcf_path, sep="\t", header=None, names=VCF_COLUMNS)
+    return config, variants
+
+
+def test_score_variants_matches_the_pipeline(tmp_path, toy_genome):
+    config, variants = _configs(tmp_path, toy_genome)
+
+    expected = _pipeline_results(config)
+    results, details = score_variants(variants, config, return_details=True)
+
+    assert not expected.empty
+    pd.testing.assert_frame_equal(_sorted(results), _sorted(expected), check_dtype=False)
+    invalid = pd.read_csv(os.path.join(config.output_dir, f"invalid_rows_{config.vcf_id}.csv"))
+    assert sorted(details["invalid_ids"]) == sorted(invalid["id"])
+
+
+def test_score_variants_prunes_like_the_pipeline(tmp_path, toy_genome):
+    config, variants = _configs(tmp_path, toy_genome, prune_pairs=True, prune_energy=-10.0)
+
+    expected = _pipeline_results(config)
+    results, details = score_variants(variants, config, return_details=True)
+
+    pd.testing.assert_frame_equal(_sorted(results), _sorted(expected), check_dtype=False)
+    assert details["pairs_pruned_overlap"] + details["pairs_pruned_energy"] > 0
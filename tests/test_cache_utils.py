@@ -0,0 +1,84 @@
+import pytest
+
+from scripts.utils import cache_utils
+from scripts.utils.cache_utils import (BoundedCache, _sizeof, bounded_cache, cache_stats,
+                                       configure_cache_budgets, merge_cache_stats)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # keep the caches created by a test out of the process-wide registry
+    monkeypatch.setattr(cache_utils, "_REGISTRY", {})
+    return cache_utils._REGISTRY
+
+
+def _entry_size(key, value):
+    return _sizeof(key) + _sizeof(value)
+
+
+def test_least_recently_used_entries_are_evicted():
+    size = _entry_size("k0", "v" * 100)
+    cache = BoundedCache("test", max_mb=3.5 * size / 1024 ** 2)
+    for i in range(3):
+        cache.put(f"k{i}", "v" * 100)
+
+    # k0 becomes the most recently used, so k1 goes first
+    assert cache.get("k0") == "v" * 100
+    cache.put("k3", "v" * 100)
+
+    assert cache.get("k1") is cache_utils._MISSING
+    assert [cache.get(f"k{i}") for i in (0, 2, 3)] == ["v" * 100] * 3
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"], stats["hits"], stats["misses"]) == (3, 1, 4, 1)
+    assert stats["size_mb"] <= stats["budget_mb"]
+
+
+def test_values_larger_than_the_budget_are_not_stored():
+    cache = BoundedCache("test", max_mb=1 / 1024)
+
+    cache.put("big", "x" * 2048)
+
+    assert cache.get("big", None) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_bounded_cache_memoizes_and_clears(registry):
+    calls = []
+
+    @bounded_cache("squares", 1)
+    def square(x, offset=0):
+        calls.append(x)
+        return x * x + offset
+
+    assert [square(3), square(3), square(3, offset=1), square(3, offset=1)] == [9, 9, 10, 10]
+    assert calls == [3, 3]
+    assert cache_stats()["squares"]["hit_rate"] == 0.5
+
+    square.cache_clear()
+    square(3)
+    assert calls == [3, 3, 3]
+
+
+def test_budgets_are_scaled_in_proportion(registry):
+    small = BoundedCache("small", 10)
+    large = BoundedCache("large", 30)
+    registry.update(small=small, large=large)
+    for i in range(2000):
+        large.put(i, "x" * 1000)
+
+    configure_cache_budgets(1)
+
+    assert small.stats()["budget_mb"] == pytest.approx(0.25)
+    assert large.stats()["budget_mb"] == pytest.approx(0.75)
+    assert large.stats()["size_mb"] <= 0.75
+    assert large.stats()["evictions"] > 0
+
+
+def test_worker_snapshots_are_summed():
+    worker = {"seq": {"hits": 3, "misses": 1, "entries": 2, "evictions": 0, "size_mb": 1.0,
+                      "budget_mb": 8.0, "hit_rate": 0.75}}
+
+    merged = merge_cache_stats([worker, worker])
+
+    assert merged["seq"]["hits"] == 6 and merged["seq"]["budget_mb"] == 16.0
+    assert merged["seq"]["hit_rate"] == 0.75
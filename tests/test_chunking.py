@@ -0,0 +1,53 @@
+import pytest
+
+from scripts.chunking import MEMORY_OVERHEAD_FACTOR, AdaptiveChunkSizer
+
+
+def _sizer(**kwargs):
+    settings = dict(initial_size=100, target_seconds=10, memory_budget_mb=1000, min_size=10, max_size=5000)
+    settings.update(kwargs)
+    return AdaptiveChunkSizer(**settings)
+
+
+def test_initial_size_is_used_until_a_chunk_finishes():
+    sizer = _sizer(initial_size=20000)
+
+    assert sizer.next_size() == 5000
+
+
+def test_size_moves_at_most_by_a_factor_of_two():
+    sizer = _sizer(smoothing=1.0)
+
+    # 0.01 s per row would allow 1000 rows for 10 s
+    sizer.record({"rows": 100, "seconds": 1.0, "frame_bytes": 0})
+    assert sizer.next_size() == 200
+    assert sizer.next_size() == 400
+    assert sizer.next_size() == 800
+    assert sizer.next_size() == 1000
+
+    # a chunk ten times as expensive
+    sizer.record({"rows": 1000, "seconds": 100.0, "frame_bytes": 0})
+    assert sizer.next_size() == 500
+    assert sizer.next_size() == 250
+
+
+def test_memory_budget_caps_the_size():
+    sizer = _sizer(initial_size=400, memory_budget_mb=1, smoothing=1.0)
+
+    # 1 KB per row, 3 KB with the pandas overhead: about 350 rows fit in 1 MB
+    sizer.record({"rows": 1000, "seconds": 0.001, "frame_bytes": 1000 * 1024})
+
+    assert sizer.next_size() == int(1024 ** 2 / (1024 * MEMORY_OVERHEAD_FACTOR))
+
+
+def test_measurements_are_smoothed_and_summarized():
+    sizer = _sizer(smoothing=0.5)
+
+    sizer.record({"rows": 100, "seconds": 1.0, "folded_rows": 4000, "frame_bytes": 0})
+    sizer.record({"rows": 100, "seconds": 3.0, "folded_rows": 4000, "frame_bytes": 0})
+    sizer.record({"rows": 0, "seconds": 5.0})
+
+    summary = sizer.summary()
+    assert summary["seconds_per_row"] == pytest.approx(0.02)
+    assert summary["chunks"] == 2 and summary["rows"] == 200
+    assert summary["rows_folded_per_worker_second"] == pytest.approx(2000)
@@ -0,0 +1,189 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scripts.executors import (DaskExecutor, FileQueueExecutor, MAX_TASK_ATTEMPTS, _claim_next_task,
+                               _claim_owner, _queue_subdirs, _stop_file, create_executor,
+                               run_file_queue_worker)
+
+TIMEOUT = 30
+
+
+def square(x):
+    return x * x
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def slow_square(x):
+    time.sleep(0.3)
+    return x * x
+
+
+def mark_initialized(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def _dead_pid():
+    process = multiprocessing.Process(target=time.sleep, args=(0,))
+    process.start()
+    process.join()
+    return process.pid
+
+
+def _claim_as(queue_dir, pid):
+    # claim the pending task the way a worker with this PID on this host would
+    dirs = _queue_subdirs(queue_dir)
+    (filename,) = os.listdir(dirs["pending"])
+    os.rename(os.path.join(dirs["pending"], filename),
+              os.path.join(dirs["claimed"], f"{filename}.{socket.gethostname()}:{pid}"))
+
+
+def _start_thread_worker(queue_dir):
+    worker = threading.Thread(target=run_file_queue_worker, args=(queue_dir, 0.05), daemon=True)
+    worker.start()
+    return worker
+
+
+def test_claim_owner_parses_claimed_names():
+    assert _claim_owner("000000001_ab12cd34.pkl.node-1.local:4242") == ("000000001_ab12cd34", "node-1.local", 4242)
+    assert _claim_owner("000000001_ab12cd34.pkl.node:") == ("000000001_ab12cd34", "node", None)
+
+
+def test_workers_claim_the_oldest_task(tmp_path):
+    dirs = _queue_subdirs(str(tmp_path))
+    for path in dirs.values():
+        os.makedirs(path)
+    for task_id in ("000000002_b", "000000001_a"):
+        (tmp_path / "pending" / f"{task_id}.pkl").touch()
+
+    task_id, claimed_path = _claim_next_task(str(tmp_path))
+
+    assert task_id == "000000001_a"
+    assert os.path.basename(claimed_path) == f"000000001_a.pkl.{socket.gethostname()}:{os.getpid()}"
+    assert sorted(os.listdir(dirs["pending"])) == ["000000002_b.pkl"]
+
+
+def test_results_and_errors_reach_the_futures(tmp_path):
+    executor = create_executor("filequeue", 1, queue_dir=str(tmp_path / "queue"))
+    try:
+        futures = [executor.submit(square, i) for i in range(5)]
+        failed = executor.submit(fail, "boom")
+
+        assert [future.result(timeout=TIMEOUT) for future in futures] == [0, 1, 4, 9, 16]
+        with pytest.raises(ValueError, match="boom"):
+            failed.result(timeout=TIMEOUT)
+    finally:
+        executor.shutdown()
+    assert os.path.exists(_stop_file(str(tmp_path / "queue")))
+
+
+def test_shutdown_without_wait_resolves_pending_futures(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    executor = FileQueueExecutor(queue_dir, local_workers=1, poll_interval=0.05)
+    futures = [executor.submit(slow_square, i) for i in range(3)]
+
+    executor.shutdown(wait=False)
+
+    assert not os.path.exists(_stop_file(queue_dir))
+    with pytest.raises(RuntimeError):
+        executor.submit(square, 1)
+    assert [future.result(timeout=TIMEOUT) for future in futures] == [0, 1, 4]
+    executor._collector.join(TIMEOUT)
+    assert os.path.exists(_stop_file(queue_dir))
+
+
+def test_claim_of_a_dead_worker_is_requeued(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    executor = FileQueueExecutor(queue_dir, poll_interval=0.05)
+    try:
+        future = executor.submit(square, 7)
+        _claim_as(queue_dir, _dead_pid())
+        _start_thread_worker(queue_dir)
+
+        assert future.result(timeout=TIMEOUT) == 49
+    finally:
+        executor.shutdown()
+
+
+def test_stale_claim_is_requeued(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    executor = FileQueueExecutor(queue_dir, poll_interval=0.05, claim_timeout=0.3)
+    try:
+        future = executor.submit(square, 3)
+        # a live PID, but the claim is never touched again
+        _claim_as(queue_dir, os.getpid())
+        time.sleep(0.1)
+        _start_thread_worker(queue_dir)
+
+        assert future.result(timeout=TIMEOUT) == 9
+    finally:
+        executor.shutdown()
+
+
+def test_task_lost_too_often_fails(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    executor = FileQueueExecutor(queue_dir, poll_interval=0.05)
+    pending = _queue_subdirs(queue_dir)["pending"]
+    try:
+        future = executor.submit(square, 2)
+        for _ in range(MAX_TASK_ATTEMPTS):
+            deadline = time.time() + TIMEOUT
+            while not os.listdir(pending):
+                assert time.time() < deadline
+                time.sleep(0.02)
+            _claim_as(queue_dir, _dead_pid())
+
+        with pytest.raises(RuntimeError, match="lost with its worker"):
+            future.result(timeout=TIMEOUT)
+    finally:
+        executor.shutdown()
+
+
+def test_joining_worker_runs_the_stored_initializer(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    marker = tmp_path / "initialized"
+    executor = FileQueueExecutor(queue_dir, poll_interval=0.05, initializer=mark_initialized,
+                                 initargs=(str(marker), "run-1"))
+    try:
+        future = executor.submit(square, 4)
+        # like `synth.py --join`, without an initializer of its own
+        _start_thread_worker(queue_dir)
+
+        assert future.result(timeout=TIMEOUT) == 16
+        assert marker.read_text() == "run-1"
+    finally:
+        executor.shutdown()
+
+
+class _FakeClient:
+    # the parts of dask.distributed.Client the executor uses
+    def __init__(self):
+        self.status = "running"
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def get_executor(self):
+        return self.executor
+
+    def close(self):
+        self.status = "closed"
+
+
+def test_dask_shutdown_closes_the_client():
+    client = _FakeClient()
+    executor = DaskExecutor(client)
+
+    assert executor.submit(square, 5).result(timeout=TIMEOUT) == 25
+    executor.shutdown()
+
+    assert client.status == "closed"
+    with pytest.raises(RuntimeError):
+        client.executor.submit(square, 1)
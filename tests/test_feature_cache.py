@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.feature_cache import (FEATURE_CACHE_VERSION, chunk_feature_path, list_cached_chunks,
+                                   load_chunk_features, require_chunk_features, save_chunk_features)
+
+KEY = {"version": FEATURE_CACHE_VERSION, "digest": "d1"}
+
+
+@pytest.fixture
+def stored(tmp_path):
+    features = pd.DataFrame({"pred_energy": [-12.5, -8.25, np.nan], "mre_au_content": [0.5, 0.25, 1.0]})
+    ids = pd.Series(["1_100_A_G_PD1_hsa-miR-1_wt", "1_100_A_G_PD1_hsa-miR-1_mut",
+                     "2_5_C_T_PD1_hsa-let-7a_wt"], name="id")
+    in_mre = pd.Series([True, False, True], name="is_mutation_in_mre")
+    path = chunk_feature_path(str(tmp_path), "PD1", 0, 199)
+    save_chunk_features(path, KEY, features, ids, in_mre)
+    return path, features, ids, in_mre
+
+
+def test_round_trip(stored):
+    path, features, ids, in_mre = stored
+
+    loaded_features, loaded_ids, loaded_in_mre, key = load_chunk_features(path, digest="d1")
+
+    pd.testing.assert_frame_equal(loaded_features, features.astype(np.float32))
+    pd.testing.assert_series_equal(loaded_ids, ids)
+    pd.testing.assert_series_equal(loaded_in_mre, in_mre)
+    assert key == KEY
+
+
+def test_empty_chunk_round_trip(tmp_path):
+    path = str(tmp_path / "PD1_0_0.npz")
+    save_chunk_features(path, KEY, pd.DataFrame({"pred_energy": []}), pd.Series([], dtype=object), [])
+
+    features, ids, in_mre, _ = load_chunk_features(path)
+
+    assert features.shape == (0, 1) and ids.empty and in_mre.empty
+
+
+def test_other_digest_or_missing_file_is_a_miss(stored, tmp_path):
+    path = stored[0]
+
+    assert load_chunk_features(path, digest="d2") is None
+    assert load_chunk_features(str(tmp_path / "PD1_200_399.npz")) is None
+
+
+def test_require_explains_what_is_wrong(stored, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        require_chunk_features(str(tmp_path / "PD1_200_399.npz"))
+
+    path = stored[0]
+    with np.load(path) as data:
+        arrays = dict(data)
+    arrays["key"] = np.array(json.dumps({**KEY, "version": FEATURE_CACHE_VERSION + 1}))
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError, match="another feature cache version"):
+        require_chunk_features(path)
+
+
+def test_list_cached_chunks_keeps_other_vcfs_apart(tmp_path):
+    for name in ("PD1_200_399.npz", "PD1_0_199.npz", "PD1_x_0_9.npz", "PD1.txt"):
+        (tmp_path / name).touch()
+
+    chunks = list_cached_chunks(str(tmp_path), "PD1")
+
+    assert [(start, end) for start, end, _ in chunks] == [(0, 199), (200, 399)]
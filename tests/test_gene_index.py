@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from scripts.gene_index import GeneIntervalIndex, IntervalSet, _sorted_intervals, load_bed_intervals
+from scripts.pipeline_steps.step2 import prefilter_case_1_mutations
+
+
+def _random_intervals(n, seed=0):
+    rng = np.random.default_rng(seed)
+    contigs = rng.choice(["1", "2", "X"], n)
+    starts = rng.integers(1, 5000, n)
+    ends = starts + rng.integers(0, 400, n)
+    return _sorted_intervals(contigs, starts, ends)
+
+
+def _first_covering(contigs, starts, ends, contig, position):
+    # the per-locus scan the vectorized lookup replaced
+    for i, (c, start, end) in enumerate(zip(contigs, starts, ends)):
+        if c == contig and start <= position <= end:
+            return i
+    return -1
+
+
+def test_first_overlap_matches_a_linear_scan():
+    contigs, starts, ends = _random_intervals(300)
+    intervals = IntervalSet(contigs, starts, ends)
+    positions = np.arange(0, 5600, 7)
+
+    for contig in ("1", "2", "X", "Y"):
+        expected = [_first_covering(contigs, starts, ends, contig, p) for p in positions]
+        np.testing.assert_array_equal(intervals.first_overlap(contig, positions), expected)
+
+
+def test_interval_bounds_are_inclusive():
+    intervals = IntervalSet(*_sorted_intervals(["1", "1"], [10, 15], [20, 15]))
+
+    assert intervals.first_overlap("1", [9, 10, 15, 20, 21]).tolist() == [-1, 0, 0, 0, -1]
+
+
+def test_annotate_reports_the_first_gene_and_introns():
+    genes = _sorted_intervals(["1", "1", "2"], [100, 150, 100], [300, 400, 200], ["G1", "G2", "G3"],
+                              ["protein_coding", "lncRNA", "miRNA"])
+    exons = _sorted_intervals(["1", "2"], [100, 100], [120, 200])
+    index = GeneIntervalIndex({
+        "release": "75", "gene_id": genes[3], "gene_biotype": genes[4],
+        "gene_contig": genes[0], "gene_start": genes[1], "gene_end": genes[2],
+        "exon_contig": exons[0], "exon_start": exons[1], "exon_end": exons[2],
+        "utr3_contig": np.array([], dtype=str), "utr3_start": np.array([], dtype=np.int64),
+        "utr3_end": np.array([], dtype=np.int64)})
+
+    annotated = index.annotate(["1", "1", "1", "2", "3"], [110, 200, 350, 150, 150])
+
+    expected = pd.DataFrame({"gene_id": ["G1", "G1", "G2", "G3", np.nan],
+                             "biotype": ["protein_coding", "protein_coding", "lncRNA", "miRNA", np.nan],
+                             "is_intron": [False, True, True, False, False]})
+    pd.testing.assert_frame_equal(annotated, expected)
+
+
+def test_bed_intervals_are_converted_to_1_based(tmp_path):
+    bed = tmp_path / "keep.bed"
+    bed.write_text("track name=keep\n#comment\nchr1\t99\t200\n2\t0\t10\n")
+
+    intervals = load_bed_intervals(str(bed))
+
+    assert intervals.covers(["1", "chr1", "1", "2", "2"], [99, 100, 200, 1, 11]).tolist() == [
+        False, True, True, True, False]
+
+
+def test_prefilter_keeps_mirna_loci_and_covered_case_1_mutations():
+    utr3 = IntervalSet(*_sorted_intervals(["1"], [100], [200]))
+    bed = IntervalSet(*_sorted_intervals(["2"], [500], [600]))
+    df = pd.DataFrame({"chr": [1, 1, 1, 2, 2], "pos": [150, 300, 300, 550, 700],
+                       "is_mirna": [0, 0, 1, 0, 0]})
+
+    kept, removed = prefilter_case_1_mutations(df, [utr3, bed])
+
+    assert kept.index.tolist() == [0, 2, 3]
+    assert removed == 2
@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+
+from scripts.utils.instrumentation import RunReport, chunk_recorder, span
+
+
+def test_chunk_peak_is_sampled_per_chunk():
+    with chunk_recorder("0_9") as large:
+        block = np.ones(100 * 1024 ** 2 // 8)
+        time.sleep(0.2)
+        del block
+    with chunk_recorder("10_19") as small:
+        time.sleep(0.2)
+
+    assert large.stats["peak_rss_mb"] - large.stats["rss_start_mb"] >= 90
+    # unlike ru_maxrss the peak of a later chunk does not carry the earlier one
+    assert small.stats["peak_rss_mb"] < large.stats["peak_rss_mb"] - 50
+
+
+def test_spans_go_to_the_chunk_of_the_thread():
+    with chunk_recorder("0_9") as recorder:
+        with span("features", rows_in=10) as record:
+            record["rows_out"] = 8
+
+    (record,) = recorder.spans
+    assert record["stage"] == "features"
+    assert (record["rows_in"], record["rows_out"]) == (10, 8)
+
+
+def test_report_sums_stages_and_keeps_the_largest_chunk_peak():
+    report = RunReport("PD1")
+    for label, peak in (("0_9", 300.0), ("10_19", 250.0)):
+        with chunk_recorder(label) as recorder:
+            with span("duplex", rows_in=5) as record:
+                record["rows_out"] = 5
+        recorder.stats.update(rows=5, rss_start_mb=200.0, peak_rss_mb=peak)
+        report.add_chunk(recorder.to_dict())
+
+    summary = report.to_dict()
+
+    assert summary["stages"]["duplex"]["calls"] == 2
+    assert summary["stages"]["duplex"]["rows_out"] == 10
+    assert summary["max_chunk_peak_mb"] == 300.0
+    assert summary["max_chunk_rss_growth_mb"] == 100.0
+    assert "largest peak RSS during a chunk: 300.0 MB" in report.format_summary()
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from scripts.config import MirnaPanel
+from scripts.reference_data import read_panel_file, select_mirna_panel
+
+MIRNAS = pd.DataFrame({"mirna_name": ["hsa-let-7a-5p", "hsa-miR-1-3p", "hsa-miR-21-5p", "hsa-miR-9999"],
+                       "mirna_accession": ["MIMAT0000062", "MIMAT0000416", "MIMAT0000076", "MIMAT9999999"],
+                       "conservation": [2.0, 2.0, 1.0, -1.0]})
+
+
+def _panel_file(tmp_path, text):
+    path = tmp_path / "panel.csv"
+    path.write_text(text)
+    return str(path)
+
+
+def test_panel_file_reads_the_first_field_of_every_line(tmp_path):
+    path = _panel_file(tmp_path, "mirna_accession,note\n# comment\nMIMAT0000062,x\n\nhsa-miR-21-5p\tfoo\n")
+
+    assert read_panel_file(path) == {"MIMAT0000062", "hsa-miR-21-5p"}
+
+
+def test_panel_selects_by_accession_name_and_query(tmp_path):
+    path = _panel_file(tmp_path, "MIMAT0000062\nhsa-miR-21-5p\nhsa-miR-1-3p\nMIMAT0000000\n")
+
+    assert select_mirna_panel(MIRNAS, None) is MIRNAS
+    assert select_mirna_panel(MIRNAS, MirnaPanel(file=path))["mirna_accession"].tolist() == [
+        "MIMAT0000062", "MIMAT0000416", "MIMAT0000076"]
+    selected = select_mirna_panel(MIRNAS, MirnaPanel(file=path, query="conservation >= 2"))
+    assert selected["mirna_accession"].tolist() == ["MIMAT0000062", "MIMAT0000416"]
+    assert selected.index.tolist() == [0, 1]
+
+
+def test_empty_panel_is_rejected():
+    with pytest.raises(ValueError, match="selects no miRNAs"):
+        select_mirna_panel(MIRNAS, MirnaPanel(query="conservation > 5"))
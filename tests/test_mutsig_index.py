@@ -0,0 +1,40 @@
+import os
+
+import pandas as pd
+
+from scripts.mutsig_index import load_mutsig_index
+
+ROWS = [("PD1", "A[C>A]A", "SBS1"), ("PD1", "A[C>T]G", "SBS5"), ("PD2", "A[C>A]A", "SBS5"),
+        ("PD2", "A[C>A]A", "SBS40")]
+
+
+def _write_table(path, rows):
+    pd.DataFrame(rows, columns=["Sample Names", "MutationTypes", "mutsig"]).to_csv(path, index=False)
+
+
+def test_lookup_matches_a_dict_of_the_rows(tmp_path):
+    path = str(tmp_path / "probabilities.csv")
+    _write_table(path, ROWS)
+    # later rows win, as in the dict lookup the index replaced
+    expected = {(sample, context): signature for sample, context, signature in ROWS}
+
+    samples = ["PD1", "PD1", "PD2", "PD3", "PD1", None]
+    contexts = ["A[C>A]A", "A[C>T]G", "A[C>A]A", "A[C>A]A", "T[T>G]T", "A[C>A]A"]
+    result = load_mutsig_index(path, index_dir=str(tmp_path / "index")).lookup(samples, contexts)
+
+    assert [None if pd.isna(value) else value for value in result] == [
+        expected.get((sample, context)) for sample, context in zip(samples, contexts)]
+
+
+def test_index_is_rebuilt_when_the_table_changes(tmp_path):
+    path = str(tmp_path / "probabilities.csv")
+    index_dir = str(tmp_path / "index")
+    _write_table(path, ROWS)
+    assert list(load_mutsig_index(path, index_dir).lookup(["PD1"], ["A[C>A]A"])) == ["SBS1"]
+    assert len(os.listdir(index_dir)) == 1
+
+    _write_table(path, [("PD1", "A[C>A]A", "SBS18")] * 3)
+    os.utime(path, ns=(0, 1))
+
+    assert list(load_mutsig_index(path, index_dir).lookup(["PD1"], ["A[C>A]A"])) == ["SBS18"]
+    assert len(os.listdir(index_dir)) == 1
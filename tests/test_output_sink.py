@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from scripts import output_sink
+from scripts.output_sink import (append_text, chunk_outputs, open_output_sink, replay_outputs,
+                                 write_text)
+
+
+def test_writes_without_a_sink_happen_immediately(tmp_path):
+    write_text(tmp_path / "result.csv", "a,b\n")
+    append_text(tmp_path / "log.csv", "1\n", header="n\n")
+    append_text(tmp_path / "log.csv", "2\n", header="n\n")
+
+    assert (tmp_path / "result.csv").read_text() == "a,b\n"
+    assert (tmp_path / "log.csv").read_text() == "n\n1\n2\n"
+
+
+def test_sink_writes_every_append_once_with_one_header(tmp_path):
+    path = tmp_path / "invalid_rows.csv"
+
+    def append_rows(thread):
+        for i in range(50):
+            append_text(path, f"{thread},{i}\n", header="thread,row\n")
+
+    with open_output_sink(max_queue=4) as sink:
+        threads = [threading.Thread(target=append_rows, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        write_text(tmp_path / "result.csv", "done\n")
+
+    lines = path.read_text().splitlines()
+    assert lines[0] == "thread,row"
+    assert sorted(lines[1:]) == sorted(f"{t},{i}" for t in range(4) for i in range(50))
+    assert (tmp_path / "result.csv").read_text() == "done\n"
+    assert sink.stats()["writes"] == 201
+
+
+def test_collected_outputs_are_replayed_in_order(tmp_path, monkeypatch):
+    path = tmp_path / "case_2.csv"
+    # as in a worker process, where the driver's sink is not reachable
+    monkeypatch.setattr(output_sink, "_shared_sink", None)
+    with chunk_outputs() as collector:
+        append_text(path, "x\n", header="h\n")
+        append_text(path, "y\n", header="h\n")
+    assert not path.exists()
+
+    with open_output_sink():
+        replay_outputs({"outputs": [list(operation) for operation in collector.operations]})
+
+    assert path.read_text() == "h\nx\ny\n"
+
+
+def test_failed_write_is_raised_on_close(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        with open_output_sink():
+            write_text(tmp_path / "missing_dir" / "result.csv", "a\n")
@@ -0,0 +1,55 @@
+import io
+import subprocess
+
+import pytest
+
+from scripts.main_operations import auto_fold_workers
+from scripts.pipeline_steps import step2
+from scripts.pipeline_steps.step2 import (fold_in_parallel, generate_fasta_representation_string,
+                                          run_rnaduplex_on_string)
+from tests.conftest import RNADUPLEX_STUB
+
+
+@pytest.fixture
+def fasta_string(monkeypatch):
+    monkeypatch.setattr(step2, "RNADUPLEX_LOCATION", RNADUPLEX_STUB)
+    mrnas = {"PD1_1_100_A_G": "ACGUACGUACGUACGUACGUAAGCUAGCUAGCUAGCUAGCUAGCUAGCUAGCUAGCUAGCUAGC",
+             "PD1_1_200_C_T": "UUUUACGUACGAAAGUACGUAAGCUAGCUAGCUAGCUAGCUAGCUAGCUAGCUAGGGGGCUAGC"}
+    mirnas = {"MIMAT0000001": "UGAGGUAGUAGGUUGUAUAGUU", "MIMAT0000002": "UAGCAGCACGUAAAUAUUGGCG",
+              "MIMAT0000003": "CAUUAUUACUUUUGGUACGCG", "MIMAT0000004": "UGGAAUGUAAAGAAGUAUGUAU"}
+    # 15 records, so they do not split evenly into the parts
+    records = list(generate_fasta_representation_string(mrnas, mirnas, True))
+    records += list(generate_fasta_representation_string(mrnas, mirnas, False))
+    return "".join(records[:-1])
+
+
+def _fold_file(fasta_string, workers, tmp_path):
+    input_path = tmp_path / "input.fa"
+    input_path.write_text(fasta_string)
+    output = io.StringIO()
+    with open(input_path) as input_f:
+        fold_in_parallel(input_f, output, workers)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("workers", [2, 3, 4, 40])
+def test_parallel_folding_keeps_the_input_order(fasta_string, workers, tmp_path):
+    expected = run_rnaduplex_on_string(fasta_string)
+
+    assert expected.count(">") == 15
+    assert _fold_file(fasta_string, workers, tmp_path) == expected
+    assert run_rnaduplex_on_string(fasta_string, workers) == expected
+
+
+def test_a_failing_part_fails_the_chunk(fasta_string, monkeypatch, tmp_path):
+    monkeypatch.setattr(step2, "RNADUPLEX_LOCATION", "false")
+
+    with pytest.raises(subprocess.CalledProcessError):
+        _fold_file(fasta_string, 3, tmp_path)
+
+
+def test_fold_workers_are_spread_over_few_chunks():
+    assert auto_fold_workers(None, 8) == 1
+    assert auto_fold_workers(8, 8) == 1
+    assert auto_fold_workers(3, 8) == 2
+    assert auto_fold_workers(1, 8) == 8
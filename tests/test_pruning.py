@@ -0,0 +1,46 @@
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_synthetic_vcf
+from scripts.api import score_variants
+from scripts.config import PipelineConfig
+from scripts.pipeline_steps.step3 import prune_duplex_pairs
+from scripts.vcf_reader import VCF_COLUMNS
+
+
+def _duplexes():
+    # (mutation, miRNA, wt or mut, mRNA start and end, energy); base 31 is the mutated one
+    rows = [("M1", "A", "wt", 25, 35, -8.0), ("M1", "A", "mut", 40, 50, -12.0),
+            ("M1", "B", "wt", 40, 50, -20.0), ("M1", "B", "mut", 1, 30, -20.0),
+            ("M2", "A", "wt", 28, 33, -5.0), ("M2", "A", "mut", 28, 33, -6.0),
+            ("M2", "B", "wt", 31, 40, -9.0), ("M2", "B", "mut", 20, 32, -11.0)]
+    return pd.DataFrame(rows, columns=["mutation_id", "mirna_accession", "is_mutated", "mrna_start",
+                                       "mrna_end", "pred_energy"])
+
+
+def test_pairs_without_overlap_are_dropped():
+    kept, no_overlap, too_weak = prune_duplex_pairs(_duplexes())
+
+    # M1-A keeps its mut duplex although only the wt one covers the mutation
+    assert kept.index.tolist() == [0, 1, 4, 5, 6, 7]
+    assert (no_overlap, too_weak) == (1, 0)
+
+
+def test_pairs_weaker_than_the_cutoff_are_dropped():
+    kept, no_overlap, too_weak = prune_duplex_pairs(_duplexes(), energy_cutoff=-10)
+
+    # M1-A and M2-B each have one duplex at -10 or below; M2-A has none
+    assert kept.index.tolist() == [0, 1, 6, 7]
+    assert (no_overlap, too_weak) == (1, 1)
+
+
+def test_overlap_pruning_keeps_every_result(toy_genome, tmp_path):
+    path = str(tmp_path / "variants.vcf")
+    generate_synthetic_vcf(path, toy_genome, n_variants=12, seed=11)
+    variants = pd.read_csv(path, sep="\t", header=None, names=VCF_COLUMNS)
+
+    results = score_variants(variants, PipelineConfig())
+    pruned, details = score_variants(variants, PipelineConfig(prune_pairs=True), return_details=True)
+
+    assert details["pairs_pruned_overlap"] > 0
+    pd.testing.assert_frame_equal(pruned.sort_values("id").reset_index(drop=True),
+                                  results.sort_values("id").reset_index(drop=True))
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.resampling import (NullAccumulator, bootstrap_comparison, count_matrices, log2_ratios,
+                                replicate_comparison)
+
+GENES = pd.Index(["A", "B", "C"])
+
+
+def test_blocks_merge_to_the_summary_of_all_replicates():
+    rng = np.random.default_rng(0)
+    observed = np.array([0.0, 1.0, -2.0])
+    null = rng.normal(size=(3, 250))
+
+    merged = NullAccumulator(observed).update(null[:, :100])
+    merged.merge(NullAccumulator(observed).update(null[:, 100:]))
+    summary = merged.summary(GENES)
+
+    np.testing.assert_allclose(summary["null_mean"], null.mean(axis=1))
+    np.testing.assert_allclose(summary["null_std"], null.std(axis=1, ddof=1))
+    at_least = (null >= observed[:, None]).sum(axis=1)
+    at_most = (null <= observed[:, None]).sum(axis=1)
+    np.testing.assert_allclose(summary["p_upper"], (at_least + 1) / 251)
+    np.testing.assert_allclose(summary["empirical_p_value"],
+                               np.minimum(1, 2 * np.minimum(at_least + 1, at_most + 1) / 251))
+
+
+def test_empty_accumulator_cannot_be_summarized():
+    with pytest.raises(ValueError):
+        NullAccumulator([0.0]).summary(pd.Index(["A"]))
+
+
+def test_count_matrices_and_replicate_comparison():
+    frames = [pd.DataFrame({"gene_name": ["A", "A", "B", None], "is_gene_upregulated": [True, False, True, True]}),
+              pd.DataFrame({"gene_name": ["B", "B"], "is_gene_upregulated": [False, False]})]
+
+    genes, up, down = count_matrices(frames)
+
+    assert genes.tolist() == ["A", "B"]
+    assert up.tolist() == [[1, 0], [1, 0]] and down.tolist() == [[1, 0], [0, 2]]
+    result = replicate_comparison(genes, [3, 0], [0, 3], up, down)
+    np.testing.assert_allclose(result["real_log2_ratio"], log2_ratios(np.array([3, 0]), np.array([0, 3])))
+
+
+def _counts(seed=1):
+    rng = np.random.default_rng(seed)
+    synth_up = rng.integers(0, 20, (3, 5))
+    synth_down = rng.integers(0, 20, (3, 5))
+    return np.array([30, 2, 10]), np.array([5, 20, 10]), synth_up, synth_down
+
+
+def test_bootstrap_depends_on_the_seed_not_the_workers():
+    counts = _counts()
+
+    in_process = bootstrap_comparison(GENES, *counts, n_replicates=250, seed=7, block_size=60)
+    in_workers = bootstrap_comparison(GENES, *counts, n_replicates=250, seed=7, block_size=60, workers=2)
+    other_seed = bootstrap_comparison(GENES, *counts, n_replicates=250, seed=8, block_size=60)
+
+    pd.testing.assert_frame_equal(in_process, in_workers)
+    assert not in_process["null_mean"].equals(other_seed["null_mean"])
+
+
+def test_bootstrap_null_is_centred_on_the_pooled_synthetic_ratio():
+    real_up, real_down, synth_up, synth_down = _counts()
+
+    result = bootstrap_comparison(GENES, real_up, real_down, synth_up, synth_down,
+                                  n_replicates=2000, n_variants=100_000)
+
+    # at a large depth every replicate reproduces the pooled cell frequencies
+    cells = np.concatenate([synth_up.sum(axis=1), synth_down.sum(axis=1)])
+    expected = log2_ratios(cells[:3] / cells.sum() * 100_000, cells[3:] / cells.sum() * 100_000)
+    np.testing.assert_allclose(result["null_mean"], expected, atol=0.02)
+    # gene A is far more upregulated in the real data than in the synthetic pool
+    assert result.loc["A", "p_upper"] == pytest.approx(1 / 2001)
+
+
+def test_all_zero_synthetic_counts_are_rejected():
+    with pytest.raises(ValueError, match="all zero"):
+        bootstrap_comparison(GENES, [1, 1, 1], [1, 1, 1], np.zeros((3, 2)), np.zeros((3, 2)))
@@ -0,0 +1,107 @@
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import generate_synthetic_vcf
+from scripts import server
+from scripts.api import score_variants
+from scripts.config import PipelineConfig
+from scripts.server import MicroBatcher, ScoringService, fetch_stats, make_handler, score_remote
+from scripts.vcf_reader import VCF_COLUMNS
+
+TIMEOUT = 60
+
+
+@pytest.fixture(scope="module")
+def variants(toy_genome, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("vcf") / "variants.vcf")
+    generate_synthetic_vcf(path, toy_genome, n_variants=12, invalid_fraction=0, seed=5)
+    return pd.read_csv(path, sep="\t", header=None, names=VCF_COLUMNS)
+
+
+@pytest.fixture(scope="module")
+def url(toy_genome):
+    service = ScoringService(PipelineConfig(), window_ms=300)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _sorted(results):
+    return results.sort_values("id").reset_index(drop=True)
+
+
+def test_concurrent_requests_get_their_own_results(url, variants):
+    requests = [variants.iloc[i::3] for i in range(3)]
+
+    with ThreadPoolExecutor(len(requests)) as pool:
+        responses = list(pool.map(lambda request: score_remote(request, url, timeout=TIMEOUT), requests))
+
+    for request, response in zip(requests, responses):
+        expected = score_variants(request)
+        pd.testing.assert_frame_equal(_sorted(response["results"]), _sorted(expected), check_dtype=False)
+
+
+def test_bad_requests_are_rejected_without_failing_others(url, variants):
+    bad_requests = [
+        [{"chr": 1, "pos": 500, "ref": "Z", "alt": "A"}],
+        [{"chr": 22, "pos": 500, "ref": "A", "alt": "G"}],
+        [{"chr": 1, "pos": 10 ** 9, "ref": "A", "alt": "G"}],
+        [{"chr": 1, "pos": 500, "ref": "A"}],
+    ]
+
+    def send(request):
+        try:
+            return score_remote(request, url, timeout=TIMEOUT)
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    with ThreadPoolExecutor(len(bad_requests) + 1) as pool:
+        good = pool.submit(send, variants.iloc[:4])
+        codes = list(pool.map(send, bad_requests))
+
+    assert codes == [400] * len(bad_requests)
+    pd.testing.assert_frame_equal(_sorted(good.result()["results"]), _sorted(score_variants(variants.iloc[:4])),
+                                  check_dtype=False)
+
+
+def test_stats_count_requests_and_duplex_cache_hits(url, variants):
+    before = fetch_stats(url)
+    score_remote(variants.iloc[:2], url, timeout=TIMEOUT)
+    score_remote(variants.iloc[:2], url, timeout=TIMEOUT)
+
+    stats = fetch_stats(url)
+
+    assert stats["requests"] == before["requests"] + 2
+    assert stats["batches"] >= before["batches"] + 2
+    assert stats["latency_ms"]["p50"] > 0
+    assert stats["duplex_cache"]["hits"] > before["duplex_cache"]["hits"]
+
+
+def test_a_failing_batch_is_scored_one_request_at_a_time(monkeypatch, toy_genome):
+    def fake_score_variants(variants, config, rnaduplex, return_details):
+        if (variants["pos"] == 666).any():
+            raise RuntimeError("cannot score position 666")
+        ids = variants["id"] + "_" + variants["chr"].astype(str) + "_" + variants["pos"].astype(str) \
+            + "_" + variants["ref"] + "_" + variants["alt"]
+        results = pd.DataFrame({"id": ids + "_MIMAT0000001", "wt_prediction": 0.5,
+                                "mut_prediction": 0.1, "pred_difference": -0.4})
+        return results, {"invalid_ids": [], "case_2_ids": []}
+
+    monkeypatch.setattr(server, "score_variants", fake_score_variants)
+    batcher = MicroBatcher(PipelineConfig(), rnaduplex=None, window_ms=300)
+
+    good = batcher.submit({"chr": [1], "pos": [500], "ref": ["A"], "alt": ["G"]}, "good")
+    bad = batcher.submit({"chr": [1], "pos": [666], "ref": ["A"], "alt": ["G"]}, "bad")
+
+    assert [row["id"] for row in good.result(TIMEOUT)["results"]] == ["good_1_500_A_G_MIMAT0000001"]
+    with pytest.raises(RuntimeError, match="666"):
+        bad.result(TIMEOUT)
+    assert list(batcher.batch_sizes) == [2]
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from scipy.stats import fisher_exact
+
+from scripts import stats
+from scripts.stats import fisher_exact_pvalues
+
+
+def _scipy_pvalues(tables):
+    return np.array([fisher_exact([[a, b], [c, d]])[1] for a, b, c, d in tables])
+
+
+def test_matches_scipy_on_random_tables():
+    rng = np.random.default_rng(0)
+    tables = np.concatenate([rng.integers(0, 20, size=(300, 4)),
+                             rng.integers(0, 400, size=(100, 4))])
+
+    np.testing.assert_allclose(fisher_exact_pvalues(*tables.T), _scipy_pvalues(tables), rtol=1e-9)
+
+
+def test_degenerate_and_repeated_tables():
+    tables = np.array([[0, 0, 3, 4], [3, 0, 4, 0], [0, 0, 0, 0], [5, 1, 1, 5], [5, 1, 1, 5], [1, 5, 5, 1]])
+
+    pvalues = fisher_exact_pvalues(*tables.T)
+
+    np.testing.assert_allclose(pvalues, _scipy_pvalues(tables), rtol=1e-9)
+    assert pvalues[:3].tolist() == [1.0, 1.0, 1.0]
+    assert pvalues[3] == pvalues[4]
+
+
+def test_batches_smaller_than_the_input(monkeypatch):
+    monkeypatch.setattr(stats, "FISHER_BATCH_CELLS", 50)
+    tables = np.random.default_rng(1).integers(0, 60, size=(50, 4))
+
+    np.testing.assert_allclose(fisher_exact_pvalues(*tables.T), _scipy_pvalues(tables), rtol=1e-9)
+
+
+def test_empty_input():
+    assert fisher_exact_pvalues([], [], [], []).shape == (0,)
+
+
+def test_negative_cells_raise():
+    with pytest.raises(ValueError):
+        fisher_exact_pvalues([1], [-1], [2], [3])
@@ -0,0 +1,44 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from scripts.pipeline_steps.step3 import generate_au_content_columns
+
+
+def _au_content(sequence):
+    # the per-row implementation the vectorized columns replaced
+    au_count = sequence.count('A') + sequence.count('T') + sequence.count('U')
+    return None if len(sequence) == 0 else au_count / len(sequence)
+
+
+def _random_rows(n, seed=0):
+    rng = random.Random(seed)
+    sequences = ["".join(rng.choice("ACGTUN") for _ in range(rng.randint(0, 70))) for _ in range(n)]
+    mre_end = [rng.randint(-5, 80) for _ in sequences]
+    mre_start = [max(end - rng.randint(0, 25), 0) for end in mre_end]
+    return pd.DataFrame({"mrna_sequence": sequences, "mre_start": mre_start, "mre_end": mre_end})
+
+
+def test_au_content_columns_match_per_row_code():
+    df = _random_rows(2000)
+
+    result = generate_au_content_columns(df.copy())
+
+    mre_region = [seq[start:end] for seq, start, end in zip(df["mrna_sequence"], df["mre_start"], df["mre_end"])]
+    expected_local = pd.Series([_au_content(seq) for seq in df["mrna_sequence"]], dtype=float)
+    expected_mre = pd.Series([_au_content(region) for region in mre_region], dtype=float)
+    np.testing.assert_allclose(result["local_au_content"], expected_local, equal_nan=True)
+    np.testing.assert_allclose(result["mre_au_content"], expected_mre, equal_nan=True)
+    assert result["anchor_a"].tolist() == [int(region.endswith("A")) for region in mre_region]
+    assert result["anchor_a"].dtype == np.int8
+
+
+def test_long_sequences_do_not_overflow():
+    # wider than int16 prefix counts can hold
+    df = pd.DataFrame({"mrna_sequence": ["A" * 40000, "GC"], "mre_start": [0, 0], "mre_end": [40000, 2]})
+
+    result = generate_au_content_columns(df)
+
+    assert result["local_au_content"].tolist() == [1.0, 0.0]
+    assert result["mre_au_content"].tolist() == [1.0, 0.0]
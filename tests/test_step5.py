@@ -0,0 +1,89 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.pipeline_steps import step5
+from scripts.pipeline_steps.step5 import concat_with_union_categoricals, crawl_and_import_results_into_df
+
+
+def test_concat_keeps_categoricals_with_the_union_of_categories():
+    frames = [pd.DataFrame({"gene_id": pd.Categorical(["G2", "G1"]), "score": [0.1, 0.2]}, index=[5, 6]),
+              pd.DataFrame({"gene_id": pd.Categorical(["G3", None]), "score": [0.3, 0.4]}),
+              pd.DataFrame({"gene_id": ["G1", "G4"], "score": [0.5, 0.6]})]
+
+    result = concat_with_union_categoricals(frames)
+
+    assert isinstance(result["gene_id"].dtype, pd.CategoricalDtype)
+    assert result["gene_id"].cat.categories.tolist() == ["G1", "G2", "G3", "G4"]
+    assert result["gene_id"].astype(object).where(result["gene_id"].notna(), None).tolist() == [
+        "G2", "G1", "G3", None, "G1", "G4"]
+    assert result.index.tolist() == list(range(6))
+    assert result["score"].tolist() == [0.1, 0.2, 0.3, 0.4, 0.5, 0.6]
+
+
+def test_concat_of_no_frames_is_empty():
+    assert concat_with_union_categoricals([]).empty
+
+
+def _write_results(tmp_path):
+    # file names sort differently from the order os.walk may return them in
+    for folder, name in [("b", "chunk_1"), ("a", "chunk_2"), ("a", "chunk_10"), ("c", "other")]:
+        (tmp_path / folder).mkdir(exist_ok=True)
+        (tmp_path / folder / f"{name}_results.csv").write_text(f"id\n{folder}/{name}\n")
+
+
+def test_frames_follow_the_sorted_file_order(tmp_path, monkeypatch):
+    _write_results(tmp_path)
+    monkeypatch.setattr(step5, "apply_step_5", lambda file_path, assembly, mutsig_probabilities: pd.DataFrame(
+        {"id": pd.Categorical(pd.read_csv(file_path)["id"])}))
+
+    combined = crawl_and_import_results_into_df(str(tmp_path), "results", None)
+    lazy = crawl_and_import_results_into_df(str(tmp_path), "results", None, lazy=True)
+
+    expected = ["a/chunk_10", "a/chunk_2", "b/chunk_1", "c/other"]
+    assert combined["id"].tolist() == expected
+    assert isinstance(combined["id"].dtype, pd.CategoricalDtype)
+    assert [frame["id"].iloc[0] for frame in lazy] == expected
+
+
+def _step5_frame(ids, gene_id="G1"):
+    n = len(ids)
+    return pd.DataFrame({"id": ids, "wt_prediction": np.float32(0.2), "mut_prediction": np.float32(0.7),
+                         "vcf_id": pd.Categorical(["PD1"] * n), "gene_id": pd.Categorical([gene_id] * n),
+                         "mutsig": pd.Categorical([None] * n, categories=["SBS1"]),
+                         "is_intron": [True] * n, "is_gene_upregulated": [False] * n})
+
+
+def _import(tmp_path, monkeypatch, frames):
+    db_path = str(tmp_path / "results.db")
+    monkeypatch.setattr(step5, "iter_step_5_frames", lambda *args, **kwargs: iter(frames))
+    step5.crawl_and_import_results(str(tmp_path), "results", db_path, "results", None, batch_size=2)
+    return db_path
+
+
+def test_import_loads_all_rows_and_restores_the_journal_mode(tmp_path, monkeypatch):
+    db_path = _import(tmp_path, monkeypatch, [_step5_frame(["c", "a", "b"]), _step5_frame(["d"], "G2")])
+
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT id, wt_prediction, gene_id, mutsig, is_intron FROM results "
+                            "ORDER BY rowid").fetchall()
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(results)")}
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+    # rows of each file go in sorted by id
+    assert [row[0] for row in rows] == ["a", "b", "c", "d"]
+    assert rows[0][1:] == (pytest.approx(0.2), "G1", None, 1)
+    assert {"idx_results_vcf_id", "idx_results_gene_id"} <= indexes
+    assert journal_mode == "delete"
+
+
+def test_a_duplicate_id_rolls_the_whole_load_back(tmp_path, monkeypatch):
+    db_path = _import(tmp_path, monkeypatch, [_step5_frame(["a"])])
+
+    with pytest.raises(sqlite3.IntegrityError):
+        _import(tmp_path, monkeypatch, [_step5_frame(["b", "c"]), _step5_frame(["a"])])
+
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT id FROM results").fetchall() == [("a",)]
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_synthetic_vcf, make_toy_reference
+from scripts.utils.sequence_utils import get_nucleotides_in_interval
+from scripts.vcf_reader import VCF_COLUMNS
+
+
+def test_toy_reference_is_reproducible_and_readable(toy_genome, tmp_path):
+    chromosomes = {"1": 500, "2": 130}
+
+    sequences = make_toy_reference(str(tmp_path / "a"), chromosomes, seed=3)
+
+    assert sequences == make_toy_reference(str(tmp_path / "b"), chromosomes, seed=3)
+    assert {chrom: len(seq) for chrom, seq in sequences.items()} == chromosomes
+    fasta = (tmp_path / "a" / "Homo_sapiens.GRCh37.dna.chromosome.2.fa").read_text().splitlines()
+    assert fasta[0].startswith(">2 ") and [len(line) for line in fasta[1:]] == [60, 60, 10]
+    assert get_nucleotides_in_interval("1", 100, 120) == toy_genome["1"][99:120]
+
+
+def test_only_the_invalid_rows_disagree_with_the_reference(toy_genome, tmp_path):
+    path = str(tmp_path / "variants.vcf")
+
+    counts = generate_synthetic_vcf(path, toy_genome, n_variants=400, indel_fraction=0.2,
+                                    invalid_fraction=0.1, seed=5)
+
+    df = pd.read_csv(path, sep="\t", header=None, names=VCF_COLUMNS, dtype={"chr": str})
+    assert counts["snv"] + counts["insertion"] + counts["deletion"] == len(df) == 400
+    assert counts["insertion"] > 0 and counts["deletion"] > 0
+    mismatched = sum(toy_genome[chrom][pos - 1:pos - 1 + len(ref)] != ref
+                     for chrom, pos, ref in zip(df["chr"], df["pos"], df["ref"]))
+    assert mismatched == counts["invalid"] > 0
+    assert df.equals(df.sort_values(["chr", "pos"], kind="stable", ignore_index=True))
@@ -0,0 +1,106 @@
+import gzip
+
+import pandas as pd
+import pytest
+
+from scripts.vcf_reader import RegionChunkReader, VCF_COLUMNS, open_vcf_reader, plan_regions
+
+HEADER = ("##fileformat=VCFv4.2\n"
+          "##contig=<ID=chr1,length=1000>\n"
+          "##contig=<ID=chr2,length=1000>\n"
+          "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tPD1234\n")
+RECORDS = ("chr1\t100\t.\tA\tG\t.\tPASS\t.\tGT\t0/1\n"
+           "chr1\t200\t.\tC\tT,<DEL>\t.\tPASS\t.\tGT\t1/2\n"
+           "chr1\t300\t.\tG\tA,C\t.\tPASS\t.\tGT\t1/2\n"
+           "chr2\t150\t.\tT\t*\t.\tPASS\t.\tGT\t0/1\n"
+           "chr2\t600\t.\tAC\tA\t.\tPASS\t.\tGT\t0/1\n")
+EXPECTED = pd.DataFrame({"chr": [1, 1, 1, 1, 2], "pos": [100, 200, 300, 300, 600],
+                         "id": "PD1234", "ref": ["A", "C", "G", "G", "AC"],
+                         "alt": ["G", "T", "A", "C", "A"]})
+
+
+def _read_all(path, chunksize=2, vcf_id=None):
+    with open_vcf_reader(path, chunksize, vcf_id=vcf_id) as reader:
+        records = pd.concat(list(reader), ignore_index=True)
+    return records, reader
+
+
+@pytest.fixture
+def headered_vcf(tmp_path):
+    path = tmp_path / "sample.vcf"
+    path.write_text(HEADER + RECORDS)
+    return path
+
+
+def test_headered_vcf_is_split_and_filtered(headered_vcf):
+    records, reader = _read_all(headered_vcf)
+
+    pd.testing.assert_frame_equal(records[VCF_COLUMNS], EXPECTED)
+    assert reader.records_read == 5
+    # <DEL> and *
+    assert reader.alleles_dropped == 2
+
+
+def test_gzip_input_reads_like_plain(tmp_path):
+    path = tmp_path / "sample.vcf.gz"
+    with gzip.open(path, 'wt') as f:
+        f.write(HEADER + RECORDS)
+
+    records, _ = _read_all(path)
+
+    pd.testing.assert_frame_equal(records[VCF_COLUMNS], EXPECTED)
+
+
+def test_sites_only_vcf_uses_vcf_id_without_separators(tmp_path):
+    path = tmp_path / "sites.vcf"
+    path.write_text("#CHROM\tPOS\tID\tREF\tALT\n1\t100\t.\tA\tG\n")
+
+    records, _ = _read_all(path, vcf_id="my_sample-1")
+
+    assert records["id"].tolist() == ["mysample1"]
+
+
+def test_headerless_input_is_left_as_read(tmp_path):
+    path = tmp_path / "converted.vcf"
+    path.write_text("chr1\t100\tPD1\tA\tG,T\n")
+
+    records, reader = _read_all(path)
+
+    assert records.to_dict("records") == [{"chr": "chr1", "pos": 100, "id": "PD1", "ref": "A", "alt": "G,T"}]
+    assert reader.alleles_dropped == 0
+
+
+@pytest.fixture
+def indexed_vcf(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    plain = tmp_path / "sample.vcf"
+    plain.write_text(HEADER + RECORDS)
+    return pysam.tabix_index(str(plain), preset="vcf", force=True)
+
+
+def test_tabix_regions(indexed_vcf):
+    regions = plan_regions(indexed_vcf, window_size=500)
+    assert regions == [("chr1", 1, 500), ("chr1", 501, 1000), ("chr2", 1, 500), ("chr2", 501, 1000)]
+
+    readers = [RegionChunkReader(indexed_vcf, region, chunksize=100) for region in regions]
+    records = pd.concat([chunk for reader in readers for chunk in reader], ignore_index=True)
+    pd.testing.assert_frame_equal(records[VCF_COLUMNS], EXPECTED)
+    assert [reader.records_read for reader in readers] == [3, 0, 1, 1]
+    assert sum(reader.alleles_dropped for reader in readers) == 2
+
+
+def test_regions_are_read_in_chunks(indexed_vcf):
+    reader = RegionChunkReader(indexed_vcf, ("chr1", 1, None), chunksize=2)
+
+    chunks = list(reader)
+
+    # records at 100 and 200 (its <DEL> allele dropped), then the split record at 300
+    assert [chunk["pos"].tolist() for chunk in chunks] == [[100, 200], [300, 300]]
+    assert reader.records_read == 3
+
+
+def test_long_chromosomes_are_split_into_equal_parts(indexed_vcf):
+    assert plan_regions(indexed_vcf, max_region_size=400) == [
+        ("chr1", 1, 334), ("chr1", 335, 668), ("chr1", 669, 1000),
+        ("chr2", 1, 334), ("chr2", 335, 668), ("chr2", 669, 1000)]
+    assert plan_regions(indexed_vcf, max_region_size=1000) == [("chr1", 1, 1000), ("chr2", 1, 1000)]